@@ -1,3 +1,8 @@
+import tempfile
+
+import pytest
+
+from indexer.indexer import indexer5_parallel
 from queryEngine import query_engine, query_engine_dict
 
 
@@ -29,8 +34,27 @@ def test_query_engine_dict(benchmark):
         warmup_rounds=5
     )
 
+
+@pytest.mark.parametrize("workers", [1, 2, 4, 8])
+def test_indexer5_parallel(benchmark, tmp_path, workers):
+    benchmark.extra_info['unit'] = 's'
+    benchmark.extra_info['workers'] = workers
+    book_datamart_folder = "../Books_Datamart"
+
+    def setup():
+        # Every round indexes into an empty folder so all of them do the same work
+        indexer_folder = tempfile.mkdtemp(dir=tmp_path)
+        return (book_datamart_folder, indexer_folder,), {'workers': workers}
+
+    benchmark.pedantic(
+        target=indexer5_parallel,
+        setup=setup,
+        rounds=3,
+        warmup_rounds=0
+    )
+
 # to execute => pytest benchmark.py --benchmark-group-by=func
 # to save results => pytest benchmark.py --benchmark-save indexer_benchmarks
-# to execute memory usage => in query engine module, I added @profile, then execute in there, first uncomment the profile and function call at the enc:
-# python -m memory_profiler query_engine.py
+# to compare the parallel indexer as workers are added => pytest benchmark.py -k indexer5_parallel --benchmark-group-by=func
+# to execute memory usage => python -m benchmark.memory_benchmark, see memory_benchmark.py
 # all of these test, from inside the package
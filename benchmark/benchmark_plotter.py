@@ -11,9 +11,23 @@ def load_json_data(filepath):
         return json.load(file)
 
 
+THROUGHPUT_FIELDS = ['books', 'tokens_per_s', 'mb_per_s', 'peak_rss_mb']
+LATENCY_FIELDS = ['concurrency', 'p50_ms', 'p95_ms', 'p99_ms', 'qps']
+MEMORY_FIELDS = ['peak_traced_mb', 'steady_traced_mb', 'peak_rss_mb', 'steady_rss_mb']
+# tracemalloc slows the traced runs down, so their time is kept apart from the mean time
+TRACED_TIME_FIELDS = ['traced_seconds']
+
+
 def write_csv_data(filepath, benchmarks):
-    """Write benchmarks data to a CSV file."""
+    """
+    Write benchmarks data to a CSV file. Indexing throughput, query latency and memory benchmarks
+    add their own columns.
+    """
     fields_names = ['name', 'mean_time', 'rounds', 'iterations', 'warmup']
+    for marker, fields in [('tokens_per_s', THROUGHPUT_FIELDS), ('p99_ms', LATENCY_FIELDS),
+                           ('peak_traced_mb', TRACED_TIME_FIELDS + MEMORY_FIELDS)]:
+        if any(marker in benchmark.get('extra_info', {}) for benchmark in benchmarks):
+            fields_names += [field for field in fields if field not in fields_names]
 
     with open(filepath, 'w', newline='') as file:
         writer = csv.DictWriter(file, fieldnames=fields_names)
@@ -24,13 +38,21 @@ def write_csv_data(filepath, benchmarks):
 
 def convert_benchmark_to_dict(benchmark):
     """Converts a JSON object to a dictionary."""
-    return {
+    row = {
         'name': benchmark['name'],
         'mean_time': benchmark['stats']['mean'],
         'rounds': benchmark['stats']['rounds'],
         'iterations': benchmark['stats']['iterations'],
         'warmup': benchmark['options']['warmup']
     }
+    extra_info = benchmark.get('extra_info', {})
+    if 'tokens_per_s' in extra_info:
+        row.update({field: extra_info.get(field) for field in THROUGHPUT_FIELDS})
+    if 'p99_ms' in extra_info:
+        row.update({field: extra_info.get(field) for field in LATENCY_FIELDS})
+    if 'peak_traced_mb' in extra_info:
+        row.update({field: extra_info.get(field) for field in TRACED_TIME_FIELDS + MEMORY_FIELDS})
+    return row
 
 
 def load_data(filename):
@@ -61,9 +83,88 @@ def plot_benchmark_data(df):
     plt.show()
 
 
-def main():
-    json_filepath = '0001_indexer_benchmark.json'
-    csv_filepath = '0001_indexer_benchmark.csv'
+def plot_indexing_throughput(df):
+    """Plot how the throughput and the peak RSS of each indexer scale with the number of books."""
+    df = df.copy()
+    df['indexer'] = df['name'].str.split('[').str[0]
+
+    fig, axes = plt.subplots(1, 3, figsize=(15, 5))
+    for column, title, ax in zip(['tokens_per_s', 'mb_per_s', 'peak_rss_mb'],
+                                 ['Throughput (tokens/s)', 'Throughput (MB/s)', 'Peak RSS (MB)'], axes):
+        for indexer, rows in df.groupby('indexer'):
+            rows = rows.sort_values('books')
+            ax.plot(rows['books'], rows[column], marker='o', label=indexer)
+        ax.set_title(title)
+        ax.set_xlabel('Books')
+        ax.set_xscale('log')
+        ax.grid(True)
+        ax.legend()
+
+    plt.tight_layout()
+    plt.show()
+
+
+def plot_latency_percentiles(df):
+    """Plot the latency percentiles and the throughput of each query engine by number of concurrent clients."""
+    df = df.copy()
+    df['engine'] = df['name'].str.split('[').str[0]
+
+    fig, axes = plt.subplots(1, 2, figsize=(12, 5))
+    for engine, rows in df.groupby('engine'):
+        rows = rows.sort_values('concurrency')
+        for column, style in [('p50_ms', '-'), ('p95_ms', '--'), ('p99_ms', ':')]:
+            axes[0].plot(rows['concurrency'], rows[column], style, marker='o', label=f"{engine} {column[:3]}")
+        axes[1].plot(rows['concurrency'], rows['qps'], marker='o', label=engine)
+
+    axes[0].set_title('Latency percentiles')
+    axes[0].set_ylabel('Latency (ms)')
+    axes[1].set_title('Throughput')
+    axes[1].set_ylabel('Queries/s')
+    for ax in axes:
+        ax.set_xlabel('Concurrent clients')
+        ax.grid(True)
+        ax.legend()
+
+    plt.tight_layout()
+    plt.show()
+
+
+def plot_memory_data(df):
+    """Plot the time of each benchmark, without and under tracemalloc, next to its peak and steady-state memory."""
+    fig, (time_ax, memory_ax) = plt.subplots(1, 2, figsize=(15, 6))
+
+    positions = range(len(df))
+    if 'traced_seconds' in df:
+        time_ax.bar([position - 0.2 for position in positions], df['mean_time'], 0.4, color='skyblue',
+                    label='without tracemalloc')
+        time_ax.bar([position + 0.2 for position in positions], df['traced_seconds'], 0.4, color='lightgray',
+                    label='under tracemalloc')
+        time_ax.legend()
+    else:
+        time_ax.bar(list(positions), df['mean_time'], color='skyblue')
+    time_ax.set_xticks(list(positions))
+    time_ax.set_xticklabels(df['name'])
+    time_ax.set_title('Time of Each Benchmark')
+    time_ax.set_ylabel('Time (s)')
+
+    width = 0.2
+    for offset, column in enumerate(MEMORY_FIELDS):
+        memory_ax.bar([position + (offset - 1.5) * width for position in positions], df[column], width,
+                      label=column)
+    memory_ax.set_xticks(list(positions))
+    memory_ax.set_xticklabels(df['name'])
+    memory_ax.set_title('Memory of Each Benchmark')
+    memory_ax.set_ylabel('Memory (MB)')
+    memory_ax.legend()
+
+    for ax in (time_ax, memory_ax):
+        ax.tick_params(axis='x', rotation=45)
+        ax.grid(axis='y')
+    plt.tight_layout()
+    plt.show()
+
+
+def main(json_filepath='0001_indexer_benchmark.json', csv_filepath='0001_indexer_benchmark.csv'):
 
     data = load_json_data(json_filepath)
     benchmarks = data['benchmarks']
@@ -74,6 +175,24 @@ def main():
     df_benchmark = process_numeric_data(df_benchmark, "mean_time")
     plot_benchmark_data(df_benchmark)
 
+    # Results of indexing_benchmark also have the throughput of each indexer by corpus size
+    if 'tokens_per_s' in df_benchmark.columns:
+        for colname in THROUGHPUT_FIELDS:
+            df_benchmark = process_numeric_data(df_benchmark, colname)
+        plot_indexing_throughput(df_benchmark)
+
+    # Results of query_benchmark also have the latency percentiles of each engine by concurrency
+    if 'p99_ms' in df_benchmark.columns:
+        for colname in LATENCY_FIELDS:
+            df_benchmark = process_numeric_data(df_benchmark, colname)
+        plot_latency_percentiles(df_benchmark)
+
+    # Results of memory_benchmark also have the peak and steady-state memory of each run
+    if 'peak_traced_mb' in df_benchmark.columns:
+        for colname in MEMORY_FIELDS + [field for field in TRACED_TIME_FIELDS if field in df_benchmark.columns]:
+            df_benchmark = process_numeric_data(df_benchmark, colname)
+        plot_memory_data(df_benchmark)
+
 
 if __name__ == "__main__":
     main()
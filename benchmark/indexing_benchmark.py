@@ -0,0 +1,191 @@
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from benchmark.synthetic_corpus import generate_corpus
+from indexer.analyzer import STOPWORDS_FILEPATH
+from indexer.indexer import indexer5, indexer5_parallel
+from indexer.indexer_dict import indexer_dict
+from monitoring.logging_config import logging_disabled
+
+try:
+    import resource  # Not available on Windows, where peak RSS is not reported
+except ImportError:
+    resource = None
+
+CORPUS_SIZES = (10, 100, 1000)
+INDEXERS = ('indexer5', 'indexer5_parallel', 'indexer_dict')
+
+
+def peak_rss_mb(who):
+    """
+    Read the peak resident set size of this process or of its finished children.
+
+    :param who: resource.RUSAGE_SELF or resource.RUSAGE_CHILDREN.
+    :return: The peak RSS in MB, or None where the resource module is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if platform.system() == 'Darwin' else peak / 1024
+
+
+def run_indexer(indexer_name, books_directory, workers):
+    """
+    Index a corpus into an empty directory. Runs inside a fresh process, so the peak RSS it reports
+    belongs to this run only.
+
+    :param indexer_name: One of `INDEXERS`.
+    :param books_directory: The directory of the corpus.
+    :param workers: Number of workers of the parallel indexers.
+    :return: A dictionary with the elapsed "seconds", the "peak_rss_mb" of the indexing process and the
+             "peak_children_rss_mb" of its worker processes.
+    """
+    output_directory = tempfile.mkdtemp(prefix='indexing_benchmark_')
+    try:
+        # The indexers log every book they process
+        with logging_disabled():
+            start = time.perf_counter()
+            if indexer_name == 'indexer5':
+                indexer5(books_directory, os.path.join(output_directory, 'words'))
+            elif indexer_name == 'indexer5_parallel':
+                indexer5_parallel(books_directory, os.path.join(output_directory, 'words'), workers=workers)
+            else:
+                indexer_dict(books_directory, os.path.join(output_directory, 'words'),
+                             os.path.join(output_directory, 'metadata'), STOPWORDS_FILEPATH, workers=workers)
+            seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_directory, ignore_errors=True)
+
+    return {
+        "seconds": seconds,
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+        "peak_children_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None
+    }
+
+
+def measure_indexer(indexer_name, books_directory, corpus, rounds=1, workers=None):
+    """
+    Measure the throughput of an indexer on a corpus, in the format of a pytest-benchmark entry.
+
+    :param indexer_name: One of `INDEXERS`.
+    :param books_directory: The directory of the corpus.
+    :param corpus: The description of the corpus returned by `generate_corpus`.
+    :param rounds: Number of times the corpus is indexed, each one from scratch in a new process.
+    :param workers: Number of workers of the parallel indexers. Defaults to the number of CPUs.
+    :return: A dictionary with the "name", "stats", "options" and "extra_info" of the benchmark.
+    """
+    workers = workers or os.cpu_count() or 1
+    runs = []
+    for _ in range(rounds):
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            runs.append(executor.submit(run_indexer, indexer_name, books_directory, workers).result())
+
+    times = [run["seconds"] for run in runs]
+    mean = statistics.mean(times)
+    peaks = [run["peak_rss_mb"] for run in runs if run["peak_rss_mb"] is not None]
+    children_peaks = [run["peak_children_rss_mb"] for run in runs if run["peak_children_rss_mb"] is not None]
+
+    return {
+        "group": "indexing",
+        "name": f"{indexer_name}[{corpus['books']}]",
+        "fullname": f"indexing_benchmark.py::{indexer_name}[{corpus['books']}]",
+        "params": {"books": corpus['books']},
+        "stats": {
+            "min": min(times),
+            "max": max(times),
+            "mean": mean,
+            "stddev": statistics.stdev(times) if len(times) > 1 else 0.0,
+            "rounds": rounds,
+            "iterations": 1,
+            "total": sum(times)
+        },
+        "options": {"warmup": False},
+        "extra_info": {
+            "unit": "s",
+            "indexer": indexer_name,
+            "workers": workers if indexer_name != 'indexer5' else 1,
+            "books": corpus['books'],
+            "tokens": corpus['tokens'],
+            "bytes": corpus['bytes'],
+            "tokens_per_s": corpus['tokens'] / mean,
+            "mb_per_s": corpus['bytes'] / (1024 * 1024) / mean,
+            "peak_rss_mb": max(peaks) if peaks else None,
+            "peak_children_rss_mb": max(children_peaks) if children_peaks else None
+        }
+    }
+
+
+def run_indexing_benchmarks(corpus_directory, output_filepath, sizes=CORPUS_SIZES, indexers=INDEXERS, rounds=1,
+                            workers=None, words_per_book=10000, vocabulary_size=20000):
+    """
+    Generate a synthetic corpus for every size and measure the indexing throughput and peak RSS of
+    every indexer on it. The results are saved in the JSON format of pytest-benchmark, which
+    `benchmark_plotter` reads.
+
+    :param corpus_directory: The directory where the corpora are generated, one subdirectory per size.
+                             Corpora that already exist with the same parameters are reused.
+    :param output_filepath: The JSON file where the results are saved.
+    :param sizes: The numbers of books of the corpora.
+    :param indexers: The indexers to measure, see `INDEXERS`.
+    :param rounds: Number of times each corpus is indexed by each indexer.
+    :param workers: Number of workers of the parallel indexers. Defaults to the number of CPUs.
+    :param words_per_book: The average number of words of a book.
+    :param vocabulary_size: The number of distinct words of the corpora.
+    :return: The results.
+    """
+    benchmarks = []
+    for size in sizes:
+        books_directory = os.path.join(corpus_directory, f"books_{size}")
+        print(f"Generating a corpus of {size} books in '{books_directory}'...")
+        corpus = generate_corpus(books_directory, size, words_per_book, vocabulary_size)
+
+        for indexer_name in indexers:
+            benchmark = measure_indexer(indexer_name, books_directory, corpus, rounds, workers)
+            extra_info = benchmark["extra_info"]
+            peak_rss = "n/a" if extra_info['peak_rss_mb'] is None else f"{extra_info['peak_rss_mb']:.1f} MB"
+            print(f"{benchmark['name']}: {benchmark['stats']['mean']:.2f} s, "
+                  f"{extra_info['tokens_per_s']:.0f} tokens/s, {extra_info['mb_per_s']:.2f} MB/s, peak RSS {peak_rss}")
+            benchmarks.append(benchmark)
+
+    results = {
+        "machine_info": {
+            "node": platform.node(),
+            "processor": platform.processor(),
+            "machine": platform.machine(),
+            "python_implementation": platform.python_implementation(),
+            "python_version": platform.python_version(),
+            "system": platform.system(),
+            "cpu_count": os.cpu_count()
+        },
+        "datetime": datetime.now().isoformat(),
+        "benchmarks": benchmarks
+    }
+
+    output_directory = os.path.dirname(output_filepath)
+    if output_directory:
+        os.makedirs(output_directory, exist_ok=True)
+    with open(output_filepath, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=4)
+    print(f"Results saved in '{output_filepath}'.")
+    return results
+
+
+def main():
+    run_indexing_benchmarks("../Benchmark_Corpus", "benchmark/0002_indexing_throughput.json")
+
+
+if __name__ == "__main__":
+    main()
+
+# to execute => python -m benchmark.indexing_benchmark, from the root of the package
+# to plot the results => from benchmark_plotter, main('0002_indexing_throughput.json', '0002_indexing_throughput.csv')
@@ -0,0 +1,300 @@
+import multiprocessing
+import os
+import platform
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from benchmark.indexing_benchmark import INDEXERS, run_indexer
+from benchmark.query_benchmark import ENGINES, engine_function, generate_query_mix, prepare_indexes, save_results
+from benchmark.synthetic_corpus import generate_corpus
+from indexer.indexer_dict import index_vocabulary_weights
+from monitoring.logging_config import logging_disabled
+
+MEMORY_SIZES = (10, 100)
+SAMPLE_INTERVAL = 0.01
+
+
+def current_rss_mb():
+    """
+    Read the resident set size of this process.
+
+    :return: The RSS in MB, or None on systems without /proc.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            resident_pages = int(file.read().split()[1])
+    except OSError:
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+class RssSampler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        """
+        Initialize a sampler that reads the RSS of this process from a background thread, so short
+        peaks between two measurements are not missed.
+
+        :param interval: Seconds between two samples.
+        """
+        self.interval = interval
+        self.samples = []
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        """
+        Take samples until `stop` is called.
+
+        :return: None
+        """
+        while not self.stop_event.is_set():
+            rss = current_rss_mb()
+            if rss is None:
+                return
+            self.samples.append(rss)
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        """
+        Start sampling.
+
+        :return: None
+        """
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop sampling.
+
+        :return: The peak RSS sampled in MB, or None if the RSS cannot be read.
+        """
+        self.stop_event.set()
+        self.thread.join()
+        return max(self.samples) if self.samples else None
+
+
+def memory_run(target, *args):
+    """
+    Run a function while tracing its memory. Runs inside a fresh process.
+
+    :param target: The function that runs the work, such as `run_indexer`.
+    :param args: The arguments of `target`.
+    :return: A dictionary with the "traced_seconds" elapsed under tracemalloc, which slows the run down,
+             the "peak_traced_mb" and "steady_traced_mb" (Python memory still allocated at the end)
+             measured by tracemalloc, and the "peak_rss_mb" and "steady_rss_mb" of the process.
+    """
+    sampler = RssSampler()
+    tracemalloc.start()
+    sampler.start()
+
+    start = time.perf_counter()
+    target(*args)
+    seconds = time.perf_counter() - start
+
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "traced_seconds": seconds,
+        "peak_traced_mb": peak / (1024 * 1024),
+        "steady_traced_mb": current / (1024 * 1024),
+        "peak_rss_mb": sampler.stop(),
+        "steady_rss_mb": current_rss_mb()
+    }
+
+
+def query_memory_run(engine, books_directory, folders, queries, warmup):
+    """
+    Run a query mix while tracing its memory. Runs inside a fresh process.
+
+    The steady state is the memory held by the warm engine, its caches included, once the warm-up
+    queries have run. The peak is the highest memory reached while the rest of the queries run.
+
+    :param engine: One of `ENGINES`.
+    :param books_directory: The directory of the corpus.
+    :param folders: The index folders returned by `prepare_indexes`.
+    :param queries: The queries to run.
+    :param warmup: Number of queries run before the steady state is measured.
+    :return: A dictionary with the same keys as `memory_run`.
+    """
+    sampler = RssSampler()
+    tracemalloc.start()
+    sampler.start()
+
+    with logging_disabled():
+        search = engine_function(engine, books_directory, folders)
+        for input_query in queries[:warmup]:
+            search(input_query)
+        steady_traced, _ = tracemalloc.get_traced_memory()
+        steady_rss = current_rss_mb()
+        tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        for input_query in queries[warmup:]:
+            search(input_query)
+        seconds = time.perf_counter() - start
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "traced_seconds": seconds,
+        "peak_traced_mb": peak / (1024 * 1024),
+        "steady_traced_mb": steady_traced / (1024 * 1024),
+        "peak_rss_mb": sampler.stop(),
+        "steady_rss_mb": steady_rss
+    }
+
+
+def query_time_run(engine, books_directory, folders, queries, warmup):
+    """
+    Run a query mix without tracing, to time it like `query_memory_run` does under tracemalloc.
+    Runs inside a fresh process.
+
+    :param engine: One of `ENGINES`.
+    :param books_directory: The directory of the corpus.
+    :param folders: The index folders returned by `prepare_indexes`.
+    :param queries: The queries to run.
+    :param warmup: Number of queries run before the timed ones.
+    :return: The elapsed seconds of the queries after the warm-up.
+    """
+    with logging_disabled():
+        search = engine_function(engine, books_directory, folders)
+        for input_query in queries[:warmup]:
+            search(input_query)
+
+        start = time.perf_counter()
+        for input_query in queries[warmup:]:
+            search(input_query)
+        return time.perf_counter() - start
+
+
+def in_fresh_process(function, *args):
+    """
+    Run a function in a newly spawned process, so the memory it reports only belongs to that run.
+
+    :param function: The function to run.
+    :param args: Its arguments.
+    :return: The value returned by the function.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(function, *args).result()
+
+
+def memory_benchmark(group, name, params, run, seconds):
+    """
+    Build a pytest-benchmark entry with the time and the memory of a run.
+
+    :param group: The group of the benchmark, "indexing_memory" or "query_memory".
+    :param name: The name of the benchmark.
+    :param params: The parameters of the benchmark.
+    :param run: The dictionary returned by `memory_run` or `query_memory_run`.
+    :param seconds: The time of the same work in a run without tracemalloc.
+    :return: A dictionary with the "name", "stats", "options" and "extra_info" of the benchmark.
+    """
+    return {
+        "group": group,
+        "name": name,
+        "fullname": f"memory_benchmark.py::{name}",
+        "params": params,
+        "stats": {
+            "min": seconds,
+            "max": seconds,
+            "mean": seconds,
+            "stddev": 0.0,
+            "rounds": 1,
+            "iterations": 1,
+            "total": seconds
+        },
+        "options": {"warmup": False},
+        "extra_info": dict(params, unit="s", **run)
+    }
+
+
+def run_memory_benchmarks(corpus_directory, output_filepath, sizes=MEMORY_SIZES, indexers=INDEXERS,
+                          engines=ENGINES, num_queries=200, warmup=50, workers=None):
+    """
+    Measure the peak and steady-state memory of indexing and querying at several corpus sizes,
+    with tracemalloc (Python allocations of the measured process) and RSS sampling (the whole
+    process, including native memory). The worker processes of the parallel indexers are not included.
+
+    The results are saved in the JSON format of pytest-benchmark, so `benchmark_plotter` charts memory
+    alongside time. tracemalloc slows Python code down several times, so the time of every benchmark
+    comes from a separate run of the same work without it, and the traced time is only kept as
+    "traced_seconds".
+
+    :param corpus_directory: The directory where the synthetic corpora and their indexes are stored.
+    :param output_filepath: The JSON file where the results are saved.
+    :param sizes: The numbers of books of the corpora.
+    :param indexers: The indexers to measure, see `INDEXERS`.
+    :param engines: The query engines to measure, see `ENGINES`.
+    :param num_queries: The number of queries of the generated mix.
+    :param warmup: Number of queries run before the steady state of an engine is measured.
+    :param workers: Number of workers of the parallel indexers. Defaults to the number of CPUs.
+    :return: The results.
+    """
+    workers = workers or os.cpu_count() or 1
+    benchmarks = []
+
+    for size in sizes:
+        books_directory = os.path.join(corpus_directory, f"books_{size}")
+        print(f"Preparing a corpus of {size} books in '{books_directory}'...")
+        generate_corpus(books_directory, size)
+
+        for indexer_name in indexers:
+            run = in_fresh_process(memory_run, run_indexer, indexer_name, books_directory, workers)
+            seconds = in_fresh_process(run_indexer, indexer_name, books_directory, workers)["seconds"]
+            benchmarks.append(memory_benchmark("indexing_memory", f"{indexer_name}[{size}]", {"books": size}, run,
+                                               seconds))
+            print_memory(benchmarks[-1])
+
+        folders = prepare_indexes(books_directory, os.path.join(corpus_directory, f"indexes_{size}"), workers)
+        queries = generate_query_mix(index_vocabulary_weights(folders["dict"]), num_queries + warmup)
+        for engine in engines:
+            run = in_fresh_process(query_memory_run, engine, books_directory, folders, queries, warmup)
+            seconds = in_fresh_process(query_time_run, engine, books_directory, folders, queries, warmup)
+            benchmarks.append(memory_benchmark("query_memory", f"{engine}[{size}]", {"books": size}, run, seconds))
+            print_memory(benchmarks[-1])
+
+    results = {
+        "machine_info": {
+            "node": platform.node(),
+            "python_version": platform.python_version(),
+            "system": platform.system(),
+            "cpu_count": os.cpu_count()
+        },
+        "datetime": datetime.now().isoformat(),
+        "benchmarks": benchmarks
+    }
+    save_results(results, output_filepath)
+    print(f"Results saved in '{output_filepath}'.")
+    return results
+
+
+def print_memory(benchmark):
+    """
+    Print the time and memory of a benchmark.
+
+    :param benchmark: The benchmark entry built by `memory_benchmark`.
+    :return: None
+    """
+    extra_info = benchmark["extra_info"]
+    rss = "n/a" if extra_info["peak_rss_mb"] is None else \
+        f"{extra_info['peak_rss_mb']:.1f} MB peak / {extra_info['steady_rss_mb']:.1f} MB steady"
+    print(f"{benchmark['name']} ({benchmark['group']}): {benchmark['stats']['mean']:.2f} s "
+          f"({extra_info['traced_seconds']:.2f} s under tracemalloc), "
+          f"traced {extra_info['peak_traced_mb']:.1f} MB peak / {extra_info['steady_traced_mb']:.1f} MB steady, "
+          f"RSS {rss}")
+
+
+def main():
+    run_memory_benchmarks("../Benchmark_Corpus", "benchmark/0004_memory.json")
+
+
+if __name__ == "__main__":
+    main()
+
+# to execute => python -m benchmark.memory_benchmark, from the root of the package
+# to plot the results => from benchmark_plotter, main('0004_memory.json', '0004_memory.csv')
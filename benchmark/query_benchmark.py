@@ -0,0 +1,313 @@
+import json
+import os
+import platform
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmark.synthetic_corpus import generate_corpus
+from indexer.analyzer import STOPWORDS_FILEPATH
+from indexer.indexer import indexer5_parallel
+from indexer.indexer_dict import index_vocabulary_weights, indexer_dict
+from monitoring.logging_config import logging_disabled
+from queryEngine import query_engine, query_engine_dict
+from queryEngine.shard_cache import ShardCache
+
+ENGINES = ('query_engine', 'query_engine_dict')
+CONCURRENCY_LEVELS = (1, 4, 16)
+
+# Share of the vocabulary, sorted from the most to the least frequent word, that makes each band
+FREQUENCY_BANDS = {"high": (0.0, 0.01), "medium": (0.01, 0.1), "low": (0.1, 1.0)}
+REGRESSION_TOLERANCE = 0.20
+MIN_QUERIES = 2  # Percentiles and standard deviation need at least two latencies
+
+
+def load_query_file(filepath):
+    """
+    Load the queries of a file, one per line. Empty lines and lines starting with '#' are skipped.
+
+    :param filepath: The path of the query file.
+    :return: A list of queries.
+    """
+    with open(filepath, 'r', encoding='utf-8') as file:
+        return [line.strip() for line in file if line.strip() and not line.startswith('#')]
+
+
+def frequency_bands(word_weights, bands=FREQUENCY_BANDS):
+    """
+    Divide a vocabulary into frequency bands.
+
+    :param word_weights: A dictionary mapping words to their frequency, see `index_vocabulary_weights`.
+    :param bands: A dictionary mapping band names to the (start, end) share of the sorted vocabulary they take.
+    :return: A dictionary mapping band names to their words.
+    """
+    words = sorted(word_weights, key=lambda word: (-word_weights[word], word))
+    return {name: words[int(start * len(words)):max(int(start * len(words)) + 1, int(end * len(words)))]
+            for name, (start, end) in bands.items()}
+
+
+def generate_query_mix(word_weights, num_queries, min_words=1, max_words=5, bands=FREQUENCY_BANDS, seed=0):
+    """
+    Generate queries of `min_words` to `max_words` words, each word drawn from a random frequency band,
+    so the mix has cheap queries on rare words as well as expensive ones on very common words.
+
+    Queries of several words are quoted phrases: `query_engine` looks for unquoted words as a phrase, while
+    `query_engine_dict` ranks them as separate words, so only quotes give both engines the same work.
+
+    :param word_weights: A dictionary mapping words to their frequency, see `index_vocabulary_weights`.
+    :param num_queries: The number of queries.
+    :param min_words: The minimum number of words of a query.
+    :param max_words: The maximum number of words of a query.
+    :param bands: The frequency bands, see `frequency_bands`.
+    :param seed: The seed of the random generator.
+    :return: A list of queries.
+    """
+    rng = random.Random(seed)
+    band_words = {name: words for name, words in frequency_bands(word_weights, bands).items() if words}
+    band_names = sorted(band_words)
+
+    queries = []
+    for _ in range(num_queries):
+        num_words = rng.randint(min_words, max_words)
+        query = ' '.join(rng.choice(band_words[rng.choice(band_names)]) for _ in range(num_words))
+        queries.append(f'"{query}"' if num_words > 1 else query)
+    return queries
+
+
+def prepare_indexes(books_directory, work_directory, workers=None):
+    """
+    Build the indexes of both query engines for a corpus, unless they were built by a previous run.
+
+    :param books_directory: The directory of the corpus.
+    :param work_directory: The directory where the indexes are stored.
+    :param workers: Number of worker processes of the indexers.
+    :return: A dictionary with the "words" folder of indexer5, the "dict" index folder and the "metadata" folder.
+    """
+    folders = {"words": os.path.join(work_directory, 'words'), "dict": os.path.join(work_directory, 'dict'),
+               "metadata": os.path.join(work_directory, 'metadata')}
+    workers = workers or os.cpu_count() or 1
+
+    with logging_disabled():
+        if not os.path.exists(folders["words"]):
+            indexer5_parallel(books_directory, folders["words"], workers=workers)
+        if not os.path.exists(folders["dict"]):
+            indexer_dict(books_directory, folders["dict"], folders["metadata"], STOPWORDS_FILEPATH, workers=workers,
+                         index_format='binary')
+    return folders
+
+
+def engine_function(engine, books_directory, folders):
+    """
+    Build the function that runs a query with one of the engines. The dictionary engine gets a
+    ShardCache shared by all its queries, as in the search engine controller.
+
+    :param engine: One of `ENGINES`.
+    :param books_directory: The directory of the corpus.
+    :param folders: The index folders returned by `prepare_indexes`.
+    :return: A function that takes a query.
+    """
+    if engine == 'query_engine':
+        return lambda input_query: query_engine.query_engine(input_query, books_directory, folders["words"])
+
+    cache = ShardCache(max_entries=64, max_bytes=512 * 1024 * 1024)
+    return lambda input_query: query_engine_dict.query_engine(input_query, folders["dict"], folders["metadata"],
+                                                              books_directory, cache=cache)
+
+
+def run_load(search, queries, concurrency, warmup=0):
+    """
+    Replay queries with `concurrency` clients sending them one after another.
+
+    :param search: A function that runs a query.
+    :param queries: The queries to replay, each one sent once.
+    :param concurrency: The number of concurrent clients.
+    :param warmup: Number of queries sent before measuring.
+    :return: A tuple with the latency of every query in seconds and the elapsed time of the whole run.
+    """
+    for input_query in queries[:warmup]:
+        search(input_query)
+
+    def timed(input_query):
+        start = time.perf_counter()
+        search(input_query)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed, queries))
+    return latencies, time.perf_counter() - start
+
+
+def latency_benchmark(engine, concurrency, latencies, elapsed):
+    """
+    Summarize a run in the format of a pytest-benchmark entry, with its percentiles and throughput.
+
+    :param engine: The engine measured.
+    :param concurrency: The number of concurrent clients.
+    :param latencies: The latency of every query in seconds.
+    :param elapsed: The elapsed time of the whole run in seconds.
+    :return: A dictionary with the "name", "stats", "options" and "extra_info" of the benchmark.
+    """
+    if len(latencies) < MIN_QUERIES:
+        raise ValueError(f"At least {MIN_QUERIES} queries must be measured to summarize a run, got {len(latencies)}.")
+    cut_points = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        "group": "query_latency",
+        "name": f"{engine}[{concurrency}]",
+        "fullname": f"query_benchmark.py::{engine}[{concurrency}]",
+        "params": {"concurrency": concurrency},
+        "stats": {
+            "min": min(latencies),
+            "max": max(latencies),
+            "mean": statistics.mean(latencies),
+            "median": statistics.median(latencies),
+            "stddev": statistics.stdev(latencies),
+            "rounds": len(latencies),
+            "iterations": 1,
+            "total": sum(latencies)
+        },
+        "options": {"warmup": False},
+        "extra_info": {
+            "unit": "s",
+            "engine": engine,
+            "concurrency": concurrency,
+            "queries": len(latencies),
+            "p50_ms": cut_points[49] * 1000,
+            "p95_ms": cut_points[94] * 1000,
+            "p99_ms": cut_points[98] * 1000,
+            "qps": len(latencies) / elapsed
+        }
+    }
+
+
+def compare_with_baseline(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compare the results of a run with a baseline run. Percentiles that grow and QPS that drops by more
+    than `tolerance` are regressions.
+
+    :param results: The results of the run.
+    :param baseline: The results of the baseline run.
+    :param tolerance: The relative change allowed.
+    :return: A list with a description of every regression, empty if there is none.
+    """
+    baseline_benchmarks = {benchmark["name"]: benchmark["extra_info"] for benchmark in baseline["benchmarks"]}
+    regressions = []
+
+    for benchmark in results["benchmarks"]:
+        previous = baseline_benchmarks.get(benchmark["name"])
+        if previous is None:
+            continue
+        current = benchmark["extra_info"]
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{benchmark['name']} {metric}: {previous[metric]:.2f} -> {current[metric]:.2f}")
+        if current['qps'] < previous['qps'] * (1 - tolerance):
+            regressions.append(f"{benchmark['name']} qps: {previous['qps']:.1f} -> {current['qps']:.1f}")
+    return regressions
+
+
+def run_query_benchmarks(corpus_directory, output_filepath, baseline_filepath=None, query_filepath=None,
+                         num_books=100, num_queries=500, concurrency_levels=CONCURRENCY_LEVELS, engines=ENGINES,
+                         warmup=20, tolerance=REGRESSION_TOLERANCE):
+    """
+    Measure the latency percentiles and throughput of the query engines under load, save the results
+    in the JSON format of pytest-benchmark and compare them with a baseline.
+
+    :param corpus_directory: The directory where the synthetic corpus and its indexes are stored.
+                             They are reused by later runs.
+    :param output_filepath: The JSON file where the results are saved.
+    :param baseline_filepath: Optional JSON file with the results of a baseline run. If it does not exist
+                              yet, the results of this run are saved there as the baseline.
+    :param query_filepath: Optional file with the queries to replay. Defaults to a generated mix of
+                           1 to 5 word queries across frequency bands.
+    :param num_books: The number of books of the synthetic corpus.
+    :param num_queries: The number of queries generated, when no query file is given.
+    :param concurrency_levels: The numbers of concurrent clients to measure.
+    :param engines: The engines to measure, see `ENGINES`.
+    :param warmup: Number of queries sent before measuring each run.
+    :param tolerance: The relative change allowed before flagging a regression.
+    :return: A tuple with the results and the list of regressions.
+    """
+    queries = load_query_file(query_filepath) if query_filepath is not None else None
+    num_measured = len(queries) if queries is not None else num_queries
+    if num_measured < MIN_QUERIES:
+        raise ValueError(f"At least {MIN_QUERIES} queries are needed to compute latency percentiles, "
+                         f"got {num_measured}.")
+
+    books_directory = os.path.join(corpus_directory, f"books_{num_books}")
+    print(f"Preparing a corpus of {num_books} books and its indexes in '{corpus_directory}'...")
+    generate_corpus(books_directory, num_books)
+    folders = prepare_indexes(books_directory, os.path.join(corpus_directory, f"indexes_{num_books}"))
+
+    if queries is None:
+        queries = generate_query_mix(index_vocabulary_weights(folders["dict"]), num_queries)
+
+    benchmarks = []
+    for engine in engines:
+        search = engine_function(engine, books_directory, folders)
+        for concurrency in concurrency_levels:
+            # The engines log every word they do not find
+            with logging_disabled():
+                latencies, elapsed = run_load(search, queries, concurrency, warmup)
+            benchmark = latency_benchmark(engine, concurrency, latencies, elapsed)
+            extra_info = benchmark["extra_info"]
+            print(f"{benchmark['name']}: p50 {extra_info['p50_ms']:.2f} ms, p95 {extra_info['p95_ms']:.2f} ms, "
+                  f"p99 {extra_info['p99_ms']:.2f} ms, {extra_info['qps']:.1f} queries/s")
+            benchmarks.append(benchmark)
+
+    results = {
+        "machine_info": {
+            "node": platform.node(),
+            "python_version": platform.python_version(),
+            "system": platform.system(),
+            "cpu_count": os.cpu_count()
+        },
+        "datetime": datetime.now().isoformat(),
+        "queries": query_filepath or f"generated mix of {len(queries)} queries",
+        "benchmarks": benchmarks
+    }
+    save_results(results, output_filepath)
+
+    regressions = []
+    if baseline_filepath is not None:
+        if os.path.exists(baseline_filepath):
+            with open(baseline_filepath, 'r', encoding='utf-8') as file:
+                regressions = compare_with_baseline(results, json.load(file), tolerance)
+            for regression in regressions:
+                print(f"REGRESSION {regression}")
+            if not regressions:
+                print(f"No regressions against '{baseline_filepath}'.")
+        else:
+            save_results(results, baseline_filepath)
+            print(f"Baseline saved in '{baseline_filepath}'.")
+    return results, regressions
+
+
+def save_results(results, filepath):
+    """
+    Save benchmark results to a JSON file.
+
+    :param results: The results.
+    :param filepath: The path of the JSON file.
+    :return: None
+    """
+    directory = os.path.dirname(filepath)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(filepath, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=4)
+
+
+def main():
+    run_query_benchmarks("../Benchmark_Corpus", "benchmark/0003_query_latency.json",
+                         baseline_filepath="benchmark/query_latency_baseline.json")
+
+
+if __name__ == "__main__":
+    main()
+
+# to execute => python -m benchmark.query_benchmark, from the root of the package
+# to replay real queries => run_query_benchmarks(..., query_filepath="queries.txt"), one query per line
+# to plot the results => from benchmark_plotter, main('0003_query_latency.json', '0003_query_latency.csv')
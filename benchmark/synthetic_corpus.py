@@ -0,0 +1,144 @@
+import json
+import os
+import random
+from itertools import accumulate
+
+from indexer.analyzer import get_analyzer
+
+# Kept in a hidden folder, so the indexers do not take it for a book
+CORPUS_FOLDER = '.corpus'
+CORPUS_PARAMETERS_FILENAME = 'corpus.json'
+SYLLABLES = ['ba', 'be', 'bi', 'bo', 'da', 'de', 'di', 'do', 'fa', 'fe', 'ka', 'ke', 'ki', 'la', 'le', 'li', 'lo',
+             'ma', 'me', 'mi', 'mo', 'na', 'ne', 'ni', 'no', 'pa', 'pe', 'ra', 're', 'ri', 'ro', 'sa', 'se', 'si',
+             'ta', 'te', 'ti', 'to', 'va', 've', 'za', 'zo', 'ar', 'el', 'in', 'or', 'un', 'ul']
+
+
+def zipf_vocabulary(size, rng):
+    """
+    Build a vocabulary of made-up words, ordered from the most to the least frequent.
+    The stopwords come first, as they do in real text, so the indexers filter as many tokens as usual.
+
+    :param size: The number of words of the vocabulary, stopwords included.
+    :param rng: The random.Random used to build the words.
+    :return: A list of distinct lowercase words.
+    """
+    vocabulary = sorted(get_analyzer().stopwords)[:size]
+    seen = set(vocabulary)
+
+    while len(vocabulary) < size:
+        word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4)))
+        if word not in seen:
+            seen.add(word)
+            vocabulary.append(word)
+    return vocabulary
+
+
+def zipf_cumulative_weights(size, exponent=1.1):
+    """
+    Compute the cumulative weights of a Zipf distribution, where the word of rank r has weight 1 / r^exponent.
+
+    :param size: The number of words.
+    :param exponent: The exponent of the distribution.
+    :return: A list of cumulative weights, for `random.choices`.
+    """
+    return list(accumulate(1 / rank ** exponent for rank in range(1, size + 1)))
+
+
+def generate_paragraphs(rng, vocabulary, cum_weights, num_words, words_per_paragraph=120):
+    """
+    Generate the paragraphs of a book, made of sentences of words drawn from the Zipf distribution.
+
+    :param rng: The random.Random used to draw the words.
+    :param vocabulary: The vocabulary, see `zipf_vocabulary`.
+    :param cum_weights: The cumulative weights of the vocabulary.
+    :param num_words: The number of words of the book.
+    :param words_per_paragraph: The average number of words of a paragraph.
+    :return: A list of paragraphs.
+    """
+    words = rng.choices(vocabulary, cum_weights=cum_weights, k=num_words)
+    paragraphs = []
+    start = 0
+
+    while start < num_words:
+        end = min(num_words, start + rng.randint(words_per_paragraph // 2, words_per_paragraph * 3 // 2))
+        sentences = []
+        sentence_start = start
+        while sentence_start < end:
+            sentence_end = min(end, sentence_start + rng.randint(5, 25))
+            sentence = ' '.join(words[sentence_start:sentence_end])
+            sentences.append(sentence[0].upper() + sentence[1:] + '.')
+            sentence_start = sentence_end
+        paragraphs.append(' '.join(sentences))
+        start = end
+    return paragraphs
+
+
+def generate_book(rng, vocabulary, cum_weights, book_id, num_words):
+    """
+    Generate the text of a book with the header and footer of a Project Gutenberg eBook.
+
+    :param rng: The random.Random used to draw the words.
+    :param vocabulary: The vocabulary, see `zipf_vocabulary`.
+    :param cum_weights: The cumulative weights of the vocabulary.
+    :param book_id: The ID of the book.
+    :param num_words: The number of words of the book.
+    :return: A tuple with the file name of the book, following the 'Title by Author_id.txt' pattern, and its text.
+    """
+    # Titles and authors only use rare words and no digits, so the ID is the only number of the file name
+    title = ' '.join(rng.choice(vocabulary[-1000:]).capitalize() for _ in range(rng.randint(1, 4)))
+    author = ' '.join(rng.choice(vocabulary[-1000:]).capitalize() for _ in range(2))
+
+    header = [f"The Project Gutenberg eBook of {title}",
+              f"Title: {title}\nAuthor: {author}\nRelease date: January 1, 2000 [eBook #{book_id}]\n"
+              f"Language: English",
+              f"*** START OF THE PROJECT GUTENBERG EBOOK {title.upper()} ***"]
+    footer = [f"*** END OF THE PROJECT GUTENBERG EBOOK {title.upper()} ***"]
+    paragraphs = generate_paragraphs(rng, vocabulary, cum_weights, num_words)
+    return f"{title} by {author}_{book_id}.txt", '\n\n'.join(header + paragraphs + footer) + '\n'
+
+
+def generate_corpus(output_directory, num_books, words_per_book=10000, vocabulary_size=20000, exponent=1.1,
+                    seed=0, first_id=1):
+    """
+    Generate a synthetic corpus of Gutenberg-style books with a Zipfian vocabulary. The same parameters
+    always generate the same corpus, so a directory that already has it is reused.
+
+    :param output_directory: The directory where the books are written.
+    :param num_books: The number of books.
+    :param words_per_book: The average number of words of a book. Books have between half and 1.5 times that.
+    :param vocabulary_size: The number of distinct words, stopwords included.
+    :param exponent: The exponent of the Zipf distribution.
+    :param seed: The seed of the random generator.
+    :param first_id: The ID of the first book.
+    :return: A dictionary with the parameters of the corpus and its number of "books", "tokens" and "bytes".
+    """
+    parameters = {"num_books": num_books, "words_per_book": words_per_book, "vocabulary_size": vocabulary_size,
+                  "exponent": exponent, "seed": seed, "first_id": first_id}
+    parameters_path = os.path.join(output_directory, CORPUS_FOLDER, CORPUS_PARAMETERS_FILENAME)
+    if os.path.exists(parameters_path):
+        with open(parameters_path, 'r', encoding='utf-8') as file:
+            corpus = json.load(file)
+        if all(corpus.get(key) == value for key, value in parameters.items()):
+            return corpus
+        raise ValueError(f"'{output_directory}' holds a corpus generated with other parameters.")
+
+    os.makedirs(os.path.join(output_directory, CORPUS_FOLDER), exist_ok=True)
+    rng = random.Random(seed)
+    vocabulary = zipf_vocabulary(vocabulary_size, rng)
+    cum_weights = zipf_cumulative_weights(vocabulary_size, exponent)
+    tokens = 0
+    total_bytes = 0
+
+    for book_id in range(first_id, first_id + num_books):
+        num_words = rng.randint(words_per_book // 2, words_per_book * 3 // 2)
+        filename, text = generate_book(rng, vocabulary, cum_weights, book_id, num_words)
+        data = text.encode('utf-8')
+        with open(os.path.join(output_directory, filename), 'wb') as file:
+            file.write(data)
+        tokens += num_words
+        total_bytes += len(data)
+
+    corpus = dict(parameters, books=num_books, tokens=tokens, bytes=total_bytes)
+    with open(parameters_path, 'w', encoding='utf-8') as file:
+        json.dump(corpus, file)
+    return corpus
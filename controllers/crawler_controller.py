@@ -1,7 +1,18 @@
+import logging
 import os
 import time
 
-from crawler import crawler
+from crawler.crawl_state import (load_crawl_state, new_crawl_state, next_window, record_probe, rewind_cursor,
+                                 save_crawl_state)
+from crawler.download_engine import MIN_INTERVAL, download_books, probe_books
+from monitoring.logging_config import configure_logging
+
+MISSING_TTL = 30 * 24 * 60 * 60  # Probe known-missing IDs again after 30 days
+MAX_WINDOWS = 8  # Windows probed per call, the next call of `periodic_task` goes on from there
+EMPTY_WINDOW_BACKOFF = 1.0  # Seconds waited after a window without books, doubled for every other one
+MAX_BACKOFF = 30.0
+
+logger = logging.getLogger(__name__)
 
 
 def obtain_last_id(datamart_path):
@@ -30,30 +41,70 @@ def obtain_last_id(datamart_path):
         return 0
 
 
-def downloading_process(datamart_path):
+def downloading_process(datamart_path, books_to_download=3, max_workers=8, probe_window=32,
+                        min_interval=MIN_INTERVAL, max_windows=MAX_WINDOWS):
     """
-    Downloads three books sequentially from Gutenberg starting from the next available ID.
+    Downloads at least `books_to_download` books from Gutenberg starting from the next available ID,
+    probing at most `max_windows` windows of IDs.
 
-    This function checks the specified datamart path to find the last downloaded book ID,
-    then attempts to download the next three books based on that ID.
+    The crawl cursor, the IDs to retry and a negative cache of known-missing IDs are persisted in the
+    datamart, so the directory is only scanned the first time. Windows of IDs after the cursor are
+    checked concurrently with HEAD requests, and only the IDs that exist are downloaded.
+    Every book of the last window that exists is kept.
+
+    The process waits longer after every window without books, and returns early when the server does
+    not answer or when every new ID of a window is missing, which means the cursor went past the last
+    book published. The cursor is then moved back so those IDs are probed again by the next call.
 
     :param datamart_path: The directory where the downloaded books will be saved.
+    :param books_to_download: The number of books to download.
+    :param max_workers: The number of books downloaded at the same time.
+    :param probe_window: The number of IDs checked at the same time.
+    :param min_interval: Minimum number of seconds between the start of two requests to gutenberg.org.
+    :param max_windows: Maximum number of windows probed.
     :return: None
     """
-    last_id = obtain_last_id(datamart_path)
+    state = load_crawl_state(datamart_path)
+    if state is None:
+        state = new_crawl_state(obtain_last_id(datamart_path))
 
     successful_downloads = 0
-
-    while successful_downloads < 3:
-        next_id = last_id + 1
-        last_id += 1
-
-        status = crawler.download_book(next_id, datamart_path)
-
-        if status == 200:
-            successful_downloads += 1
-
-    print("Three books downloaded successfully.")
+    empty_windows = 0
+
+    for window_number in range(max_windows):
+        if successful_downloads >= books_to_download:
+            break
+
+        previous_cursor = state["cursor"]
+        window = next_window(state, probe_window, MISSING_TTL)
+        probes = probe_books(window, max_workers=probe_window, min_interval=min_interval)
+        record_probe(state, {book_id: status for book_id, status in probes.items() if status != 200})
+
+        available = [book_id for book_id in window if probes[book_id] == 200]
+        if available:
+            statuses = download_books(available, datamart_path, max_workers=max_workers, min_interval=min_interval)
+            record_probe(state, statuses)
+            successful_downloads += sum(1 for status in statuses.values() if status == 200)
+
+        new_ids = [book_id for book_id in window if book_id > previous_cursor]
+        past_the_end = bool(new_ids) and all(probes[book_id] == 404 for book_id in new_ids)
+        if past_the_end:
+            rewind_cursor(state, new_ids)
+        save_crawl_state(state, datamart_path)
+
+        if past_the_end:
+            logger.info(f"No books after ID {state['cursor']} yet.")
+            break
+        if all(status is None for status in probes.values()):
+            logger.warning("Gutenberg did not answer, the download is tried again later.")
+            break
+        if available:
+            empty_windows = 0
+        elif window_number + 1 < max_windows:
+            empty_windows += 1
+            time.sleep(min(MAX_BACKOFF, EMPTY_WINDOW_BACKOFF * 2 ** (empty_windows - 1)))
+
+    logger.info(f"{successful_downloads} books downloaded successfully.")
 
 
 def periodic_task(interval, datamart_path):
@@ -69,11 +120,12 @@ def periodic_task(interval, datamart_path):
     """
     while True:
         downloading_process(datamart_path)
-        print(f"Wait {interval} seconds")
+        logger.info(f"Wait {interval} seconds")
         time.sleep(interval)
 
 
 def main():
+    configure_logging()
     sleep_interval = 20
     books_datamart_path = "../Books_Datamart"
     periodic_task(sleep_interval, books_datamart_path)
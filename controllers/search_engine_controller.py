@@ -1,4 +1,7 @@
+from monitoring.logging_config import configure_logging
 from queryEngine.query_engine_dict import query_engine as query_engine_dict
+from queryEngine.result_cache import ResultCache
+from queryEngine.shard_cache import ShardCache
 
 
 def search_engine_controller():
@@ -6,11 +9,19 @@ def search_engine_controller():
     Start the search engine interface for querying words in the indexed books.
 
     This function allows users to input words to search for and displays the results,
-    including book name, author, URL, total occurrences, and relevant paragraphs.
-    The user can exit the search engine by typing 'EXIT'.
+    including book name, author, URL, total occurrences, score, and relevant paragraphs,
+    from the most to the least relevant book.
+    The user can exit the search engine by typing 'EXIT', and see the cache usage by typing 'STATS'.
+
+    Parsed index shards and metadata files are kept in a bounded cache for the whole session,
+    so repeated and related queries do not read them from disk again. The results of whole queries
+    are cached too, until the indexer publishes a new generation, and saved to disk on exit.
 
     :return: None
     """
+    shard_cache = ShardCache(max_entries=64, max_bytes=512 * 1024 * 1024)
+    result_cache = ResultCache(max_bytes=64 * 1024 * 1024, persist_path="../Query_Cache/query_results.json")
+
     print("\nWelcome to the Search Engine!")
     print("If you desire to exit the search engine, type 'EXIT'")
 
@@ -18,10 +29,18 @@ def search_engine_controller():
         user_input = input("\nWhat word/words would you like to look for? ").strip()
 
         if user_input == "EXIT":
+            result_cache.save()
+            print(f"\nCache usage: {shard_cache.stats()}")
+            print(f"Result cache usage: {result_cache.stats()}")
             print("\nSearch Engine Stopped Successfully!\n"
                   "Have a nice day! :)\n")
             break
 
+        if user_input == "STATS":
+            print(f"\nCache usage: {shard_cache.stats()}")
+            print(f"Result cache usage: {result_cache.stats()}")
+            continue
+
         ## Code for JSON structure
         # results = query_engine(user_input)
 
@@ -29,7 +48,8 @@ def search_engine_controller():
         indexer_folder = "../Words_Datamart"
         metadata_datamart_folder = "../Books_Metadata"
         book_datamart_folder = "../Books_Datamart"
-        results = query_engine_dict(user_input, indexer_folder, metadata_datamart_folder, book_datamart_folder)
+        results = query_engine_dict(user_input, indexer_folder, metadata_datamart_folder, book_datamart_folder,
+                                    cache=shard_cache, result_cache=result_cache)
 
         if results:
             print(f"\nResults for '{user_input}':\n")
@@ -38,6 +58,7 @@ def search_engine_controller():
                 print(f"Author: {result['author_name']}")
                 print(f"URL: {result['URL']}")
                 print(f"Total Occurrences: {result['total_occurrences']}")
+                print(f"Score: {result['score']:.3f}")
                 print("Paragraphs:\n")
                 for paragraph in result['paragraphs']:
                     print(f"Paragraph: {paragraph}\n")
@@ -46,6 +67,8 @@ def search_engine_controller():
 
 
 def main():
+    # Only problems are logged, so they do not get mixed with the results
+    configure_logging('WARNING')
     search_engine_controller()
 
 
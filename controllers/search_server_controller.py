@@ -0,0 +1,319 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from urllib.parse import parse_qs, urlsplit
+
+from indexer.index_generation import read_generation
+from monitoring.logging_config import configure_logging
+from monitoring.metrics import format_prometheus, registry
+from queryEngine.query_engine_dict import load_books_catalog, load_index_doc_lengths, search_books
+from queryEngine.result_cache import ResultCache
+from queryEngine.shard_cache import ShardCache
+
+HOST = '127.0.0.1'
+PORT = 8080
+MAX_REQUEST_LINE = 8 * 1024
+MAX_HEADERS = 100
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+logger = logging.getLogger(__name__)
+
+
+async def read_request(reader):
+    """
+    Read the request line and headers of an HTTP/1.1 request. Requests have no body.
+
+    :param reader: The asyncio StreamReader of the connection.
+    :return: A tuple with the method, the target and a dictionary with the lower-cased headers,
+             or None if the client closed the connection.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    if len(request_line) > MAX_REQUEST_LINE:
+        raise ValueError("Request line too long")
+
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ValueError("Malformed request line")
+    method, target, _ = parts
+
+    headers = {}
+    for _ in range(MAX_HEADERS):
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            return method, target, headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    raise ValueError("Too many headers")
+
+
+async def send_json(writer, status, body, keep_alive=True):
+    """
+    Send a JSON response.
+
+    :param writer: The asyncio StreamWriter of the connection.
+    :param status: The HTTP status code.
+    :param body: The JSON serializable body.
+    :param keep_alive: Whether the connection stays open for more requests.
+    :return: None
+    """
+    payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    await send_response(writer, status, payload, 'application/json; charset=utf-8', keep_alive)
+
+
+async def send_response(writer, status, payload, content_type, keep_alive=True):
+    """
+    Send a response.
+
+    :param writer: The asyncio StreamWriter of the connection.
+    :param status: The HTTP status code.
+    :param payload: The body, as bytes.
+    :param content_type: The media type of the body.
+    :param keep_alive: Whether the connection stays open for more requests.
+    :return: None
+    """
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode('latin-1') + payload)
+    await writer.drain()
+
+
+class SearchServer:
+    def __init__(self, index_folder, metadata_folder, book_folder, host=HOST, port=PORT, workers=8,
+                 shard_cache=None, result_cache=None, deadline=None):
+        """
+        Initialize a long-running search server that answers queries over HTTP with JSON results.
+
+        The caches are shared by every client for the whole life of the server, so the index is loaded once
+        and stays warm. The document lengths and the metadata catalog, which every query needs, are kept
+        apart from the shard cache so its evictions never drop them. Queries read shards, metadata and books
+        from disk, so they run in a pool of `workers` threads while the event loop keeps accepting and
+        answering other clients.
+
+        :param index_folder: Directory where the word index files are stored.
+        :param metadata_folder: Directory where the book metadata files are stored.
+        :param book_folder: Directory where the book files are stored.
+        :param host: The address to listen on. Defaults to localhost only.
+        :param port: The port to listen on.
+        :param workers: Number of threads running queries at the same time.
+        :param shard_cache: The ShardCache shared by the queries. A new one is created if not given.
+        :param result_cache: An optional ResultCache shared by the queries.
+        :param deadline: Default time limit of a query in seconds, after which its partial results are returned.
+        """
+        self.index_folder = index_folder
+        self.metadata_folder = metadata_folder
+        self.book_folder = book_folder
+        self.host = host
+        self.port = port
+        self.shard_cache = shard_cache if shard_cache is not None else ShardCache(max_entries=64)
+        self.result_cache = result_cache
+        self.deadline = deadline
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='search')
+        self.requests = 0
+        self.errors = 0
+        self.warm_generation = None
+        self.doc_lengths = None
+        self.catalog = None
+        self.warm_lock = Lock()
+
+    def warm_up(self):
+        """
+        Load the parts of the index every query needs, the document lengths and the metadata catalog,
+        for the current generation of the index.
+
+        :return: None
+        """
+        generation = read_generation(self.index_folder)
+        doc_lengths = load_index_doc_lengths(self.index_folder)
+        catalog = load_books_catalog(self.metadata_folder)
+        with self.warm_lock:
+            self.warm_generation = generation
+            self.doc_lengths = doc_lengths
+            self.catalog = catalog
+
+    def warm_state(self):
+        """
+        Return the document lengths and the metadata catalog, loading them again if the index has
+        published a new generation since they were loaded.
+
+        :return: A tuple with the document lengths and the catalog.
+        """
+        if read_generation(self.index_folder) != self.warm_generation:
+            self.warm_up()
+        with self.warm_lock:
+            return self.doc_lengths, self.catalog
+
+    def search(self, params):
+        """
+        Run a query. Runs in a thread of the pool.
+
+        :param params: The query string parameters: `q`, and optionally `top_k`, `max_occurrences`
+                       and `deadline_ms`.
+        :return: A dictionary with the query, the index generation, the results, whether they are
+                 complete and the time taken.
+        """
+        input_query = params['q']
+        top_k = int(params.get('top_k', 10))
+        max_occurrences = int(params.get('max_occurrences', 3))
+        deadline = float(params['deadline_ms']) / 1000 if 'deadline_ms' in params else self.deadline
+
+        start = time.perf_counter()
+        doc_lengths, catalog = self.warm_state()
+        results, complete = search_books(input_query, self.index_folder, self.metadata_folder, self.book_folder,
+                                         max_occurrences, cache=self.shard_cache, top_k=top_k,
+                                         result_cache=self.result_cache, highlight=False, deadline=deadline,
+                                         catalog=catalog, doc_lengths=doc_lengths)
+        return {
+            "query": input_query,
+            "generation": read_generation(self.index_folder),
+            "results": results,
+            "complete": complete,
+            "took_ms": (time.perf_counter() - start) * 1000
+        }
+
+    def stats(self):
+        """
+        Report the usage of the server and its caches.
+
+        :return: A dictionary with the number of requests and errors and the statistics of the caches.
+        """
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "shard_cache": self.shard_cache.stats(),
+            "result_cache": self.result_cache.stats() if self.result_cache is not None else None
+        }
+
+    async def route(self, method, target):
+        """
+        Answer a request.
+
+        :param method: The HTTP method.
+        :param target: The request target, with its query string.
+        :return: A tuple with the status code and the JSON body, or the text of `/metrics`.
+        """
+        if method != 'GET':
+            return 405, {"error": "Only GET is supported"}
+
+        url = urlsplit(target)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if url.path == '/search':
+            if not params.get('q', '').strip():
+                return 400, {"error": "Missing query parameter 'q'"}
+            try:
+                loop = asyncio.get_running_loop()
+                return 200, await loop.run_in_executor(self.executor, self.search, params)
+            except ValueError as e:
+                return 400, {"error": str(e)}
+        if url.path == '/stats':
+            return 200, self.stats()
+        if url.path == '/metrics':
+            return 200, format_prometheus(registry.snapshot())
+        if url.path == '/health':
+            return 200, {"status": "ok"}
+        return 404, {"error": f"Unknown path '{url.path}'"}
+
+    async def handle_client(self, reader, writer):
+        """
+        Serve the requests of a connection until the client closes it or asks to.
+
+        :param reader: The asyncio StreamReader of the connection.
+        :param writer: The asyncio StreamWriter of the connection.
+        :return: None
+        """
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except ValueError as e:
+                    self.errors += 1
+                    await send_json(writer, 400, {"error": str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                method, target, headers = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                self.requests += 1
+                try:
+                    status, body = await self.route(method, target)
+                except Exception as e:
+                    status, body = 500, {"error": str(e)}
+                if status >= 400:
+                    self.errors += 1
+
+                if isinstance(body, str):
+                    await send_response(writer, status, body.encode('utf-8'), PROMETHEUS_CONTENT_TYPE, keep_alive)
+                else:
+                    await send_json(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, ready=None):
+        """
+        Warm up the index and serve clients until the task is cancelled.
+
+        :param ready: An optional asyncio.Event set once the server is listening.
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.warm_up)
+
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        logger.info(f"Search server listening on http://{self.host}:{self.port}")
+        if ready is not None:
+            ready.set()
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=True)
+            if self.result_cache is not None:
+                self.result_cache.save()
+
+
+def search_server_controller(host=HOST, port=PORT, workers=8):
+    """
+    Start the search engine as a server on localhost.
+
+    Queries are sent as `GET /search?q=...&top_k=10&max_occurrences=3&deadline_ms=500` and answered with the results
+    as JSON, paragraphs without highlighting. `GET /stats` reports the cache usage, `GET /metrics` the
+    query metrics in the Prometheus text format, and `GET /health` can be used to check that the server is up.
+    Stop the server with Ctrl+C.
+
+    :param host: The address to listen on.
+    :param port: The port to listen on.
+    :param workers: Number of threads running queries at the same time.
+    :return: None
+    """
+    shard_cache = ShardCache(max_entries=64, max_bytes=512 * 1024 * 1024)
+    result_cache = ResultCache(max_bytes=64 * 1024 * 1024, persist_path="../Query_Cache/query_results.json")
+    server = SearchServer("../Words_Datamart", "../Books_Metadata", "../Books_Datamart", host, port, workers,
+                          shard_cache, result_cache)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        print("\nSearch Server Stopped Successfully!")
+
+
+def main():
+    configure_logging()
+    search_server_controller()
+
+
+if __name__ == "__main__":
+    main()
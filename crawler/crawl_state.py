@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import time
+
+STATE_FOLDER = '.crawler'
+STATE_FILENAME = 'crawl_state.json'
+MAX_ATTEMPTS = 5  # Failed probes or downloads of an ID before giving up on it
+RETRY_DELAY = 60  # Seconds before the first retry of an ID, doubled after every failed attempt
+
+logger = logging.getLogger(__name__)
+
+
+def crawl_state_path(datamart_path):
+    """
+    Return the path of the crawl state. It lives in a hidden folder of the books datamart,
+    so it is never taken for a book.
+
+    :param datamart_path: The directory where the downloaded books are saved.
+    :return: The path of the crawl state file.
+    """
+    return os.path.join(datamart_path, STATE_FOLDER, STATE_FILENAME)
+
+
+def load_crawl_state(datamart_path):
+    """
+    Load the crawl state: the last ID probed, the IDs to retry and the known-missing IDs.
+
+    :param datamart_path: The directory where the downloaded books are saved.
+    :return: A dictionary with the "cursor", the "retry" IDs (ID -> {"attempts", "retry_at"}) and the
+             "missing" IDs (ID -> time it was found missing), or None if the datamart has never been
+             crawled with a saved state.
+    """
+    filepath = crawl_state_path(datamart_path)
+    if not os.path.exists(filepath):
+        return None
+
+    with open(filepath, 'r', encoding='utf-8') as file:
+        state = json.load(file)
+    state["missing"] = {int(book_id): found_at for book_id, found_at in state["missing"].items()}
+    if isinstance(state["retry"], list):
+        # States saved before the attempts were counted kept a plain list of IDs
+        state["retry"] = {book_id: {"attempts": 0, "retry_at": 0} for book_id in state["retry"]}
+    state["retry"] = {int(book_id): entry for book_id, entry in state["retry"].items()}
+    return state
+
+
+def new_crawl_state(cursor):
+    """
+    Create an empty crawl state.
+
+    :param cursor: The last ID already probed.
+    :return: The crawl state.
+    """
+    return {"cursor": cursor, "retry": {}, "missing": {}}
+
+
+def save_crawl_state(state, datamart_path):
+    """
+    Save the crawl state, replacing the previous file atomically.
+
+    :param state: The crawl state.
+    :param datamart_path: The directory where the downloaded books are saved.
+    :return: None
+    """
+    filepath = crawl_state_path(datamart_path)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    temporary_path = filepath + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump(state, file)
+    os.replace(temporary_path, filepath)
+
+
+def is_known_missing(state, book_id, missing_ttl):
+    """
+    Check the negative cache for a book ID.
+
+    :param state: The crawl state.
+    :param book_id: The ID of the book.
+    :param missing_ttl: Seconds after which a missing ID is probed again, since books can be added later.
+    :return: True if the ID was found missing less than `missing_ttl` seconds ago.
+    """
+    found_at = state["missing"].get(book_id)
+    return found_at is not None and time.time() - found_at < missing_ttl
+
+
+def next_window(state, size, missing_ttl):
+    """
+    Pick the next IDs to probe: first the ones to retry whose backoff has elapsed, then the IDs after
+    the cursor that are not in the negative cache. Retries take at most half of the window, so the
+    cursor keeps moving while some IDs keep failing. The cursor is moved past the IDs picked.
+
+    :param state: The crawl state. Updated in place.
+    :param size: The number of IDs to pick.
+    :param missing_ttl: Seconds after which a missing ID is probed again.
+    :return: A list of book IDs.
+    """
+    now = time.time()
+    # IDs found missing long ago are probed again anyway, so they are not kept forever
+    state["missing"] = {book_id: found_at for book_id, found_at in state["missing"].items()
+                        if now - found_at < missing_ttl}
+    due = sorted(book_id for book_id, entry in state["retry"].items() if entry["retry_at"] <= now)
+    window = due[:size // 2]
+
+    while len(window) < size:
+        state["cursor"] += 1
+        if not is_known_missing(state, state["cursor"], missing_ttl):
+            window.append(state["cursor"])
+    return window
+
+
+def rewind_cursor(state, book_ids):
+    """
+    Move the cursor back before some new IDs that were all missing, since they are most likely past the
+    last book published, and take them out of the negative cache so they are probed again.
+
+    :param state: The crawl state. Updated in place.
+    :param book_ids: The IDs after the cursor probed in the last window.
+    :return: None
+    """
+    state["cursor"] = min(book_ids) - 1
+    for book_id in book_ids:
+        state["missing"].pop(book_id, None)
+
+
+def record_probe(state, statuses, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+    """
+    Update the crawl state with the result of probing or downloading some IDs: missing IDs go to
+    the negative cache, and IDs that failed for any other reason are retried later with an exponential
+    backoff, until they have failed `max_attempts` times.
+
+    :param state: The crawl state. Updated in place.
+    :param statuses: A dictionary mapping book IDs to status codes (None if the request failed).
+    :param max_attempts: The number of failures after which an ID is not retried anymore.
+    :param retry_delay: Seconds before the first retry of an ID, doubled after every failure.
+    :return: None
+    """
+    now = time.time()
+    for book_id, status in statuses.items():
+        if status == 404:
+            state["missing"][book_id] = now
+            state["retry"].pop(book_id, None)
+        elif status != 200:
+            attempts = state["retry"].get(book_id, {"attempts": 0})["attempts"] + 1
+            if attempts >= max_attempts:
+                logger.warning(f"Book {book_id} failed {attempts} times (last status {status}), not retried.")
+                state["retry"].pop(book_id, None)
+            else:
+                state["retry"][book_id] = {"attempts": attempts, "retry_at": now + retry_delay * 2 ** (attempts - 1)}
+        else:
+            state["missing"].pop(book_id, None)
+            state["retry"].pop(book_id, None)
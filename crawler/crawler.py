@@ -1,7 +1,71 @@
+import logging
 import os
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+
+GUTENBERG_URL = "https://www.gutenberg.org"
+
+logger = logging.getLogger(__name__)
+
+
+def book_text_url(book_id, base_url=GUTENBERG_URL):
+    """
+    Build the URL of the plain text of a book.
+
+    :param book_id: The ID of the book.
+    :param base_url: The base URL of the Gutenberg server.
+    :return: The URL of the book's text.
+    """
+    return f'{base_url}/files/{book_id}/{book_id}-0.txt'
+
+
+def book_page_url(book_id, base_url=GUTENBERG_URL):
+    """
+    Build the URL of the HTML page of a book.
+
+    :param book_id: The ID of the book.
+    :param base_url: The base URL of the Gutenberg server.
+    :return: The URL of the book's page.
+    """
+    return f'{base_url}/ebooks/{book_id}'
+
+
+def parse_title(html):
+    """
+    Extract the text of the first <h1> tag of an HTML page. Only <h1> tags are parsed.
+
+    :param html: The HTML of the page.
+    :return: The text of the first <h1> tag, or an indication that there was none.
+    """
+    h1 = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('h1')).find('h1')
+
+    # If found, give back the text
+    if h1:
+        return h1.get_text().strip()
+    else:
+        return "There was no <h1> found."
+
+
+def save_book(content, title, book_id, download_route):
+    """
+    Save the text of a book in the download directory, named after its title and ID.
+
+    :param content: The text of the book.
+    :param title: The title of the book.
+    :param book_id: The ID of the book.
+    :param download_route: The directory where the book will be saved.
+    :return: The path of the saved file.
+    """
+    os.makedirs(download_route, exist_ok=True)
+    file_name = os.path.join(download_route, f'{title}_{book_id}.txt')
+
+    # Save content in file
+    with open(file_name, 'w', encoding='utf-8') as file:
+        file.write(content)
+
+    logger.info(f"Book {book_id} downloaded correctly under {file_name}")
+    return file_name
 
 
 def get_title(url):
@@ -18,16 +82,7 @@ def get_title(url):
         # See if request was successful
         if answer.status_code == 200:
             # Analyze HTML
-            soup = BeautifulSoup(answer.text, 'html.parser')
-
-            # find the first <h1>
-            h1 = soup.find('h1')
-
-            # If found, give back the text
-            if h1:
-                return h1.get_text().strip()
-            else:
-                return "There was no <h1> found."
+            return parse_title(answer.text)
         else:
             return f"Error accessing the page. Status code: {answer.status_code}"
 
@@ -43,7 +98,7 @@ def download_book(book_id, download_route):
     :param download_route: The directory where the downloaded book will be saved.
     :return: None
     """
-    url = f'https://www.gutenberg.org/files/{book_id}/{book_id}-0.txt'
+    url = book_text_url(book_id)
     if not os.path.exists(download_route):
         os.makedirs(download_route)
     answer = requests.get(url)
@@ -53,16 +108,10 @@ def download_book(book_id, download_route):
         content = answer.text
 
         # Call assign_title to find the file name
-        file_name = get_title(f"https://www.gutenberg.org/ebooks/{book_id}")
-        file_name = os.path.join(download_route, f'{file_name}_{book_id}.txt')
-
-        # Save content in file
-        with open(file_name, 'w', encoding='utf-8') as file:
-            file.write(content)
-
-        print(f"Book {book_id} downloaded correctly under {file_name}")
+        title = get_title(book_page_url(book_id))
+        save_book(content, title, book_id, download_route)
     elif answer.status_code == 404:
-        print(f"Book {book_id} not found.")
+        logger.info(f"Book {book_id} not found.")
     else:
-        print(f"Error when downloading Book {book_id}: {answer.status_code}")
+        logger.error(f"Error when downloading Book {book_id}: {answer.status_code}")
     return answer.status_code
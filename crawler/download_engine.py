@@ -0,0 +1,209 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from threading import Condition
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from crawler.crawler import GUTENBERG_URL, book_page_url, book_text_url, parse_title, save_book
+
+# Minimum seconds between the start of two requests to the same host, to be polite with gutenberg.org
+MIN_INTERVAL = 0.25
+
+logger = logging.getLogger(__name__)
+
+
+def create_session(pool_size):
+    """
+    Create an HTTP session that keeps up to `pool_size` connections alive per host.
+
+    :param pool_size: The number of connections kept in the pool.
+    :return: A requests Session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class HostThrottle:
+    def __init__(self, per_host=4, min_interval=MIN_INTERVAL):
+        """
+        Initialize the politeness rules applied to every host.
+
+        :param per_host: Maximum number of requests in flight to the same host.
+        :param min_interval: Minimum number of seconds between the start of two requests to the same host.
+        """
+        self.per_host = per_host
+        self.min_interval = min_interval
+        self.in_flight = {}
+        self.last_start = {}
+        self.condition = Condition()
+
+    @contextmanager
+    def slot(self, url):
+        """
+        Wait until a request to the host of `url` is allowed, and hold the slot while it runs.
+
+        :param url: The URL about to be requested.
+        """
+        host = urlsplit(url).netloc
+        with self.condition:
+            while True:
+                if self.in_flight.get(host, 0) < self.per_host:
+                    delay = self.last_start.get(host, 0.0) + self.min_interval - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self.condition.wait(delay)
+                else:
+                    self.condition.wait()
+            self.in_flight[host] = self.in_flight.get(host, 0) + 1
+            self.last_start[host] = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight[host] -= 1
+                self.condition.notify_all()
+
+
+def fetch(session, throttle, url, method='GET', timeout=30):
+    """
+    Request a URL through the shared session, respecting the host politeness rules.
+
+    :param session: The requests Session.
+    :param throttle: The HostThrottle shared by all the requests.
+    :param url: The URL to request.
+    :param method: The HTTP method.
+    :param timeout: Seconds to wait for the server.
+    :return: The response, or None if the request failed.
+    """
+    with throttle.slot(url):
+        try:
+            return session.request(method, url, timeout=timeout)
+        except requests.RequestException as e:
+            logger.error(f"Error making the request to {url}: {e}")
+            return None
+
+
+def fetch_title(session, throttle, book_id, base_url):
+    """
+    Fetch the title page of a book and extract its title.
+
+    :param session: The requests Session.
+    :param throttle: The HostThrottle shared by all the requests.
+    :param book_id: The ID of the book.
+    :param base_url: The base URL of the Gutenberg server.
+    :return: The title of the book, or an error message if it could not be obtained.
+    """
+    answer = fetch(session, throttle, book_page_url(book_id, base_url))
+    if answer is None:
+        return "Error making the request"
+    if answer.status_code != 200:
+        return f"Error accessing the page. Status code: {answer.status_code}"
+    return parse_title(answer.text)
+
+
+def download_books(book_ids, download_route, base_url=GUTENBERG_URL, max_workers=8, per_host=4,
+                   min_interval=MIN_INTERVAL, session=None):
+    """
+    Download several books concurrently.
+
+    Downloads run as a pipeline over a bounded pool of threads sharing one keep-alive session:
+    as soon as the text of a book arrives, its title page is requested while the texts of the
+    other books are still being fetched, and the book is saved once its title is known. Text
+    requests are submitted as others finish, so title requests never wait behind all of them.
+
+    :param book_ids: The IDs of the books to download.
+    :param download_route: The directory where the downloaded books will be saved.
+    :param base_url: The base URL of the Gutenberg server, replaceable by a local stand-in.
+    :param max_workers: Maximum number of requests in flight.
+    :param per_host: Maximum number of requests in flight to the same host.
+    :param min_interval: Minimum number of seconds between the start of two requests to the same host.
+    :param session: An optional requests Session to reuse; one is created and closed otherwise.
+    :return: A dictionary mapping each book ID to the status code of its text request (None if it failed).
+    """
+    own_session = session is None
+    if own_session:
+        session = create_session(max_workers)
+    throttle = HostThrottle(per_host, min_interval)
+    statuses = {}
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            remaining_ids = iter(book_ids)
+            text_futures = {}
+            title_futures = {}
+            pending = set()
+
+            def submit_next_text():
+                for book_id in remaining_ids:
+                    future = executor.submit(fetch, session, throttle, book_text_url(book_id, base_url))
+                    text_futures[future] = book_id
+                    pending.add(future)
+                    return
+
+            for _ in range(max_workers):
+                submit_next_text()
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                pending.difference_update(done)
+                for future in done:
+                    if future in title_futures:
+                        book_id, content = title_futures.pop(future)
+                        save_book(content, future.result(), book_id, download_route)
+                        continue
+
+                    book_id = text_futures.pop(future)
+                    answer = future.result()
+                    statuses[book_id] = answer.status_code if answer is not None else None
+
+                    if answer is not None and answer.status_code == 200:
+                        title_future = executor.submit(fetch_title, session, throttle, book_id, base_url)
+                        title_futures[title_future] = (book_id, answer.text)
+                        pending.add(title_future)
+                    elif answer is not None and answer.status_code == 404:
+                        logger.info(f"Book {book_id} not found.")
+                    elif answer is not None:
+                        logger.error(f"Error when downloading Book {book_id}: {answer.status_code}")
+                    submit_next_text()
+    finally:
+        if own_session:
+            session.close()
+
+    return statuses
+
+
+def probe_books(book_ids, base_url=GUTENBERG_URL, max_workers=16, per_host=8, min_interval=MIN_INTERVAL,
+                session=None):
+    """
+    Check concurrently which books have a plain text file, using HEAD requests.
+
+    :param book_ids: The IDs of the books to check.
+    :param base_url: The base URL of the Gutenberg server, replaceable by a local stand-in.
+    :param max_workers: Maximum number of requests in flight.
+    :param per_host: Maximum number of requests in flight to the same host.
+    :param min_interval: Minimum number of seconds between the start of two requests to the same host.
+    :param session: An optional requests Session to reuse; one is created and closed otherwise.
+    :return: A dictionary mapping each book ID to the status code of its HEAD request (None if it failed).
+    """
+    own_session = session is None
+    if own_session:
+        session = create_session(max_workers)
+    throttle = HostThrottle(per_host, min_interval)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            answers = executor.map(lambda book_id: fetch(session, throttle, book_text_url(book_id, base_url),
+                                                         method='HEAD'),
+                                   book_ids)
+            return {book_id: answer.status_code if answer is not None else None
+                    for book_id, answer in zip(book_ids, answers)}
+    finally:
+        if own_session:
+            session.close()
@@ -1,10 +1,50 @@
+import struct
+import sys
+from array import array
+
+WORD_MAGIC = b'WRD1'
+WORD_EXTENSION = '.wrd'
+HEADER = struct.Struct('<4sII')  # Magic, length of the name, number of books
+BOOK_HEADER = struct.Struct('<II')  # Book ID, number of positions
+POSITION_TYPE = 'I'
+
+assert array(POSITION_TYPE).itemsize == 4, "Positions are stored as 32-bit unsigned integers"
+
+
+def parse_doc_id(book_key):
+    """
+    Intern a book key as the integer ID of the book.
+
+    :param book_key: A book ID, as an integer or a numeric string, or a 'Title by Author - id' key.
+    :return: The ID of the book as an integer.
+    """
+    if isinstance(book_key, int):
+        return book_key
+    return int(book_key.rsplit(' - ', 1)[-1])
+
+
+def compact_positions(positions):
+    """
+    Store positions in a compact array of 32-bit unsigned integers.
+
+    :param positions: An iterable of positions.
+    :return: An array('I') with the positions.
+    """
+    if isinstance(positions, array) and positions.typecode == POSITION_TYPE:
+        return positions
+    return array(POSITION_TYPE, positions)
+
+
 class Word:
+    __slots__ = ('id_name', 'dictionary')
+
     def __init__(self, id_name, dictionary=None):
         """
         Initialize a Word object.
 
         :param id_name: The name or identifier of the word.
-        :param dictionary: An optional dictionary to hold positions of the word. Defaults to an empty dictionary if not provided.
+        :param dictionary: An optional dictionary mapping integer book IDs to the positions of the word,
+                           as arrays or read-only views. Defaults to an empty dictionary if not provided.
         """
         self.id_name = id_name
         self.dictionary = dictionary if dictionary is not None else {}
@@ -15,11 +55,19 @@ class Word:
 
         :return: A string representation of the Word object.
         """
-        result = f"Word: {self.id_name}\nDictionary:\n"
-        for key, values in self.dictionary.items():
-            values_str = ', '.join(map(str, values))
-            result += f"  {key}: [{values_str}]\n"
-        return result
+        lines = [f"Word: {self.id_name}", "Dictionary:"]
+        lines.extend(f"  {key}: [{', '.join(map(str, values))}]" for key, values in self.dictionary.items())
+        return '\n'.join(lines) + '\n'
+
+    def set_positions(self, book_key, positions):
+        """
+        Replace the positions of the word in a book.
+
+        :param book_key: The ID or key of the book, interned with `parse_doc_id`.
+        :param positions: The positions of the word in the book.
+        :return: None
+        """
+        self.dictionary[parse_doc_id(book_key)] = compact_positions(positions)
 
     def to_dict(self):
         """
@@ -29,18 +77,67 @@ class Word:
         """
         return {
             'id_name': self.id_name,
-            'dictionary': self.dictionary
+            'dictionary': {str(doc_id): list(positions) for doc_id, positions in self.dictionary.items()}
         }
 
     @staticmethod
     def from_dict(data):
         """
-        Create a Word object from a dictionary.
+        Create a Word object from a dictionary. Book keys are interned as integer IDs.
 
         :param data: A dictionary containing the word's id_name and its dictionary.
         :return: A Word object created from the provided dictionary.
         """
         return Word(
             id_name=data['id_name'],
-            dictionary=data['dictionary']
+            dictionary={parse_doc_id(key): compact_positions(positions)
+                        for key, positions in data['dictionary'].items()}
         )
+
+    def to_bytes(self):
+        """
+        Serialize the Word object to its binary form: a header, then for every book its ID, its number of
+        positions and the positions as little-endian 32-bit integers. The position buffers are written as
+        they are, without converting each integer.
+
+        :return: The serialized bytes.
+        """
+        name = self.id_name.encode('utf-8')
+        chunks = [HEADER.pack(WORD_MAGIC, len(name), len(self.dictionary)), name]
+        for doc_id, positions in self.dictionary.items():
+            chunks.append(BOOK_HEADER.pack(doc_id, len(positions)))
+            if sys.byteorder == 'big':
+                positions = compact_positions(positions)
+                positions.byteswap()
+            chunks.append(positions)
+        return b''.join(chunks)
+
+    @staticmethod
+    def from_bytes(data):
+        """
+        Create a Word object from its binary form without copying the positions: every book
+        gets a read-only view over `data`, which has to stay alive while the Word is used.
+
+        :param data: A bytes-like object written by `to_bytes`.
+        :return: A Word object.
+        """
+        view = memoryview(data)
+        magic, name_length, num_books = HEADER.unpack_from(view, 0)
+        if magic != WORD_MAGIC:
+            raise ValueError("Not a binary Word file")
+
+        offset = HEADER.size
+        id_name = bytes(view[offset:offset + name_length]).decode('utf-8')
+        offset += name_length
+
+        dictionary = {}
+        for _ in range(num_books):
+            doc_id, count = BOOK_HEADER.unpack_from(view, offset)
+            offset += BOOK_HEADER.size
+            positions = view[offset:offset + 4 * count].cast(POSITION_TYPE)
+            if sys.byteorder == 'big':
+                positions = compact_positions(positions)
+                positions.byteswap()
+            dictionary[doc_id] = positions
+            offset += 4 * count
+        return Word(id_name, dictionary)
@@ -0,0 +1,345 @@
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+
+MAGIC = b'PST1'
+BINARY_EXTENSION = '.bin'
+
+LEXICON_MAGIC = b'LEX1'
+LEXICON_EXTENSION = '.lex'
+
+logger = logging.getLogger(__name__)
+
+
+def write_varint(value, buffer):
+    """
+    Append a non-negative integer to the buffer using variable-byte encoding (7 bits per byte).
+
+    :param value: The integer to encode.
+    :param buffer: The bytearray where the encoded bytes are appended.
+    :return: None
+    """
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data, offset):
+    """
+    Read a variable-byte encoded integer.
+
+    :param data: A bytes-like object (bytes, memoryview or mmap) containing the encoded integer.
+    :param offset: The position of the first byte of the integer.
+    :return: A tuple with the decoded integer and the offset of the next byte.
+    """
+    result = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
+
+
+def write_positions(positions, buffer):
+    """
+    Append a list of positions as its length followed by the gaps between consecutive positions.
+
+    :param positions: The positions of a word in a book.
+    :param buffer: The bytearray where the encoded bytes are appended.
+    :return: None
+    """
+    write_varint(len(positions), buffer)
+    previous = 0
+    for position in sorted(positions):
+        write_varint(position - previous, buffer)
+        previous = position
+
+
+def read_positions(data, offset):
+    """
+    Read a list of positions written by `write_positions`.
+
+    :param data: A bytes-like object containing the encoded positions.
+    :param offset: The position of the first byte of the list.
+    :return: A tuple with the list of positions and the offset of the next byte.
+    """
+    count, offset = read_varint(data, offset)
+    positions = []
+    position = 0
+    for _ in range(count):
+        gap, offset = read_varint(data, offset)
+        position += gap
+        positions.append(position)
+    return positions, offset
+
+
+def encode_term(term, postings, buffer):
+    """
+    Append the record of a term: the term itself and its postings, with the book IDs
+    in increasing order and delta encoded.
+
+    :param term: The word.
+    :param postings: A dictionary mapping book IDs (numeric strings) to the positions of the word.
+    :param buffer: The bytearray where the encoded bytes are appended.
+    :return: None
+    """
+    term_bytes = term.encode('utf-8')
+    write_varint(len(term_bytes), buffer)
+    buffer.extend(term_bytes)
+
+    write_varint(len(postings), buffer)
+    previous_id = 0
+    for book_id, positions in sorted(postings.items(), key=lambda item: int(item[0])):
+        book_id = int(book_id)
+        write_varint(book_id - previous_id, buffer)
+        write_positions(positions, buffer)
+        previous_id = book_id
+
+
+def decode_term(data, offset):
+    """
+    Read the record of a term written by `encode_term`.
+
+    :param data: A bytes-like object containing the encoded record.
+    :param offset: The position of the first byte of the record.
+    :return: A tuple with the term, its postings ({book ID: [positions]}) and the offset of the next byte.
+    """
+    length, offset = read_varint(data, offset)
+    term = bytes(data[offset:offset + length]).decode('utf-8')
+    offset += length
+
+    num_books, offset = read_varint(data, offset)
+    postings = {}
+    book_id = 0
+    for _ in range(num_books):
+        gap, offset = read_varint(data, offset)
+        book_id += gap
+        postings[str(book_id)], offset = read_positions(data, offset)
+    return term, postings, offset
+
+
+def encode_index_records(index):
+    """
+    Encode a partial indexer into the binary postings format, keeping where each term record starts.
+
+    :param index: A dictionary mapping words to {book ID: [positions]} dictionaries.
+    :return: A tuple with the encoded bytes, the sorted list of terms and the offset of each term record.
+    """
+    buffer = bytearray(MAGIC)
+    write_varint(len(index), buffer)
+    terms = sorted(index)
+    offsets = []
+    for term in terms:
+        offsets.append(len(buffer))
+        encode_term(term, index[term], buffer)
+    return bytes(buffer), terms, offsets
+
+
+def encode_index(index):
+    """
+    Encode a partial indexer into the binary postings format. Terms are stored in sorted order.
+
+    :param index: A dictionary mapping words to {book ID: [positions]} dictionaries.
+    :return: The encoded bytes.
+    """
+    return encode_index_records(index)[0]
+
+
+def decode_index(data):
+    """
+    Decode a partial indexer written by `encode_index`.
+
+    :param data: A bytes-like object with the content of a binary postings file.
+    :return: A dictionary mapping words to {book ID: [positions]} dictionaries.
+    """
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a binary postings file.")
+
+    num_terms, offset = read_varint(data, len(MAGIC))
+    index = {}
+    for _ in range(num_terms):
+        term, postings, offset = decode_term(data, offset)
+        index[term] = postings
+    return index
+
+
+def encode_lexicon(terms, offsets, end):
+    """
+    Encode the term dictionary of a binary postings file.
+
+    Layout: magic, number of terms (uint32), a table with the start of each term inside the term
+    blob (uint32, one extra entry for the end), a table with the start of each term record inside the
+    postings file (uint64, one extra entry for the end) and the blob with the terms in sorted order.
+
+    :param terms: The sorted list of terms.
+    :param offsets: The offset of each term record inside the postings file.
+    :param end: The size of the postings file.
+    :return: The encoded bytes.
+    """
+    term_blob = bytearray()
+    term_offsets = []
+    for term in terms:
+        term_offsets.append(len(term_blob))
+        term_blob.extend(term.encode('utf-8'))
+    term_offsets.append(len(term_blob))
+
+    num_terms = len(terms)
+    return b''.join([
+        LEXICON_MAGIC,
+        struct.pack('<I', num_terms),
+        struct.pack(f'<{num_terms + 1}I', *term_offsets),
+        struct.pack(f'<{num_terms + 1}Q', *offsets, end),
+        bytes(term_blob),
+    ])
+
+
+def lexicon_path_for(filepath):
+    """
+    Return the path of the term dictionary that belongs to a binary postings file.
+
+    :param filepath: The path of the binary postings file.
+    :return: The path of its `.lex` file.
+    """
+    return os.path.splitext(filepath)[0] + LEXICON_EXTENSION
+
+
+def write_binary_index(index, filepath):
+    """
+    Save a partial indexer to a binary postings file and its term dictionary next to it.
+
+    :param index: A dictionary mapping words to {book ID: [positions]} dictionaries.
+    :param filepath: The path of the file to be written.
+    :return: None
+    """
+    data, terms, offsets = encode_index_records(index)
+
+    with open(filepath, 'wb') as file:
+        file.write(data)
+
+    with open(lexicon_path_for(filepath), 'wb') as file:
+        file.write(encode_lexicon(terms, offsets, len(data)))
+
+
+def read_binary_index(filepath):
+    """
+    Load a partial indexer from a binary postings file.
+
+    :param filepath: The path of the binary postings file.
+    :return: A dictionary mapping words to {book ID: [positions]} dictionaries.
+    """
+    with open(filepath, 'rb') as file:
+        return decode_index(file.read())
+
+
+def find_term(lexicon, term):
+    """
+    Binary search a term in a term dictionary.
+
+    :param lexicon: A bytes-like object (usually an mmap) with the content of a `.lex` file.
+    :param term: The term to look for.
+    :return: A tuple with the start and end offsets of the term record in the postings file,
+             or None if the term is not in the dictionary.
+    """
+    if bytes(lexicon[:len(LEXICON_MAGIC)]) != LEXICON_MAGIC:
+        raise ValueError("Not a term dictionary file.")
+
+    num_terms, = struct.unpack_from('<I', lexicon, len(LEXICON_MAGIC))
+    term_table = len(LEXICON_MAGIC) + 4
+    record_table = term_table + 4 * (num_terms + 1)
+    term_blob = record_table + 8 * (num_terms + 1)
+    target = term.encode('utf-8')
+
+    low, high = 0, num_terms
+    while low < high:
+        middle = (low + high) // 2
+        start, end = struct.unpack_from('<2I', lexicon, term_table + 4 * middle)
+        candidate = lexicon[term_blob + start:term_blob + end]
+        if candidate < target:
+            low = middle + 1
+        elif candidate > target:
+            high = middle
+        else:
+            return struct.unpack_from('<2Q', lexicon, record_table + 8 * middle)
+    return None
+
+
+def lookup_term(term, filepath):
+    """
+    Read the postings of a single term from a binary postings file, using its term dictionary.
+    Both files are memory-mapped, so only the pages touched by the binary search and by the
+    term record are read from disk.
+
+    :param term: The term to look for.
+    :param filepath: The path of the binary postings file.
+    :return: A dictionary mapping book IDs to positions, or None if the term is not indexed.
+    """
+    with open(lexicon_path_for(filepath), 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as lexicon:
+            record = find_term(lexicon, term)
+
+    if record is None:
+        return None
+
+    start, end = record
+    with open(filepath, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as postings_file:
+            _, postings, _ = decode_term(postings_file[start:end], 0)
+    return postings
+
+
+def postings_size(postings):
+    """
+    Estimate the memory taken by the postings of a term, for caches that are bounded in bytes:
+    8 bytes for every position and 64 for every book, the cost of the lists and their integers.
+
+    :param postings: A dictionary mapping book IDs to positions, or None.
+    :return: The estimated size in bytes.
+    """
+    if not postings:
+        return 0
+    return 64 * len(postings) + 8 * sum(map(len, postings.values()))
+
+
+def convert_json_shards(index_folder, remove_json=False):
+    """
+    Convert every `indexer_{shard}.json` shard of a folder to the binary postings format.
+
+    :param index_folder: The directory containing the JSON shards.
+    :param remove_json: Delete each JSON shard once its binary version is written.
+    :return: A list with the paths of the binary files written.
+    """
+    converted = []
+
+    for filename in sorted(os.listdir(index_folder)):
+        if not re.match(r'^indexer_.+\.json$', filename):
+            continue
+
+        json_path = os.path.join(index_folder, filename)
+        with open(json_path, 'r', encoding='utf-8') as file:
+            index = json.load(file)
+
+        binary_path = os.path.join(index_folder, filename[:-len('.json')] + BINARY_EXTENSION)
+        write_binary_index(index, binary_path)
+        converted.append(binary_path)
+        logger.info(f"Converted {json_path} -> {binary_path}")
+
+        if remove_json:
+            os.remove(json_path)
+
+    return converted
+
+
+def main():
+    words_directory = "../Words_Datamart_Dict"
+    convert_json_shards(words_directory)
+
+
+if __name__ == "__main__":
+    main()
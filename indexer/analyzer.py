@@ -0,0 +1,71 @@
+import os
+import re
+from functools import lru_cache
+from itertools import filterfalse
+
+from indexer.stopwords_reader import load_stopwords_from_file
+
+STOPWORDS_FILEPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stopwords.txt')
+
+# Letters and digits of any alphabet, joined by inner hyphens, apostrophes or dots ("don't", "u.s.a").
+# Slashes are not joiners, because indexer5 uses every word as a file name.
+TOKEN_PATTERN = r"[^\W_]+(?:[-'.][^\W_]+)*"
+
+
+class Analyzer:
+    def __init__(self, stopwords=(), pattern=TOKEN_PATTERN):
+        """
+        Initialize the text analysis shared by the indexers and the query engines.
+
+        :param stopwords: The words to be filtered out.
+        :param pattern: The regular expression of a token.
+        """
+        self.stopwords = frozenset(stopwords)
+        self.pattern = re.compile(rf"\b{pattern}\b")
+
+    def tokenize(self, text):
+        """
+        Split a text into lowercase tokens, keeping the stopwords.
+
+        :param text: The text to split.
+        :return: The list of tokens in reading order.
+        """
+        return self.pattern.findall(text.lower())
+
+    def analyze(self, text):
+        """
+        Split a whole text into lowercase tokens and filter out the stopwords.
+
+        :param text: The text to analyze, a query or a whole document.
+        :return: The list of words in reading order.
+        """
+        return self.filter(self.pattern.findall(text.lower()))
+
+    def filter(self, tokens):
+        """
+        Filter the stopwords out of a list of tokens.
+
+        :param tokens: The tokens returned by `tokenize`.
+        :return: The list of words in reading order.
+        """
+        return list(filterfalse(self.stopwords.__contains__, tokens))
+
+    def is_stopword(self, word):
+        """
+        Check if a word is filtered out.
+
+        :param word: A lowercase word.
+        :return: True if the word is a stopword.
+        """
+        return word in self.stopwords
+
+
+@lru_cache(maxsize=None)
+def get_analyzer(stopwords_filepath=STOPWORDS_FILEPATH):
+    """
+    Return the analyzer for a stopwords file. The file is read and the pattern compiled only once per process.
+
+    :param stopwords_filepath: The path to the file containing the stopwords.
+    :return: An Analyzer.
+    """
+    return Analyzer(word for word in load_stopwords_from_file(stopwords_filepath) if word)
@@ -1,8 +1,187 @@
+import codecs
 import json
+import logging
 import os
 import re
+import time
 
-from indexer.stopwords_reader import load_stopwords_from_file
+from indexer.analyzer import get_analyzer
+from monitoring.metrics import NULL_TIMER
+
+logger = logging.getLogger(__name__)
+
+ENCODINGS = ['utf-8', 'utf-8-sig', 'windows-1252', 'latin1']
+PARAGRAPH_SEPARATOR = re.compile(rb'\r?\n\r?\n')
+CHUNK_SIZE = 1024 * 1024
+ENCODING_PREFIX_SIZE = 64 * 1024
+
+
+def detect_encoding(filepath, prefix_size=ENCODING_PREFIX_SIZE):
+    """
+    Detect the encoding of a TXT file from its first bytes. This is only a guess for the rest of
+    the file, see `fallback_encoding`.
+
+    :param filepath: The path to the TXT file.
+    :param prefix_size: The number of bytes inspected.
+    :return: The first encoding of `ENCODINGS` that decodes the prefix.
+    """
+    with open(filepath, 'rb') as file:
+        prefix = file.read(prefix_size)
+
+    for encoding in ENCODINGS:
+        try:
+            # A character cut at the end of the prefix is not an error
+            codecs.getincrementaldecoder(encoding)().decode(prefix, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            logger.debug(f"Error decoding {filepath} with {encoding}, trying next...")
+    return ENCODINGS[-1]
+
+
+def fallback_encoding(paragraph, encoding):
+    """
+    Detect the encoding again when a paragraph found after the prefix does not decode with the guessed one.
+
+    :param paragraph: The bytes that failed to decode.
+    :param encoding: The encoding guessed so far.
+    :return: The first encoding after `encoding` in `ENCODINGS` that decodes the paragraph.
+    """
+    for candidate in ENCODINGS[ENCODINGS.index(encoding) + 1:] if encoding in ENCODINGS else ENCODINGS:
+        try:
+            paragraph.decode(candidate)
+            return candidate
+        except UnicodeDecodeError:
+            continue
+    return ENCODINGS[-1]
+
+
+def last_break(buffer):
+    """
+    Find the last whitespace byte of a buffer, where it can be cut without splitting a word or a character.
+
+    :param buffer: The bytes to inspect.
+    :return: The index of the last space, tab or newline, or -1 if there is none.
+    """
+    return max(buffer.rfind(b' '), buffer.rfind(b'\n'), buffer.rfind(b'\t'))
+
+
+def last_character_start(buffer):
+    """
+    Find where the last character of a buffer starts, to cut it without whitespace and without
+    splitting a UTF-8 sequence. With single-byte encodings, at most 3 whole characters are left out.
+
+    :param buffer: The bytes to inspect.
+    :return: The index of the first byte of the last character.
+    """
+    cut = len(buffer) - 1
+    while cut > 0 and len(buffer) - cut < 4 and buffer[cut] & 0xC0 == 0x80:
+        cut -= 1
+    return cut
+
+
+def iter_paragraphs(filepath, chunk_size=CHUNK_SIZE, timer=NULL_TIMER):
+    """
+    Read a TXT file in fixed-size chunks and yield its paragraphs, separated by blank lines.
+
+    Only the paragraph being completed is kept between chunks. A paragraph longer than `chunk_size`
+    is cut at its last whitespace, or before its last character if it has none, so memory stays
+    bounded whatever the size of the file.
+
+    :param filepath: The path to the TXT file.
+    :param chunk_size: The number of bytes read at a time.
+    :param timer: A StageTimer where the time spent reading the file is added to the "read" stage.
+    :return: A generator of (byte start, byte end, bytes) tuples.
+    """
+    buffer = b''
+    offset = 0  # Position of the buffer inside the file
+
+    with open(filepath, 'rb') as file:
+        while True:
+            start_time = time.perf_counter()
+            chunk = file.read(chunk_size)
+            timer.add('read', time.perf_counter() - start_time)
+            buffer += chunk
+
+            start = 0
+            for separator in PARAGRAPH_SEPARATOR.finditer(buffer):
+                if chunk and separator.end() == len(buffer):
+                    break  # The separator may go on in the next chunk
+                yield offset + start, offset + separator.start(), buffer[start:separator.start()]
+                start = separator.end()
+
+            if not chunk:
+                yield offset + start, offset + len(buffer), buffer[start:]
+                return
+
+            if len(buffer) - start > chunk_size:
+                cut = last_break(buffer)
+                if cut <= start:
+                    cut = last_character_start(buffer)
+                if cut <= start:
+                    cut = len(buffer)
+                yield offset + start, offset + cut, buffer[start:cut]
+                start = cut
+
+            buffer = buffer[start:]
+            offset += start
+
+
+def iter_paragraph_words(filepath, analyzer, encoding=None, chunk_size=CHUNK_SIZE, timer=NULL_TIMER):
+    """
+    Tokenize a TXT file paragraph by paragraph, filtering out stopwords.
+
+    The encoding is guessed from the beginning of the file. When a paragraph further on does not
+    decode with it, it is detected again from that paragraph and used from there on, without
+    decoding the previous paragraphs again.
+
+    :param filepath: The path to the TXT file.
+    :param analyzer: The Analyzer that splits the text into words.
+    :param encoding: The encoding of the file. Detected from its first bytes if not given.
+    :param chunk_size: The number of bytes read at a time.
+    :param timer: A StageTimer where the time spent in the "read", "decode", "tokenize" and "filter" stages is added.
+    :return: A generator of (byte start, byte end, words, encoding) tuples, for the paragraphs with at least
+             one word. The encoding is the one used so far, which can change along the file.
+    """
+    if encoding is None:
+        encoding = detect_encoding(filepath)
+
+    for start, end, paragraph in iter_paragraphs(filepath, chunk_size, timer):
+        decode_start = time.perf_counter()
+        try:
+            text = paragraph.decode(encoding)
+        except UnicodeDecodeError:
+            detected = fallback_encoding(paragraph, encoding)
+            logger.info(f"{filepath} is not {encoding} at byte {start}, reading it as {detected}.")
+            encoding = detected
+            text = paragraph.decode(encoding, errors='replace')
+        tokenize_start = time.perf_counter()
+        tokens = analyzer.tokenize(text)
+        filter_start = time.perf_counter()
+        words = analyzer.filter(tokens)
+        filter_end = time.perf_counter()
+
+        timer.add('decode', tokenize_start - decode_start)
+        timer.add('tokenize', filter_start - tokenize_start)
+        timer.add('filter', filter_end - filter_start)
+        if words:
+            yield start, end, words, encoding
+
+
+def iter_words(filepath, analyzer, encoding=None, chunk_size=CHUNK_SIZE):
+    """
+    Stream the words of a TXT file with their positions, filtering out stopwords.
+
+    :param filepath: The path to the TXT file.
+    :param analyzer: The Analyzer that splits the text into words.
+    :param encoding: The encoding of the file. Detected from its first bytes if not given.
+    :param chunk_size: The number of bytes read at a time.
+    :return: A generator of (position, word) tuples. Positions count only the words kept.
+    """
+    position = 0
+    for _, _, words, _ in iter_paragraph_words(filepath, analyzer, encoding, chunk_size):
+        for word in words:
+            yield position, word
+            position += 1
 
 
 def read_words(filepath, stopwords_filepath):
@@ -13,31 +192,45 @@ def read_words(filepath, stopwords_filepath):
     :param stopwords_filepath: The path to the file containing stopwords to be filtered out.
     :return: A list of words extracted from the file, excluding any stopwords.
     """
+    analyzer = get_analyzer(stopwords_filepath)
 
-    words = []
-    encodings = ['utf-8', 'utf-8-sig', 'windows-1252', 'latin1']
+    try:
+        return [word for _, word in iter_words(filepath, analyzer)]
+    except FileNotFoundError:
+        logger.error(f"File {filepath} not found.")
+        return []
 
-    stopwords = load_stopwords_from_file(stopwords_filepath)
 
-    for encoding in encodings:
-        try:
-            with open(filepath, 'r', encoding=encoding) as file:
-                content = file.read()
-                words = re.findall(r"\b[a-zA-Z0-9]+(?:[-'/.][a-zA-Z0-9]+)*\b", content.lower())
-                filtered_words = [word for word in words if word not in stopwords]
-                return filtered_words
-        except UnicodeDecodeError:
-            print(f"Error decoding with {encoding}, trying next...")
-            continue
-        except FileNotFoundError:
-            print(f"Error: File {filepath} not found.")
-            return words
-        except Exception as e:
-            print(f"Error: {e}")
-            return words
+def read_words_and_paragraphs(filepath, stopwords_filepath, timer=NULL_TIMER):
+    """
+    Extract the words of a TXT file, like `read_words`, together with its paragraph table.
+
+    The file is split into paragraphs on blank lines. For every paragraph with at least one word,
+    the table keeps its byte offsets in the file and the position of its first word, so the
+    paragraphs containing a match can later be read without loading the whole book.
+
+    :param filepath: The path to the TXT file from which to extract words.
+    :param stopwords_filepath: The path to the file containing stopwords to be filtered out.
+    :param timer: A StageTimer where the time spent in the "read", "decode", "tokenize" and "filter" stages is added.
+    :return: A tuple with the list of words and the paragraph table (a dictionary with the "encoding"
+             of the file and its "paragraphs" as [byte start, byte end, first word position] entries).
+             The encoding is the last one detected while reading, see `iter_paragraph_words`, and
+             readers still decode tolerantly since a file can mix several.
+    """
+    analyzer = get_analyzer(stopwords_filepath)
+    words = []
+    paragraphs = []
+
+    try:
+        encoding = detect_encoding(filepath)
+        for start, end, paragraph_words, encoding in iter_paragraph_words(filepath, analyzer, encoding, timer=timer):
+            paragraphs.append([start, end, len(words)])
+            words.extend(paragraph_words)
+    except FileNotFoundError:
+        logger.error(f"File {filepath} not found.")
+        return [], None
 
-    print("Error: Could not decode the file with any of the attempted encodings.")
-    return words
+    return words, {"encoding": encoding, "paragraphs": paragraphs}
 
 
 def read_metadata(filepath):
@@ -72,7 +265,7 @@ def save_metadata_to_json(filepath, output_directory):
     # Read metadata from the book
     metadata = read_metadata(filepath)
     if not metadata:
-        print(f"File '{filepath}' is invalid.")
+        logger.warning(f"File '{filepath}' is invalid.")
         return
 
     # Create output directory if it does not exist
@@ -93,7 +286,7 @@ def save_metadata_to_json(filepath, output_directory):
 
     # Check if the book is already in the JSON data
     if any(book['id_book'] == id_book for book in books_data):
-        print(f"Metadata for '{metadata['book_name']}' already exists. Skipping save.")
+        logger.info(f"Metadata for '{metadata['book_name']}' already exists. Skipping save.")
         return
 
     # Add new metadata to the existing JSON data
@@ -103,4 +296,4 @@ def save_metadata_to_json(filepath, output_directory):
     with open(json_filepath, 'w', encoding='utf-8') as json_file:  # Ensure UTF-8 encoding
         json.dump(books_data, json_file, ensure_ascii=False, indent=4)
 
-    print(f"Metadata for '{metadata['book_name']}' saved to '{json_filepath}'.")
+    logger.info(f"Metadata for '{metadata['book_name']}' saved to '{json_filepath}'.")
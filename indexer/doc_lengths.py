@@ -0,0 +1,49 @@
+import json
+import os
+
+DOC_LENGTHS_FILENAME = 'doc_lengths.json'
+
+
+def doc_lengths_path(words_datamart):
+    """
+    Return the path of the document lengths of an index.
+
+    :param words_datamart: The directory where the index is stored.
+    :return: The path of the document lengths file.
+    """
+    return os.path.join(words_datamart, DOC_LENGTHS_FILENAME)
+
+
+def load_doc_lengths(words_datamart):
+    """
+    Load the number of indexed words of every book, used to normalize scores at query time.
+
+    :param words_datamart: The directory where the index is stored.
+    :return: A dictionary mapping book IDs to their number of words, or an empty dictionary
+             if the index was built without document lengths.
+    """
+    filepath = doc_lengths_path(words_datamart)
+    if not os.path.exists(filepath):
+        return {}
+    with open(filepath, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_doc_lengths(doc_lengths, words_datamart, replace=False):
+    """
+    Save the number of indexed words of some books, replacing the file atomically.
+
+    :param doc_lengths: A dictionary mapping book IDs to their number of words.
+    :param words_datamart: The directory where the index is stored.
+    :param replace: If True, the saved lengths are dropped instead of being updated.
+    :return: None
+    """
+    if not replace:
+        doc_lengths = {**load_doc_lengths(words_datamart), **doc_lengths}
+
+    os.makedirs(words_datamart, exist_ok=True)
+    filepath = doc_lengths_path(words_datamart)
+    temporary_path = filepath + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump(doc_lengths, file)
+    os.replace(temporary_path, filepath)
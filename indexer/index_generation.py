@@ -0,0 +1,47 @@
+import json
+import os
+import time
+
+GENERATION_FILENAME = 'index_generation.json'
+
+
+def generation_path(words_datamart):
+    """
+    Return the path of the generation file of an index.
+
+    :param words_datamart: The directory where the index is stored.
+    :return: The path of the generation file.
+    """
+    return os.path.join(words_datamart, GENERATION_FILENAME)
+
+
+def read_generation(words_datamart):
+    """
+    Read the current generation of an index.
+
+    :param words_datamart: The directory where the index is stored.
+    :return: The generation number, 0 if the index has never published one.
+    """
+    filepath = generation_path(words_datamart)
+    if not os.path.exists(filepath):
+        return 0
+    with open(filepath, 'r', encoding='utf-8') as file:
+        return json.load(file)["generation"]
+
+
+def publish_generation(words_datamart):
+    """
+    Announce that an indexing run has finished writing the index, so the results cached
+    for the previous generation are no longer served. The file is replaced atomically.
+
+    :param words_datamart: The directory where the index is stored.
+    :return: The new generation number.
+    """
+    generation = read_generation(words_datamart) + 1
+    os.makedirs(words_datamart, exist_ok=True)
+    filepath = generation_path(words_datamart)
+    temporary_path = filepath + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump({"generation": generation, "published_at": time.time()}, file)
+    os.replace(temporary_path, filepath)
+    return generation
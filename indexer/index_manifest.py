@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+
+MANIFEST_FILENAME = 'index_manifest.json'
+
+
+def manifest_path(words_datamart):
+    """
+    Return the path of the manifest of an index.
+
+    :param words_datamart: The directory where the index is stored.
+    :return: The path of the manifest file.
+    """
+    return os.path.join(words_datamart, MANIFEST_FILENAME)
+
+
+def load_manifest(words_datamart):
+    """
+    Load the manifest of the books already indexed.
+
+    :param words_datamart: The directory where the index is stored.
+    :return: A dictionary mapping book file names to their "mtime_ns", "size" and "sha256",
+             or an empty dictionary if nothing has been indexed yet.
+    """
+    filepath = manifest_path(words_datamart)
+    if not os.path.exists(filepath):
+        return {}
+    with open(filepath, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_manifest(manifest, words_datamart):
+    """
+    Save the manifest of the books already indexed. The file is replaced atomically,
+    so an interrupted run never leaves a half-written manifest.
+
+    :param manifest: The manifest, as returned by `load_manifest`.
+    :param words_datamart: The directory where the index is stored.
+    :return: None
+    """
+    os.makedirs(words_datamart, exist_ok=True)
+    filepath = manifest_path(words_datamart)
+    temporary_path = filepath + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=4)
+    os.replace(temporary_path, filepath)
+
+
+def file_hash(filepath):
+    """
+    Compute the SHA-256 of a file, reading it in blocks.
+
+    :param filepath: The path of the file.
+    :return: The hexadecimal digest.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def select_books_to_index(filepaths, manifest):
+    """
+    Compare the books with the manifest and keep only the new or changed ones.
+
+    A book whose modification time and size match the manifest is skipped without reading it.
+    If only the modification time changed, the content hash decides, and the manifest entry
+    is refreshed when the content is the same.
+
+    :param filepaths: The paths of the book files.
+    :param manifest: The manifest, as returned by `load_manifest`. Updated in place for books
+                     that were touched but not changed.
+    :return: A tuple with the list of paths to index and the set of their file names that
+             were already indexed before (changed books).
+    """
+    to_index = []
+    changed = set()
+
+    for filepath in filepaths:
+        filename = os.path.basename(str(filepath))
+        stat = os.stat(filepath)
+        entry = manifest.get(filename)
+
+        if entry is not None:
+            if entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                continue
+            if entry["size"] == stat.st_size and entry["sha256"] == file_hash(filepath):
+                entry["mtime_ns"] = stat.st_mtime_ns
+                continue
+            changed.add(filename)
+
+        to_index.append(filepath)
+
+    return to_index, changed
+
+
+def record_books(manifest, filepaths):
+    """
+    Add the books just indexed to the manifest.
+
+    :param manifest: The manifest, as returned by `load_manifest`.
+    :param filepaths: The paths of the book files that were indexed.
+    :return: The updated manifest.
+    """
+    for filepath in filepaths:
+        stat = os.stat(filepath)
+        manifest[os.path.basename(str(filepath))] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": file_hash(filepath)
+        }
+    return manifest
@@ -1,131 +1,385 @@
 import json
+import logging
 import os
 import re
-from concurrent.futures import ThreadPoolExecutor
+import time
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from threading import Lock
 
-from data_model.object_type.Word import Word
+from data_model.object_type.Word import POSITION_TYPE, WORD_EXTENSION, Word, parse_doc_id
+from indexer.analyzer import get_analyzer
+from indexer.index_generation import publish_generation
+from indexer.index_manifest import load_manifest, record_books, save_manifest, select_books_to_index
+from monitoring.metrics import (INDEXING_STAGE_SECONDS, NULL_TIMER, StageTimer, increment, registry, reset_metrics,
+                                run_and_collect)
 
+DOC_TABLE_FILENAME = 'doc_table.json'
 
-def indexer5(datamart_txt_path, datamart_json_path):
+logger = logging.getLogger(__name__)
+
+
+def extract_words(content, timer=NULL_TIMER):
+    """
+    Split the content of a book into lowercase words, skipping stop words.
+
+    :param content: The text of the book.
+    :param timer: A StageTimer where the time spent in the "tokenize" and "filter" stages is added.
+    :return: The list of words of the book in reading order.
+    """
+    analyzer = get_analyzer()
+    with timer.stage('tokenize'):
+        tokens = analyzer.tokenize(content)
+    with timer.stage('filter'):
+        return analyzer.filter(tokens)
+
+
+def read_book(txt_file_path, timer=NULL_TIMER):
+    """
+    Read the text of a book.
+
+    :param txt_file_path: Path to the TXT file of the book.
+    :param timer: A StageTimer where the time spent in the "read" and "decode" stages is added.
+    :return: The text of the book.
+    """
+    with timer.stage('read'):
+        with open(txt_file_path, 'rb') as file:
+            data = file.read()
+    increment('indexed_bytes_total', len(data), **timer.labels)
+    with timer.stage('decode'):
+        return data.decode('utf-8')
+
+
+def load_doc_table(datamart_json_path):
+    """
+    Load the table that maps the integer book IDs used in the Word files to the book keys.
+
+    :param datamart_json_path: Path to the directory where the Word files are stored.
+    :return: A dictionary mapping book IDs (as strings) to 'Title by Author - id' keys.
+    """
+    doc_table_path = os.path.join(datamart_json_path, DOC_TABLE_FILENAME)
+    if not os.path.exists(doc_table_path):
+        return {}
+    with open(doc_table_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def update_doc_table(dictionary_keys, datamart_json_path):
+    """
+    Add the keys of the books just indexed to the doc table, replacing the file atomically.
+
+    :param dictionary_keys: The 'Title by Author - id' keys of the books.
+    :param datamart_json_path: Path to the directory where the Word files are stored.
+    :return: None
+    """
+    doc_table = load_doc_table(datamart_json_path)
+    doc_table.update((str(parse_doc_id(key)), key) for key in dictionary_keys)
+
+    doc_table_path = os.path.join(datamart_json_path, DOC_TABLE_FILENAME)
+    temporary_path = doc_table_path + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump(doc_table, file, ensure_ascii=False)
+    os.replace(temporary_path, doc_table_path)
+
+
+def migrate_word_files(datamart_json_path):
+    """
+    Convert the JSON Word files written by older versions to the binary form of `Word.to_bytes`,
+    adding their book keys to the doc table.
+
+    :param datamart_json_path: Path to the directory where the Word files are stored.
+    :return: The number of files converted.
+    """
+    dictionary_keys = set()
+    converted = 0
+
+    for filename in os.listdir(datamart_json_path):
+        # Words never contain '_', unlike the other JSON files of the index
+        if not filename.endswith('.json') or '_' in filename:
+            continue
+        json_file_path = os.path.join(datamart_json_path, filename)
+        with open(json_file_path, 'r', encoding='utf-8') as json_file:
+            data = json.load(json_file)
+        if "id_name" not in data or "dictionary" not in data:
+            continue
+
+        dictionary_keys.update(data["dictionary"])
+        word_file_path = os.path.join(datamart_json_path, f"{data['id_name']}{WORD_EXTENSION}")
+        with open(word_file_path, 'wb') as word_file:
+            word_file.write(Word.from_dict(data).to_bytes())
+        os.remove(json_file_path)
+        converted += 1
+
+    if dictionary_keys:
+        update_doc_table(dictionary_keys, datamart_json_path)
+    return converted
+
+
+def merge_word_file(word, postings, datamart_json_path, timer=NULL_TIMER):
+    """
+    Merge the buffered postings of a word into its Word file with a single read and a single write.
+    The buffer holds every position of a book, so the positions it has for a book replace the stored
+    ones and indexing the same book again does not duplicate them.
+
+    :param word: The word whose file is updated.
+    :param postings: A dictionary mapping book IDs to the positions collected for the word.
+    :param datamart_json_path: Path to the directory where the Word files are stored.
+    :param timer: A StageTimer where the time spent in the "merge" and "serialize" stages is added.
+    :return: None
+    """
+    word_file_path = os.path.join(datamart_json_path, f"{word}{WORD_EXTENSION}")
+    merge_start = time.perf_counter()
+
+    if os.path.exists(word_file_path):
+        # Load the Word object that exists
+        with open(word_file_path, 'rb') as word_file:
+            word_obj = Word.from_bytes(word_file.read())
+    else:
+        # Create a new Word object
+        word_obj = Word(id_name=word, dictionary={})
+
+    for doc_id, positions in postings.items():
+        word_obj.set_positions(doc_id, positions)
+    serialize_start = time.perf_counter()
+
+    # Save the updated Word object in its binary form
+    with open(word_file_path, 'wb') as word_file:
+        word_file.write(word_obj.to_bytes())
+
+    timer.add('merge', serialize_start - merge_start)
+    timer.add('serialize', time.perf_counter() - serialize_start)
+
+
+def flush_word_buffer(word_buffer, datamart_json_path, timer=NULL_TIMER):
+    """
+    Write every word collected in the buffer to its Word file and empty the buffer.
+
+    :param word_buffer: A dictionary mapping words to {book ID: positions} dictionaries.
+    :param datamart_json_path: Path to the directory where the Word files are stored.
+    :param timer: A StageTimer where the time spent in the "merge" and "serialize" stages is added.
+    :return: None
+    """
+    for word, postings in word_buffer.items():
+        merge_word_file(word, postings, datamart_json_path, timer)
+    word_buffer.clear()
+
+
+def add_words_to_buffer(words, dictionary_key, word_buffer):
+    """
+    Collect the positions of every word of a book in the in-memory buffer.
+
+    :param words: The list of words of the book, already filtered.
+    :param dictionary_key: The key that identifies the book, interned as its integer ID.
+    :param word_buffer: A dictionary mapping words to {book ID: array of positions} dictionaries.
+    :return: The updated buffer.
+    """
+    doc_id = parse_doc_id(dictionary_key)
+    for position, word in enumerate(words, start=1):
+        postings = word_buffer.setdefault(word, {})
+        if doc_id in postings:
+            postings[doc_id].append(position)
+        else:
+            postings[doc_id] = array(POSITION_TYPE, (position,))
+    return word_buffer
+
+
+def select_txt_files(datamart_txt_path, datamart_json_path, incremental):
+    """
+    Find the book files to index: the ones that follow the pattern 'The Title by Author_indice.txt'
+    and, in incremental mode, are not in the manifest of the index with the same content.
+
+    :param datamart_txt_path: Path to the directory containing the text files.
+    :param datamart_json_path: Path to the directory where the JSON files are stored.
+    :param incremental: Skip the books already indexed.
+    :return: A tuple with the list of file names and the manifest (None when not incremental).
+    """
+    txt_files = [f for f in os.listdir(datamart_txt_path) if re.match(r'^.+? by .+?_\d+\.txt$', f)]
+    if not incremental:
+        return txt_files, None
+
+    manifest = load_manifest(datamart_json_path)
+    to_index, _ = select_books_to_index([os.path.join(datamart_txt_path, f) for f in txt_files], manifest)
+    logger.info(f"{len(to_index)} of {len(txt_files)} books are new or changed.")
+    return [os.path.basename(f) for f in to_index], manifest
+
+
+def update_manifest(manifest, datamart_txt_path, txt_files, datamart_json_path):
+    """
+    Record the indexed books in the manifest, if the run was incremental.
+
+    :param manifest: The manifest returned by `select_txt_files`, or None.
+    :param datamart_txt_path: Path to the directory containing the text files.
+    :param txt_files: The file names of the books indexed.
+    :param datamart_json_path: Path to the directory where the JSON files are stored.
+    :return: None
+    """
+    if manifest is not None:
+        record_books(manifest, [os.path.join(datamart_txt_path, f) for f in txt_files])
+        save_manifest(manifest, datamart_json_path)
+
+
+def indexer5(datamart_txt_path, datamart_json_path, flush_threshold=1, incremental=False):
     """
     Process text tiles in `datamart_txt_path` and update the Word objects in `datamart_json_path`.
     The keys in the dictionary are the index of the book, the author and the name.
 
+    Positions are accumulated in memory and every touched word file is merged once per flush,
+    instead of being read and rewritten for every token. The doc table is updated before every flush,
+    so queries never read a book ID that it does not have yet.
+
     :param datamart_txt_path: Path to the directory containing the text files.
-    :param datamart_json_path: Path to the directory where the JSON files will be stored.
+    :param datamart_json_path: Path to the directory where the Word files will be stored.
+    :param flush_threshold: Number of books to accumulate in memory before writing the word files.
+    :param incremental: Only index the books that are new or changed since the last incremental run.
     """
-    # Make sure the directory for JSON exists
+    # Make sure the directory for the Word files exists
     os.makedirs(datamart_json_path, exist_ok=True)
+    migrate_word_files(datamart_json_path)
 
     # Find all the files that follow the pattern 'The Title by Author_indice.txt'
-    txt_files = [f for f in os.listdir(datamart_txt_path) if re.match(r'^.+? by .+?_\d+\.txt$', f)]
+    txt_files, manifest = select_txt_files(datamart_txt_path, datamart_json_path, incremental)
+
+    word_buffer = {}
+    buffered_books = 0
+    buffered_keys = []
+    # The merge and serialize time of a flush is observed with the book that triggers it
+    timer = StageTimer(INDEXING_STAGE_SECONDS, indexer='indexer5')
 
     for txt_file in txt_files:
         # Extract the name of the book, its author and the index of the file name
         match = re.match(r'^(.+?) by (.+?)_(\d+)\.txt$', txt_file)
-        print(f"Processing file: {txt_file}")
+        logger.debug("Processing file: %s", txt_file)
         if not match:
             continue  # Skip files that don't coincide
 
-        print(f"Files Found: {match}")
+        logger.debug("Files Found: %s", match)
         book_name = match.group(1)
         author = match.group(2)
         index = match.group(3)
-        print(f"Ocurrences: {book_name}, {author}, {index}")
+        logger.debug("Ocurrences: %s, %s, %s", book_name, author, index)
         dictionary_key = f"{book_name} by {author} - {index}"
+        buffered_keys.append(dictionary_key)
 
         txt_file_path = os.path.join(datamart_txt_path, txt_file)
+        content = read_book(txt_file_path, timer)
+        words = extract_words(content, timer)
 
-        with open(txt_file_path, 'r', encoding='utf-8') as file:
-            content = file.read()
-
-        # Token the content into words using regex (only taking into consideration alphanumerics)
-        # Skips Stop Words
-        words = re.findall(r'\b[a-zA-ZáéíóúüñÁÉÍÓÚÜÑ]+\b', content.lower())
-        words = [word for word in words if
-                 word not in ['in', 'on', 'at', 'by', 'for', 'with', 'about', 'against', 'between',
-                              'into', 'through', 'during', 'before', 'after', 'above', 'below',
-                              'to', 'from', 'up', 'down', 'of', 'off', 'over', 'under', 'again',
-                              'further', 'once', 'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves',
-                              'you', 'your', 'yours',
-                              'yourself', 'yourselves', 'he', 'him', 'his', 'himself', 'she', 'her', 'hers',
-                              'herself',
-                              'it', 'its', 'itself', 'they', 'them', 'their', 'theirs', 'themselves', 'what',
-                              'which',
-                              'who', 'whom', 'this', 'that', 'these', 'those', 'am', 'is', 'are', 'was', 'were',
-                              'be',
-                              'been', 'being', 'have', 'has', 'had', 'having', 'do', 'does', 'did', 'doing', 'a',
-                              'an',
-                              'the', 'and', 'but', 'if', 'or', 'because', 'as', 'until', 'while', 'of', 'at',
-                              'by',
-                              'for', 'with', 'about', 'against', 'between', 'into', 'through', 'during', 'before',
-                              'after',
-                              'above', 'below', 'to', 'from', 'up', 'down', 'in', 'out', 'on', 'off', 'over',
-                              'under',
-                              'again', 'further', 'then', 'once', 'here', 'there', 'when', 'where', 'why', 'how',
-                              'all',
-                              'any', 'both', 'each', 'few', 'more', 'most', 'other', 'some', 'such', 'no', 'nor',
-                              'not',
-                              'only', 'own', 'same', 'so', 'than', 'too', 'very', 's', 't', 'can', 'will', 'just',
-                              'don',
-                              'should', 'now']]
-
-        for position, word in enumerate(words, start=1):
-            # Route to the JSON file of the word
-            json_file_path = os.path.join(datamart_json_path, f"{word}.json")
-
-            if os.path.exists(json_file_path):
-                # Load the Word object that exists
-                with open(json_file_path, 'r', encoding='utf-8') as json_file:
-                    data = json.load(json_file)
-                    word_obj = Word.from_dict(data)
-
-                # Verify if the key is in the dictionary
-                if dictionary_key in word_obj.dictionary:
-                    word_obj.dictionary[dictionary_key].append(position)
-                else:
-                    word_obj.dictionary[dictionary_key] = [position]
-            else:
-                # Create a new Word object
-                word_obj = Word(id_name=word, dictionary={dictionary_key: [position]})
-
-            # Save the updates Word object to the JSON
-            with open(json_file_path, 'w', encoding='utf-8') as json_file:
-                json.dump(word_obj.to_dict(), json_file, ensure_ascii=False, indent=4)
-
-    print("Indexation Completed.")
-
-
-lock = Lock()
-
-
-def process_word(word, position, dictionary_key, datamart_json_path):
-    json_file_path = os.path.join(datamart_json_path, f"{word}.json")
-
-    with lock:  # Make sure only one Thread accesses at a time
-        if os.path.exists(json_file_path) and os.path.getsize(json_file_path) > 0:
-            with open(json_file_path, 'r', encoding='utf-8') as json_file:
-                data = json.load(json_file)
-                word_obj = Word.from_dict(data)
-        else:
-            word_obj = Word(id_name=word, dictionary={})
+        with timer.stage('merge'):
+            add_words_to_buffer(words, dictionary_key, word_buffer)
+        increment('indexed_books_total', indexer='indexer5')
+        increment('indexed_tokens_total', len(words), indexer='indexer5')
+        buffered_books += 1
 
-        # Update the Word object
-        if dictionary_key in word_obj.dictionary:
-            word_obj.dictionary[dictionary_key].append(position)
-        else:
-            word_obj.dictionary[dictionary_key] = [position]
+        if buffered_books >= flush_threshold:
+            update_doc_table(buffered_keys, datamart_json_path)
+            flush_word_buffer(word_buffer, datamart_json_path, timer)
+            buffered_books = 0
+            buffered_keys = []
+        timer.observe()
+
+    # Write the books left in the buffer
+    if buffered_keys:
+        update_doc_table(buffered_keys, datamart_json_path)
+    flush_word_buffer(word_buffer, datamart_json_path, timer)
+    timer.observe()
+    update_manifest(manifest, datamart_txt_path, txt_files, datamart_json_path)
+    publish_generation(datamart_json_path)
+
+    logger.info("Indexation Completed.")
+
+
+NUM_LOCK_STRIPES = 64
+lock_stripes = [Lock() for _ in range(NUM_LOCK_STRIPES)]
+
+
+def new_stripes():
+    """
+    :return: An empty buffer for every stripe of words.
+    """
+    return [{} for _ in range(NUM_LOCK_STRIPES)]
+
+
+def stripe_for_word(word):
+    """
+    Return the lock stripe that protects the Word file of a word.
+
+    :param word: The word whose stripe is computed.
+    :return: The index of the stripe in `lock_stripes`.
+    """
+    return zlib.crc32(word.encode('utf-8')) % NUM_LOCK_STRIPES
+
+
+def index_book(txt_file_path, dictionary_key):
+    """
+    Read and tokenize a book into a local buffer. Runs inside a worker process.
+
+    :param txt_file_path: Path to the TXT file of the book.
+    :param dictionary_key: The key that identifies the book inside the Word dictionaries.
+    :return: A dictionary mapping words to {book ID: array of positions} dictionaries.
+    """
+    timer = StageTimer(INDEXING_STAGE_SECONDS, indexer='indexer5_parallel')
+    words = extract_words(read_book(txt_file_path, timer), timer)
+    with timer.stage('merge'):
+        book_buffer = add_words_to_buffer(words, dictionary_key, {})
+    timer.observe()
+
+    increment('indexed_books_total', indexer='indexer5_parallel')
+    increment('indexed_tokens_total', len(words), indexer='indexer5_parallel')
+    return book_buffer
+
+
+def merge_word_stripe(stripe, stripe_buffer, datamart_json_path):
+    """
+    Merge every word of a stripe into its Word file while holding the lock of that stripe.
+
+    :param stripe: The index of the stripe in `lock_stripes`.
+    :param stripe_buffer: A dictionary mapping the words of the stripe to {book ID: positions} dictionaries.
+    :param datamart_json_path: Path to the directory where the Word files are stored.
+    :return: None
+    """
+    timer = StageTimer(INDEXING_STAGE_SECONDS, indexer='indexer5_parallel')
+    with lock_stripes[stripe]:  # Only one Thread writes the words of a stripe at a time
+        flush_word_buffer(stripe_buffer, datamart_json_path, timer)
+    timer.observe()
+
+
+def submit_stripes(writers, stripes, datamart_json_path):
+    """
+    Submit the merge of every non-empty stripe of a batch to the writer threads.
+
+    :param writers: The ThreadPoolExecutor of the writers.
+    :param stripes: The buffers of the stripes, see `new_stripes`.
+    :param datamart_json_path: Path to the directory where the Word files are stored.
+    :return: The list of futures.
+    """
+    return [writers.submit(merge_word_stripe, stripe, stripe_buffer, datamart_json_path)
+            for stripe, stripe_buffer in enumerate(stripes) if stripe_buffer]
 
-        # Save the Word object in the JSON
-        with open(json_file_path, 'w', encoding='utf-8') as json_file:
-            json.dump(word_obj.to_dict(), json_file, ensure_ascii=False, indent=4)
 
+def indexer5_parallel(datamart_txt_path, datamart_json_path, workers=None, incremental=False, flush_threshold=256):
+    """
+    Parallel version of `indexer5`.
 
-def indexer5_parallel(datamart_txt_path, datamart_json_path):
+    Books are tokenized in worker processes, each one building its own buffer. The buffers are grouped
+    into stripes of words and, every `flush_threshold` books, the stripes of the batch are handed to the
+    writer threads while the next batch is tokenized. Writers of different batches can hold the same
+    stripe, so each one merges it while holding only that stripe's lock. The doc table gets the keys of
+    every book before the first batch is written, so queries never read a book ID that it does not have.
+
+    :param datamart_txt_path: Path to the directory containing the text files.
+    :param datamart_json_path: Path to the directory where the Word files will be stored.
+    :param workers: Number of worker processes and threads. Defaults to the number of CPUs.
+    :param incremental: Only index the books that are new or changed since the last incremental run.
+    :param flush_threshold: Number of books grouped in memory before their stripes are written.
+    """
     os.makedirs(datamart_json_path, exist_ok=True)
-    txt_files = [f for f in os.listdir(datamart_txt_path) if re.match(r'^.+? by .+?_\d+\.txt$', f)]
+    migrate_word_files(datamart_json_path)
+    txt_files, manifest = select_txt_files(datamart_txt_path, datamart_json_path, incremental)
 
+    txt_file_paths = []
+    dictionary_keys = []
     for txt_file in txt_files:
         match = re.match(r'^(.+?) by (.+?)_(\d+)\.txt$', txt_file)
         if not match:
@@ -134,43 +388,36 @@ def indexer5_parallel(datamart_txt_path, datamart_json_path):
         book_name = match.group(1)
         author = match.group(2)
         index = match.group(3)
-        dictionary_key = f"{book_name} by {author} - {index}"
-        txt_file_path = os.path.join(datamart_txt_path, txt_file)
+        dictionary_keys.append(f"{book_name} by {author} - {index}")
+        txt_file_paths.append(os.path.join(datamart_txt_path, txt_file))
+
+    update_doc_table(dictionary_keys, datamart_json_path)
+    stripes = new_stripes()
+    buffered_books = 0
+    futures = []
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=reset_metrics) as executor, \
+            ThreadPoolExecutor(max_workers=workers) as writers:
+        # Map: tokenize every book in a worker process and group its words by stripe
+        for book_buffer, worker_metrics in executor.map(partial(run_and_collect, index_book), txt_file_paths,
+                                                        dictionary_keys):
+            registry.merge(worker_metrics)
+            for word, postings in book_buffer.items():
+                stripe_postings = stripes[stripe_for_word(word)].setdefault(word, {})
+                for doc_id, positions in postings.items():
+                    stripe_postings.setdefault(doc_id, array(POSITION_TYPE)).extend(positions)
+            buffered_books += 1
+
+            # Reduce: merge the stripes of the batch into the Word files in the background
+            if buffered_books >= flush_threshold:
+                futures.extend(submit_stripes(writers, stripes, datamart_json_path))
+                stripes = new_stripes()
+                buffered_books = 0
+
+        futures.extend(submit_stripes(writers, stripes, datamart_json_path))
+        for future in futures:
+            future.result()
 
-        with open(txt_file_path, 'r', encoding='utf-8') as file:
-            content = file.read()
-
-        words = re.findall(r'\b[a-zA-ZáéíóúüñÁÉÍÓÚÜÑ]+\b', content.lower())
-        words = [word for word in words if
-                 word not in ['in', 'on', 'at', 'by', 'for', 'with', 'about', 'against', 'between',
-                              'into', 'through', 'during', 'before', 'after', 'above', 'below',
-                              'to', 'from', 'up', 'down', 'of', 'off', 'over', 'under', 'again',
-                              'further', 'once', 'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves',
-                              'you', 'your', 'yours',
-                              'yourself', 'yourselves', 'he', 'him', 'his', 'himself', 'she', 'her', 'hers',
-                              'herself',
-                              'it', 'its', 'itself', 'they', 'them', 'their', 'theirs', 'themselves', 'what',
-                              'which',
-                              'who', 'whom', 'this', 'that', 'these', 'those', 'am', 'is', 'are', 'was', 'were',
-                              'be',
-                              'been', 'being', 'have', 'has', 'had', 'having', 'do', 'does', 'did', 'doing', 'a',
-                              'an',
-                              'the', 'and', 'but', 'if', 'or', 'because', 'as', 'until', 'while', 'of', 'at',
-                              'by',
-                              'for', 'with', 'about', 'against', 'between', 'into', 'through', 'during', 'before',
-                              'after',
-                              'above', 'below', 'to', 'from', 'up', 'down', 'in', 'out', 'on', 'off', 'over',
-                              'under',
-                              'again', 'further', 'then', 'once', 'here', 'there', 'when', 'where', 'why', 'how',
-                              'all',
-                              'any', 'both', 'each', 'few', 'more', 'most', 'other', 'some', 'such', 'no', 'nor',
-                              'not',
-                              'only', 'own', 'same', 'so', 'than', 'too', 'very', 's', 't', 'can', 'will', 'just',
-                              'don',
-                              'should', 'now']]
-
-        with ThreadPoolExecutor() as executor:
-            for position, word in enumerate(words, start=1):
-                executor.submit(process_word, word, position, dictionary_key, datamart_json_path)
-
-    print("Indexation Completed.")
+    update_manifest(manifest, datamart_txt_path, txt_files, datamart_json_path)
+    publish_generation(datamart_json_path)
+    logger.info("Indexation Completed.")
@@ -1,41 +1,94 @@
 import json
+import logging
 import os
 import re
+import shutil
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
-from indexer.book_reader import read_words, save_metadata_to_json
+from data_model.object_type.Word import POSITION_TYPE, compact_positions, parse_doc_id
+from data_model.postings_codec import BINARY_EXTENSION, LEXICON_EXTENSION, read_binary_index, write_binary_index
+from indexer.book_reader import read_words_and_paragraphs
+from indexer.doc_lengths import save_doc_lengths
+from indexer.index_generation import publish_generation
+from indexer.index_manifest import load_manifest, record_books, save_manifest, select_books_to_index
+from indexer.metadata_catalog import append_to_catalog, catalog_record, load_catalog
+from indexer.paragraph_index import save_paragraph_table
 from indexer.path_reader import extract_files_from_directory
+from indexer.shard_map import LETTER_SHARD_MAP, load_shard_map, save_shard_map, shard_for, vocabulary_weights
+from indexer.segments import (MERGE_FACTOR, add_segment, directory_size, expired_segments, load_segments,
+                              new_segment_name, replace_segments, retire_segments, save_segments, segment_directory,
+                              segments_lock, select_merge)
+from monitoring.metrics import (INDEXING_STAGE_SECONDS, StageTimer, increment, registry, reset_metrics, run_and_collect,
+                                timed)
+
+logger = logging.getLogger(__name__)
 
 
 def add_words_to_dict(words, id_book, dictionary):
     """
     Add words and their indexes to a dictionary.
 
+    Book IDs are interned as integers and positions are kept in arrays of 32-bit integers,
+    which take a fraction of the memory of lists of Python integers.
+
     :param words: A list of words to be added.
     :param id_book: The ID of the book from which the words are extracted.
     :param dictionary: The dictionary where words and their indexes will be stored.
     :return: The updated dictionary with words and their corresponding indexes.
     """
+    id_book = parse_doc_id(id_book)
     for idx, word in enumerate(words):
         if word not in dictionary:
-            dictionary[word] = {id_book: [idx]}
+            dictionary[word] = {id_book: array(POSITION_TYPE, (idx,))}
         else:
             if id_book not in dictionary[word]:
-                dictionary[word][id_book] = [idx]
+                dictionary[word][id_book] = array(POSITION_TYPE, (idx,))
             else:
                 dictionary[word][id_book].append(idx)
 
     return dictionary
 
 
+def compact_indexer(indexer):
+    """
+    Convert an indexer loaded from disk to the in-memory form of `add_words_to_dict`.
+
+    Postings without a book ID, which older versions wrote for file names without digits, are dropped.
+
+    :param indexer: A dictionary with words and their indexes, with book IDs as strings and lists of positions.
+    :return: The same indexes with integer book IDs and arrays of positions.
+    """
+    compacted = {}
+    for word, data in indexer.items():
+        postings = {parse_doc_id(book_id): compact_positions(positions)
+                    for book_id, positions in data.items() if book_id != ''}
+        if postings:
+            compacted[word] = postings
+    return compacted
+
+
+def json_indexer(indexer):
+    """
+    Convert an indexer to the form saved in JSON files.
+
+    :param indexer: A dictionary with words and their indexes.
+    :return: The same indexes with book IDs as strings and lists of positions.
+    """
+    return {word: {str(book_id): list(positions) for book_id, positions in data.items()}
+            for word, data in indexer.items()}
+
+
 def id_search(filepath):
     """
-    Extract the first numeric ID from the given file path.
+    Extract the first numeric ID from the name of the given file. Digits in the directories are ignored.
 
     :param filepath: The path of the file from which to extract the ID.
-    :return: The first numeric ID found in the file path, or an empty string if no ID is found.
+    :return: The first numeric ID found in the file name, or an empty string if no ID is found.
     """
     pattern = r'\d+'
-    coindidencies = re.findall(pattern, filepath)
+    coindidencies = re.findall(pattern, os.path.basename(filepath))
 
     if coindidencies:
         result = coindidencies[0]
@@ -44,39 +97,515 @@ def id_search(filepath):
     return result
 
 
-def save_partial_indexers(indexer, output_directory):
+def split_indexer_by_shard(indexer, shard_map=LETTER_SHARD_MAP):
+    """
+    Group the words of an indexer by the shard they are routed to.
+
+    :param indexer: A dictionary containing the indexer data to be divided.
+    :param shard_map: The shard map of the index, see `shard_for`.
+    :return: A dictionary mapping each shard key to the part of the indexer with the words routed to it.
+    """
+    partial_indexers = {}
+
+    for word, data in indexer.items():
+        shard = shard_for(word, shard_map)
+        if shard not in partial_indexers:
+            partial_indexers[shard] = {}
+        partial_indexers[shard][word] = data
+
+    return partial_indexers
+
+
+def partial_indexer_paths(shard, output_directory):
+    """
+    Return the paths of every file a partial indexer can be stored in.
+
+    :param shard: The key of the shard, see `shard_for`.
+    :param output_directory: The directory where the partial indexer files are saved.
+    :return: A dictionary with the 'json', 'binary' and 'lexicon' paths.
+    """
+    return {
+        'json': os.path.join(output_directory, f'indexer_{shard}.json'),
+        'binary': os.path.join(output_directory, f'indexer_{shard}{BINARY_EXTENSION}'),
+        'lexicon': os.path.join(output_directory, f'indexer_{shard}{LEXICON_EXTENSION}')
+    }
+
+
+def save_partial_indexer(shard, partial_indexer, output_directory, index_format='json'):
+    """
+    Save the part of the indexer for a shard as a JSON file or as a binary postings file.
+    Files of the other format left by previous runs are removed, so readers never see stale data.
+
+    :param shard: The key of the shard, see `shard_for`.
+    :param partial_indexer: A dictionary with the words routed to `shard` and their indexes.
+    :param output_directory: The directory where the partial indexer file will be saved.
+    :param index_format: 'json' for `indexer_{shard}.json` or 'binary' for `indexer_{shard}.bin`.
+    :return: None
+    """
+    paths = partial_indexer_paths(shard, output_directory)
+
+    with timed(INDEXING_STAGE_SECONDS, indexer='indexer_dict', stage='serialize'):
+        if index_format == 'binary':
+            write_binary_index(partial_indexer, paths['binary'])
+            stale_paths = [paths['json']]
+        else:
+            with open(paths['json'], 'w', encoding='utf-8') as file:
+                json.dump(json_indexer(partial_indexer), file, ensure_ascii=False, indent=4)
+            stale_paths = [paths['binary'], paths['lexicon']]
+
+    for stale_path in stale_paths:
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+
+
+def load_partial_indexer(shard, output_directory):
+    """
+    Load the saved part of the indexer for a shard, in whichever format it was written.
+
+    :param shard: The key of the shard, see `shard_for`.
+    :param output_directory: The directory where the partial indexer files are saved.
+    :return: A dictionary with the words routed to `shard` and their indexes, empty if there is none.
+             Book IDs are integers and positions arrays, as built by `add_words_to_dict`.
+    """
+    paths = partial_indexer_paths(shard, output_directory)
+
+    if os.path.exists(paths['binary']):
+        return compact_indexer(read_binary_index(paths['binary']))
+    if os.path.exists(paths['json']):
+        with open(paths['json'], 'r', encoding='utf-8') as file:
+            return compact_indexer(json.load(file))
+    return {}
+
+
+def saved_shards(output_directory):
+    """
+    List the shards that already have a partial indexer saved.
+
+    :param output_directory: The directory where the partial indexer files are saved.
+    :return: A set of shards.
+    """
+    if not os.path.exists(output_directory):
+        return set()
+
+    shards = set()
+    for filename in os.listdir(output_directory):
+        match = re.match(rf'^indexer_(.+)(?:\.json|{re.escape(BINARY_EXTENSION)})$', filename)
+        if match:
+            shards.add(match.group(1))
+    return shards
+
+
+def remove_shards(output_directory):
+    """
+    Remove every partial indexer saved in a directory.
+
+    :param output_directory: The directory where the partial indexer files are saved.
+    :return: None
     """
-    Divide the indexer into smaller parts and save them as separate JSON files.
+    for shard in saved_shards(output_directory):
+        for path in partial_indexer_paths(shard, output_directory).values():
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def save_partial_indexers(indexer, output_directory, index_format='json', replaced_books=None, shard_map=None):
+    """
+    Divide the indexer into smaller parts and save them as separate files, together with the shard map
+    used to divide it.
 
     :param indexer: A dictionary containing the indexer data to be divided.
     :param output_directory: The directory where the partial indexer files will be saved.
+    :param index_format: 'json' or 'binary', see `save_partial_indexer`.
+    :param replaced_books: None to overwrite the saved parts. Otherwise the indexer is a delta that is
+                           merged into the saved parts, and this is the set of book IDs it re-indexes.
+    :param shard_map: The shard map of the index. Defaults to the one saved in the directory.
     :return: None
     """
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
 
-    partial_indexers = {}
+    shard_map = shard_map or load_shard_map(output_directory)
+    save_shard_map(shard_map, output_directory)
+    partial_indexers = split_indexer_by_shard(indexer, shard_map)
 
-    for word, data in indexer.items():
-        first_letter = word[0].lower()
-        if first_letter not in partial_indexers:
-            partial_indexers[first_letter] = {}
-        partial_indexers[first_letter][word] = data
+    if replaced_books is None:
+        for shard, partial_indexer in partial_indexers.items():
+            save_partial_indexer(shard, partial_indexer, output_directory, index_format)
+        return
 
-    for letter, partial_indexer in partial_indexers.items():
-        output_file = os.path.join(output_directory, f'indexer_{letter}.json')
-        with open(output_file, 'w', encoding='utf-8') as file:
-            json.dump(partial_indexer, file, ensure_ascii=False, indent=4)
+    for shard in shards_to_merge(partial_indexers, output_directory, replaced_books):
+        merge_and_save_partial_indexer(shard, [partial_indexers.get(shard, {})], output_directory,
+                                       index_format, replaced_books)
 
 
-def indexer_dict(books_datamart, words_datamart, output_directory_metadata, stopwords_filepath):
+def shards_to_merge(partial_indexers, output_directory, replaced_books):
+    """
+    Decide which saved parts a delta has to be merged into. New books only touch the shards
+    of their words, but books indexed again may have old postings in any part.
+
+    :param partial_indexers: The delta, divided by shard.
+    :param output_directory: The directory where the partial indexer files are saved.
+    :param replaced_books: The set of book IDs the delta re-indexes.
+    :return: A sorted list of shards.
+    """
+    shards = set(partial_indexers)
+    if replaced_books:
+        shards |= saved_shards(output_directory)
+    return sorted(shards)
+
+
+def remove_books(partial_indexer, book_ids):
+    """
+    Remove the postings of some books from a partial indexer, dropping the words left without books.
+
+    :param partial_indexer: A dictionary with words and their indexes.
+    :param book_ids: The IDs of the books to remove.
+    :return: The partial indexer without those books.
+    """
+    if not book_ids:
+        return partial_indexer
+
+    book_ids = {parse_doc_id(book_id) for book_id in book_ids}
+    cleaned = {}
+    for word, data in partial_indexer.items():
+        remaining = {book_id: positions for book_id, positions in data.items() if book_id not in book_ids}
+        if remaining:
+            cleaned[word] = remaining
+    return cleaned
+
+
+def index_book(filepath, stopwords_filepath, indexer, words_datamart, doc_lengths=None):
+    """
+    Add the words of a book to the indexer and save the book's paragraph table.
+    Books without digits in their file name have no ID and are skipped.
+
+    :param filepath: The path of the book file.
+    :param stopwords_filepath: The directory containing the stopwords TXT file.
+    :param indexer: The dictionary where words and their indexes are stored.
+    :param words_datamart: The output directory for saving partial indexers and paragraph tables.
+    :param doc_lengths: An optional dictionary where the number of words of the book is stored.
+    :return: The updated indexer.
+    """
+    id_book = id_search(str(filepath))
+    if not id_book:
+        logger.warning(f"No book ID in the file name of {filepath}, skipped.")
+        return indexer
+
+    timer = StageTimer(INDEXING_STAGE_SECONDS, indexer='indexer_dict')
+    words, paragraph_table = read_words_and_paragraphs(filepath, stopwords_filepath, timer)
+    if words:
+        with timer.stage('merge'):
+            indexer = add_words_to_dict(words, id_book, indexer)
+        save_paragraph_table(paragraph_table, id_book, words_datamart)
+        if doc_lengths is not None:
+            doc_lengths[id_book] = len(words)
+
+        increment('indexed_books_total', indexer='indexer_dict')
+        increment('indexed_tokens_total', len(words), indexer='indexer_dict')
+        increment('indexed_bytes_total', os.path.getsize(filepath), indexer='indexer_dict')
+    else:
+        logger.warning(f"No words found in {filepath}")
+    timer.observe()
+    return indexer
+
+
+def build_partial_index(filepaths, stopwords_filepath, words_datamart, shard_map=LETTER_SHARD_MAP):
+    """
+    Tokenize a subset of the books into its own partial index, already divided by shard.
+    Runs inside a worker process.
+
+    :param filepaths: The paths of the books assigned to this worker.
+    :param stopwords_filepath: The directory containing the stopwords TXT file.
+    :param words_datamart: The output directory for saving the paragraph tables.
+    :param shard_map: The shard map of the index.
+    :return: A tuple with a dictionary mapping each shard key to the partial index of the words
+             routed to it, a dictionary with the number of words of each book, and the list of
+             the paths of the books indexed without errors.
+    """
+    indexer = {}
+    doc_lengths = {}
+    indexed = []
+
+    for filepath in filepaths:
+        try:
+            indexer = index_book(filepath, stopwords_filepath, indexer, words_datamart, doc_lengths)
+            indexed.append(filepath)
+        except Exception as e:
+            logger.error(f"Error processing {filepath}: {e}")
+
+    return split_indexer_by_shard(indexer, shard_map), doc_lengths, indexed
+
+
+def merge_partial_indexes(partial_indexers):
+    """
+    Merge several partial indexes into one. Every book is indexed by a single worker,
+    so the postings of a word usually only have to be joined. Files that share an ID but were indexed
+    by different workers get their positions appended, as `add_words_to_dict` does in a single process.
+
+    :param partial_indexers: A list of dictionaries with words and their indexes.
+    :return: A dictionary with the words of all the partial indexes and their indexes.
+    """
+    merged = {}
+    duplicated_ids = set()
+
+    for partial_indexer in partial_indexers:
+        for word, data in partial_indexer.items():
+            if word not in merged:
+                merged[word] = dict(data)
+                continue
+
+            postings = merged[word]
+            if postings.keys().isdisjoint(data):
+                postings.update(data)
+                continue
+            for book_id, positions in data.items():
+                if book_id in postings:
+                    postings[book_id] = postings[book_id] + positions
+                    duplicated_ids.add(book_id)
+                else:
+                    postings[book_id] = positions
+
+    if duplicated_ids:
+        logger.warning(f"Several files share the book IDs {sorted(duplicated_ids)}; their postings were merged.")
+    return merged
+
+
+def merge_and_save_partial_indexer(shard, partial_indexers, output_directory, index_format='json',
+                                   replaced_books=None):
+    """
+    Merge the partial indexes built by the workers for a shard and save the result.
+    Runs inside a worker process.
+
+    :param shard: The key of the shard, see `shard_for`.
+    :param partial_indexers: A list with the partial indexes of the shard, one for each worker.
+    :param output_directory: The directory where the partial indexer file will be saved.
+    :param index_format: 'json' or 'binary', see `save_partial_indexer`.
+    :param replaced_books: None to overwrite the saved part. Otherwise the partial indexes are merged into
+                           the saved part, after removing from it the books in this set.
+    :return: None
+    """
+    if replaced_books is not None:
+        saved = remove_books(load_partial_indexer(shard, output_directory), replaced_books)
+        partial_indexers = [saved] + list(partial_indexers)
+
+    save_partial_indexer(shard, merge_partial_indexes(partial_indexers), output_directory, index_format)
+
+
+def indexer_dict_parallel(filepaths, words_datamart, stopwords_filepath, workers, index_format='json',
+                          replaced_books=None, shards_directory=None, shard_map=LETTER_SHARD_MAP):
+    """
+    Build and save the partial indexers using a pool of processes.
+
+    Each worker tokenizes a subset of the books into its own partial index (map), then the parts
+    belonging to each shard are merged and saved in parallel (reduce).
+
+    :param filepaths: The paths of the books to be indexed.
+    :param words_datamart: The output directory for saving partial indexers.
+    :param stopwords_filepath: The directory containing the stopwords TXT file.
+    :param workers: Number of worker processes.
+    :param index_format: 'json' or 'binary', see `save_partial_indexer`.
+    :param replaced_books: None to overwrite the saved parts, or the set of book IDs re-indexed by
+                           this delta to merge it into them, see `save_partial_indexers`.
+    :param shards_directory: The directory for the partial indexers, if not `words_datamart`.
+    :param shard_map: The shard map of the index.
+    :return: A tuple with a dictionary with the number of words of each book indexed, and the list of
+             the paths of the books indexed without errors.
+    """
+    shards_directory = shards_directory or words_datamart
+    save_shard_map(shard_map, shards_directory)
+    doc_lengths = {}
+    indexed = []
+
+    # Several subsets per worker, so a slow book does not leave the other workers idle
+    num_subsets = min(len(filepaths), workers * 4)
+    subsets = [filepaths[i::num_subsets] for i in range(num_subsets)]
+
+    # Workers start with an empty registry and hand the metrics of every task back with its result
+    with ProcessPoolExecutor(max_workers=workers, initializer=reset_metrics) as executor:
+        shard_parts = {}
+        build = partial(run_and_collect, build_partial_index)
+        for (partial_index, subset_lengths, subset_indexed), worker_metrics in executor.map(build, subsets,
+                                                                            [stopwords_filepath] * num_subsets,
+                                                                            [words_datamart] * num_subsets,
+                                                                            [shard_map] * num_subsets):
+            registry.merge(worker_metrics)
+            doc_lengths.update(subset_lengths)
+            indexed.extend(subset_indexed)
+            for shard, partial_indexer in partial_index.items():
+                shard_parts.setdefault(shard, []).append(partial_indexer)
+
+        if replaced_books is not None:
+            for shard in shards_to_merge(shard_parts, shards_directory, replaced_books):
+                shard_parts.setdefault(shard, [])
+
+        futures = [executor.submit(run_and_collect, merge_and_save_partial_indexer, shard, parts, shards_directory,
+                                   index_format, replaced_books)
+                   for shard, parts in shard_parts.items()]
+        for future in futures:
+            _, worker_metrics = future.result()
+            registry.merge(worker_metrics)
+
+    return doc_lengths, indexed
+
+
+def start_segment(words_datamart):
+    """
+    Reserve a new segment and create its directory. The segment is not read by queries until it is published.
+
+    :param words_datamart: The directory where the index is stored.
+    :return: A tuple with the name of the segment and its directory.
+    """
+    with segments_lock:
+        segments = load_segments(words_datamart) or {"next_id": 1, "segments": []}
+        name = new_segment_name(segments)
+        save_segments(segments, words_datamart)
+
+    directory = segment_directory(words_datamart, name)
+    os.makedirs(directory, exist_ok=True)
+    return name, directory
+
+
+def publish_segment(words_datamart, name, books):
+    """
+    Make a written segment visible to queries. Its books replace their copies in older segments.
+    The segments left without books are retired, and the ones retired long enough ago are deleted,
+    see `retire_segments`.
+
+    :param words_datamart: The directory where the index is stored.
+    :param name: The name of the segment.
+    :param books: The set of book IDs indexed in the segment.
+    :return: None
+    """
+    with segments_lock:
+        segments = load_segments(words_datamart)
+        dropped = add_segment(segments, name, books, directory_size(segment_directory(words_datamart, name)))
+        retire_segments(segments, dropped)
+        expired = expired_segments(segments)
+        save_segments(segments, words_datamart)
+
+    for dead in expired:
+        shutil.rmtree(segment_directory(words_datamart, dead), ignore_errors=True)
+
+
+def compact_segments(words_datamart, merge_factor=MERGE_FACTOR, index_format='binary'):
+    """
+    Merge segments following the tiered policy of `select_merge` until no tier is full.
+
+    Merges read one shard at a time from the segments being merged and write a new segment
+    without the deleted books. Segments written with another shard map than the index's current
+    one are loaded whole and divided again with the current map. The list of segments is only locked
+    to reserve the new segment and to swap it in, so indexing runs of the same process can publish
+    segments while a merge runs. The merged segments are retired rather than deleted right away,
+    since queries that loaded the previous list may still read them, see `retire_segments`.
+
+    :param words_datamart: The directory where the index is stored.
+    :param merge_factor: The number of segments of a tier merged together.
+    :param index_format: 'json' or 'binary', see `save_partial_indexer`.
+    :return: The number of merges done.
+    """
+    merges = 0
+
+    while True:
+        with segments_lock:
+            segments = load_segments(words_datamart)
+            to_merge = select_merge(segments, merge_factor) if segments else []
+            if not to_merge:
+                return merges
+            snapshot = {segment["name"]: set(segment["deleted"]) for segment in to_merge}
+            name = new_segment_name(segments)
+            save_segments(segments, words_datamart)
+
+        directory = segment_directory(words_datamart, name)
+        os.makedirs(directory, exist_ok=True)
+        merged_directories = [segment_directory(words_datamart, segment["name"]) for segment in to_merge]
+
+        shard_map = load_shard_map(words_datamart)
+        save_shard_map(shard_map, directory)
+
+        if all(load_shard_map(merged_directory) == shard_map for merged_directory in merged_directories):
+            shards = set()
+            for merged_directory in merged_directories:
+                shards |= saved_shards(merged_directory)
+
+            for shard in sorted(shards):
+                parts = [remove_books(load_partial_indexer(shard, merged_directory), snapshot[segment["name"]])
+                         for segment, merged_directory in zip(to_merge, merged_directories)]
+                merged = merge_partial_indexes(parts)
+                if merged:
+                    save_partial_indexer(shard, merged, directory, index_format)
+        else:
+            parts = [remove_books(load_partial_indexer(shard, merged_directory), snapshot[segment["name"]])
+                     for segment, merged_directory in zip(to_merge, merged_directories)
+                     for shard in saved_shards(merged_directory)]
+            save_partial_indexers(merge_partial_indexes(parts), directory, index_format, shard_map=shard_map)
+
+        books = set()
+        for segment in to_merge:
+            books.update(set(segment["books"]) - snapshot[segment["name"]])
+
+        with segments_lock:
+            segments = load_segments(words_datamart)
+            dropped = replace_segments(segments, set(snapshot), name, books, directory_size(directory), snapshot)
+            retire_segments(segments, list(snapshot) + dropped)
+            expired = expired_segments(segments)
+            save_segments(segments, words_datamart)
+
+        for dead in expired:
+            shutil.rmtree(segment_directory(words_datamart, dead), ignore_errors=True)
+        merges += 1
+
+
+def index_vocabulary_weights(shards_directory):
+    """
+    Measure the postings of every word of a saved index, reading one shard at a time.
+
+    :param shards_directory: The directory where the partial indexers are saved.
+    :return: A dictionary mapping words to their weights, see `vocabulary_weights`.
+    """
+    word_weights = {}
+    for shard in saved_shards(shards_directory):
+        vocabulary_weights(load_partial_indexer(shard, shards_directory), word_weights)
+    return word_weights
+
+
+def reshard_index(shards_directory, shard_map, index_format='json'):
+    """
+    Divide a saved index again with another shard map, for example a `prefix_shard_map`
+    computed from `index_vocabulary_weights`.
+
+    :param shards_directory: The directory where the partial indexers are saved.
+    :param shard_map: The new shard map.
+    :param index_format: 'json' or 'binary', see `save_partial_indexer`.
+    :return: None
+    """
+    indexer = merge_partial_indexes([load_partial_indexer(shard, shards_directory)
+                                     for shard in saved_shards(shards_directory)])
+    remove_shards(shards_directory)
+    save_partial_indexers(indexer, shards_directory, index_format, shard_map=shard_map)
+
+
+def indexer_dict(books_datamart, words_datamart, output_directory_metadata, stopwords_filepath, workers=1,
+                 index_format='json', incremental=False, segmented=False, shard_map=None):
     """
     Create an indexer from book files, filtering out stopwords, and save metadata and partial indexers.
 
     :param books_datamart: The path to the directory containing the book files.
     :param words_datamart: The output directory for saving partial indexers.
     :param stopwords_filepath: The directory containing the stopwords TXT file.
-    :param output_directory_metadata: The directory containing the metadata JSON file.
+    :param output_directory_metadata: The directory containing the metadata catalog.
+    :param workers: Number of processes used to tokenize the books. With 1 everything runs in this process.
+    :param index_format: 'json' or 'binary', see `save_partial_indexer`.
+    :param incremental: Only tokenize the books that are new or changed according to the manifest of the
+                        index, and merge their postings into the saved parts instead of overwriting them.
+                        Only the books indexed without errors are recorded in the manifest, so the others
+                        are tried again by the next run. Each saved part the delta touches is still read
+                        and rewritten whole, and every part is when a changed book is indexed again,
+                        since its old postings may be in any of them.
+    :param segmented: Write the partial indexers of this run into a new immutable segment instead of
+                      rewriting the saved ones. See `compact_segments` to merge segments.
+    :param shard_map: How words are divided into partial indexers, see `shard_for`. Defaults to the
+                      map saved with the index, or to first letters. A saved index with another map is
+                      divided again before merging into it, while segments keep the map they were written with.
     :return: None
     """
     indexer = {}
@@ -84,17 +613,68 @@ def indexer_dict(books_datamart, words_datamart, output_directory_metadata, stop
     output_directory = words_datamart
     filepaths = extract_files_from_directory(directory_path)
 
-    for filepath in filepaths:
-        try:
-            words = read_words(filepath, stopwords_filepath)
-            if words:
-                indexer = add_words_to_dict(words, id_search(str(filepath)), indexer)
-            else:
-                print(f"Warning: No words found in {filepath}")
+    manifest = None
+    replaced_books = None
+    if incremental:
+        manifest = load_manifest(output_directory)
+        total_books = len(filepaths)
+        filepaths, changed = select_books_to_index(filepaths, manifest)
+        replaced_books = {id_search(os.path.join(str(directory_path), filename)) for filename in changed}
+        logger.info(f"{len(filepaths)} of {total_books} books are new or changed.")
+        if not filepaths:
+            save_manifest(manifest, output_directory)
+            return
 
-            save_metadata_to_json(str(filepath), output_directory_metadata)
+    # The metadata of the whole run is appended to the catalog in a single batch
+    catalog = load_catalog(output_directory_metadata)
+    records = []
+    doc_lengths = {}
 
-        except Exception as e:
-            print(f"Error processing {filepath}: {e}")
+    saved_map = load_shard_map(output_directory)
+    shard_map = shard_map or saved_map
+    if shard_map != saved_map and not segmented:
+        if replaced_books is not None:
+            reshard_index(output_directory, shard_map, index_format)
+        else:
+            remove_shards(output_directory)
+    save_shard_map(shard_map, output_directory)
+
+    segment = None
+    shards_directory = output_directory
+    if segmented:
+        segment, shards_directory = start_segment(output_directory)
+        replaced_books = None  # The new segment replaces the books in the older ones
+
+    indexed = []
+    if workers > 1 and filepaths:
+        doc_lengths, indexed = indexer_dict_parallel(filepaths, output_directory, stopwords_filepath, workers,
+                                                     index_format, replaced_books, shards_directory, shard_map)
+    else:
+        for filepath in filepaths:
+            try:
+                indexer = index_book(filepath, stopwords_filepath, indexer, output_directory, doc_lengths)
+                indexed.append(filepath)
+            except Exception as e:
+                logger.error(f"Error processing {filepath}: {e}")
+
+        save_partial_indexers(indexer, shards_directory, index_format, replaced_books, shard_map)
+
+    # Only the books indexed without errors are catalogued, like in the manifest
+    for filepath in indexed:
+        record = catalog_record(str(filepath))
+        if record:
+            records.append(record)
+        else:
+            logger.warning(f"File '{filepath}' is invalid.")
+
+    if segment is not None:
+        # Only the books with postings in the segment replace their copies in the older ones
+        publish_segment(output_directory, segment, {book_id for book_id, length in doc_lengths.items() if length})
+    save_doc_lengths(doc_lengths, output_directory, replace=not incremental)
+    append_to_catalog(records, output_directory_metadata, catalog)
+
+    if manifest is not None:
+        record_books(manifest, indexed)
+        save_manifest(manifest, output_directory)
 
-    save_partial_indexers(indexer, output_directory)
+    publish_generation(output_directory)
@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import re
+
+from indexer.book_reader import read_metadata
+
+CATALOG_FILENAME = 'books_catalog.jsonl'
+
+logger = logging.getLogger(__name__)
+
+
+def catalog_path(metadata_folder):
+    """
+    Return the path of the metadata catalog inside a metadata folder.
+
+    :param metadata_folder: The directory containing the metadata files.
+    :return: The path of the catalog file.
+    """
+    return os.path.join(metadata_folder, CATALOG_FILENAME)
+
+
+def catalog_record(filepath):
+    """
+    Build the catalog record of a book: its metadata plus the name of its file.
+
+    :param filepath: Path to the book file.
+    :return: A dictionary with book's name, author, book's id, URL and file name, or None if the file name is invalid.
+    """
+    metadata = read_metadata(filepath)
+    if metadata:
+        metadata["filename"] = os.path.basename(filepath)
+    return metadata
+
+
+def load_catalog(metadata_folder):
+    """
+    Load the whole metadata catalog in a single pass.
+
+    The catalog is an append-only JSON lines file. When a book appears more than once,
+    the last record wins.
+
+    :param metadata_folder: The directory containing the metadata files.
+    :return: A dictionary mapping book IDs to their records, or an empty dictionary if there is no catalog.
+    """
+    catalog = {}
+    filepath = catalog_path(metadata_folder)
+    if not os.path.exists(filepath):
+        return catalog
+
+    with open(filepath, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                catalog[record['id_book']] = record
+    return catalog
+
+
+def append_to_catalog(records, metadata_folder, catalog=None):
+    """
+    Append a batch of records to the metadata catalog with a single write.
+
+    :param records: The records to append.
+    :param metadata_folder: The directory containing the metadata files.
+    :param catalog: The already loaded catalog. Records identical to the ones in it are skipped,
+                    and it is updated with the appended ones.
+    :return: The number of records appended.
+    """
+    if catalog is not None:
+        records = [record for record in records if catalog.get(record['id_book']) != record]
+    if not records:
+        return 0
+
+    os.makedirs(metadata_folder, exist_ok=True)
+    lines = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+    with open(catalog_path(metadata_folder), 'a', encoding='utf-8') as file:
+        file.write(lines)
+
+    if catalog is not None:
+        for record in records:
+            catalog[record['id_book']] = record
+    logger.info(f"Metadata of {len(records)} books added to '{catalog_path(metadata_folder)}'.")
+    return len(records)
+
+
+def compact_catalog(metadata_folder):
+    """
+    Rewrite the catalog keeping only the last record of each book.
+
+    :param metadata_folder: The directory containing the metadata files.
+    :return: The number of records kept.
+    """
+    catalog = load_catalog(metadata_folder)
+    filepath = catalog_path(metadata_folder)
+    temporary_path = filepath + '.tmp'
+
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        for record in catalog.values():
+            file.write(json.dumps(record, ensure_ascii=False) + '\n')
+    os.replace(temporary_path, filepath)
+    return len(catalog)
+
+
+def import_metadata_ranges(metadata_folder):
+    """
+    Add to the catalog the books stored in the old `books_metadata_X-Y.json` files.
+
+    :param metadata_folder: The directory containing the metadata files.
+    :return: The number of records appended.
+    """
+    catalog = load_catalog(metadata_folder)
+    records = []
+
+    for filename in sorted(os.listdir(metadata_folder)):
+        if not re.match(r'^books_metadata_\d+-\d+\.json$', filename):
+            continue
+        with open(os.path.join(metadata_folder, filename), 'r', encoding='utf-8') as file:
+            for book in json.load(file):
+                if book['id_book'] not in catalog:
+                    record = dict(book)
+                    record["filename"] = f"{book['book_name']} by {book['author']}_{book['id_book']}.txt"
+                    records.append(record)
+
+    return append_to_catalog(records, metadata_folder, catalog)
+
+
+def main():
+    metadata_folder = "../Books_Metadata_Dict"
+    import_metadata_ranges(metadata_folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import json
+import os
+from bisect import bisect_right
+
+PARAGRAPHS_FOLDER = 'paragraphs'
+
+
+def paragraph_table_path(id_book, words_datamart):
+    """
+    Return the path of the paragraph table of a book.
+
+    :param id_book: The ID of the book.
+    :param words_datamart: The directory where the partial indexers are saved.
+    :return: The path of the book's paragraph table.
+    """
+    return os.path.join(words_datamart, PARAGRAPHS_FOLDER, f'{id_book}.json')
+
+
+def save_paragraph_table(paragraph_table, id_book, words_datamart):
+    """
+    Save the paragraph table of a book next to the partial indexers.
+
+    :param paragraph_table: A dictionary with the "encoding" of the book file and its "paragraphs",
+                            a list of [byte start, byte end, first token position] entries.
+    :param id_book: The ID of the book.
+    :param words_datamart: The directory where the partial indexers are saved.
+    :return: None
+    """
+    filepath = paragraph_table_path(id_book, words_datamart)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath, 'w', encoding='utf-8') as file:
+        json.dump(paragraph_table, file)
+
+
+def load_paragraph_table(id_book, words_datamart):
+    """
+    Load the paragraph table of a book.
+
+    :param id_book: The ID of the book.
+    :param words_datamart: The directory where the partial indexers are saved.
+    :return: The paragraph table, or None if the book has none.
+    """
+    filepath = paragraph_table_path(id_book, words_datamart)
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def find_paragraphs(paragraph_table, positions, max_paragraphs):
+    """
+    Map token positions to the paragraphs that contain them.
+
+    :param paragraph_table: The paragraph table of the book.
+    :param positions: Token positions inside the book.
+    :param max_paragraphs: Maximum number of paragraphs to return.
+    :return: The [byte start, byte end, first token position] entries of the first paragraphs
+             containing any of the positions, in reading order.
+    """
+    paragraphs = paragraph_table["paragraphs"]
+    first_positions = [paragraph[2] for paragraph in paragraphs]
+
+    indexes = set()
+    for position in positions:
+        index = bisect_right(first_positions, position) - 1
+        if index >= 0:
+            indexes.add(index)
+
+    return [paragraphs[index] for index in sorted(indexes)[:max_paragraphs]]
+
+
+def read_paragraphs(book_filename, paragraph_table, positions, max_paragraphs):
+    """
+    Read from the book file only the paragraphs that contain the given positions.
+
+    The encoding of the table is the best guess made while indexing, and a book can mix several,
+    so bytes that do not decode are replaced rather than failing the query.
+
+    :param book_filename: The path to the book file.
+    :param paragraph_table: The paragraph table of the book.
+    :param positions: Token positions inside the book.
+    :param max_paragraphs: Maximum number of paragraphs to read.
+    :return: A list with the text of the paragraphs, in reading order.
+    """
+    paragraphs = []
+    with open(book_filename, 'rb') as file:
+        for start, end, _ in find_paragraphs(paragraph_table, positions, max_paragraphs):
+            file.seek(start)
+            paragraphs.append(file.read(end - start).decode(paragraph_table["encoding"], errors='replace'))
+    return paragraphs
@@ -0,0 +1,216 @@
+import json
+import math
+import os
+import time
+from threading import Lock
+
+SEGMENTS_FILENAME = 'segments.json'
+SEGMENTS_FOLDER = 'segments'
+MERGE_FACTOR = 4
+MIN_SEGMENT_BYTES = 1024 * 1024
+RETIRED_GRACE = 10 * 60  # Seconds a replaced segment stays on disk for the queries still reading it
+
+# Indexing runs and compactions of the same process update the list of segments one at a time
+segments_lock = Lock()
+
+
+def segments_path(words_datamart):
+    """
+    Return the path of the list of segments of an index.
+
+    :param words_datamart: The directory where the index is stored.
+    :return: The path of the segments file.
+    """
+    return os.path.join(words_datamart, SEGMENTS_FILENAME)
+
+
+def segment_directory(words_datamart, name):
+    """
+    Return the directory where the shards of a segment are stored.
+
+    :param words_datamart: The directory where the index is stored.
+    :param name: The name of the segment.
+    :return: The path of the segment directory.
+    """
+    return os.path.join(words_datamart, SEGMENTS_FOLDER, name)
+
+
+def load_segments(words_datamart):
+    """
+    Load the list of segments of an index.
+
+    :param words_datamart: The directory where the index is stored.
+    :return: A dictionary with the "next_id" of a segment, the live "segments", oldest first, each
+             one with its "name", "books", "deleted" books (indexed again in a newer segment) and "bytes",
+             and the "retired" segments waiting to be deleted, as [name, time] pairs.
+             None if the index is not segmented.
+    """
+    filepath = segments_path(words_datamart)
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_segments(segments, words_datamart):
+    """
+    Save the list of segments, replacing the file atomically so readers always see a complete index.
+
+    :param segments: The list of segments, as returned by `load_segments`.
+    :param words_datamart: The directory where the index is stored.
+    :return: None
+    """
+    os.makedirs(words_datamart, exist_ok=True)
+    filepath = segments_path(words_datamart)
+    temporary_path = filepath + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump(segments, file)
+    os.replace(temporary_path, filepath)
+
+
+def new_segment_name(segments):
+    """
+    Reserve the name of a new segment. Names are never reused.
+
+    :param segments: The list of segments. Updated in place.
+    :return: The name of the segment.
+    """
+    name = f"seg_{segments['next_id']:06d}"
+    segments["next_id"] += 1
+    return name
+
+
+def directory_size(directory):
+    """
+    Compute the size of the files of a directory.
+
+    :param directory: The path of the directory.
+    :return: The size in bytes.
+    """
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+
+def add_segment(segments, name, books, size):
+    """
+    Add a new segment to the list. The books it contains are marked as deleted in the older segments,
+    so every book has a single live copy, and segments left without live books are dropped.
+
+    :param segments: The list of segments. Updated in place.
+    :param name: The name of the new segment.
+    :param books: The set of book IDs indexed in the new segment.
+    :param size: The size in bytes of the new segment.
+    :return: The names of the segments dropped.
+    """
+    for segment in segments["segments"]:
+        superseded = books.intersection(segment["books"])
+        if superseded:
+            segment["deleted"] = sorted(superseded.union(segment["deleted"]))
+
+    segments["segments"].append({"name": name, "books": sorted(books), "deleted": [], "bytes": size})
+    return drop_dead_segments(segments)
+
+
+def drop_dead_segments(segments):
+    """
+    Drop the segments whose books are all deleted.
+
+    :param segments: The list of segments. Updated in place.
+    :return: The names of the segments dropped.
+    """
+    dead = [segment["name"] for segment in segments["segments"]
+            if len(segment["deleted"]) >= len(segment["books"])]
+    segments["segments"] = [segment for segment in segments["segments"] if segment["name"] not in dead]
+    return dead
+
+
+def retire_segments(segments, names):
+    """
+    Schedule the deletion of segments that are no longer in the list. Their directories are kept
+    for `RETIRED_GRACE` seconds, since queries that loaded the previous list may still read them.
+
+    :param segments: The list of segments. Updated in place.
+    :param names: The names of the segments replaced or dropped.
+    :return: None
+    """
+    now = time.time()
+    segments.setdefault("retired", []).extend([name, now] for name in names)
+
+
+def expired_segments(segments, grace=RETIRED_GRACE):
+    """
+    Take the retired segments whose grace period is over out of the list, so their directories can be deleted.
+
+    :param segments: The list of segments. Updated in place.
+    :param grace: Seconds a retired segment is kept.
+    :return: The names of the segments to delete.
+    """
+    now = time.time()
+    retired = segments.get("retired", [])
+    segments["retired"] = [[name, retired_at] for name, retired_at in retired if now - retired_at < grace]
+    return [name for name, retired_at in retired if now - retired_at >= grace]
+
+
+def segment_tier(segment, merge_factor=MERGE_FACTOR, min_bytes=MIN_SEGMENT_BYTES):
+    """
+    Return the size tier of a segment: segments up to `min_bytes` are in tier 0, and each
+    following tier holds segments `merge_factor` times bigger.
+
+    :param segment: A segment of the list.
+    :param merge_factor: The number of segments of a tier merged together.
+    :param min_bytes: The size of the smallest tier.
+    :return: The tier number.
+    """
+    if segment["bytes"] <= min_bytes:
+        return 0
+    return int(math.log(segment["bytes"] / min_bytes, merge_factor)) + 1
+
+
+def select_merge(segments, merge_factor=MERGE_FACTOR, min_bytes=MIN_SEGMENT_BYTES):
+    """
+    Apply the tiered merge policy: pick the `merge_factor` oldest segments of the lowest tier
+    that has that many. Each book is written again once per tier, so the write cost of a run stays
+    small, and there are at most `merge_factor - 1` segments per tier left to read at query time.
+
+    :param segments: The list of segments.
+    :param merge_factor: The number of segments of a tier merged together.
+    :param min_bytes: The size of the smallest tier.
+    :return: The segments to merge, oldest first, or an empty list if no tier is full.
+    """
+    tiers = {}
+    for segment in segments["segments"]:
+        tiers.setdefault(segment_tier(segment, merge_factor, min_bytes), []).append(segment)
+
+    for tier in sorted(tiers):
+        if len(tiers[tier]) >= merge_factor:
+            return tiers[tier][:merge_factor]
+    return []
+
+
+def replace_segments(segments, merged, name, books, size, snapshot):
+    """
+    Replace merged segments with the segment they were merged into.
+
+    Books indexed again while the merge was running were deleted from the merged segments after
+    `snapshot` was taken, so they are deleted from the new segment too.
+
+    :param segments: The current list of segments. Updated in place.
+    :param merged: The names of the segments merged.
+    :param name: The name of the new segment.
+    :param books: The set of book IDs of the new segment.
+    :param size: The size in bytes of the new segment.
+    :param snapshot: A dictionary with the deleted books of every merged segment when the merge started.
+    :return: The names of the segments dropped because all their books are deleted.
+    """
+    deleted = set()
+    position = None
+    for index, segment in enumerate(segments["segments"]):
+        if segment["name"] in merged:
+            deleted.update(set(segment["deleted"]) - snapshot[segment["name"]])
+            if position is None:
+                position = index
+
+    remaining = [segment for segment in segments["segments"] if segment["name"] not in merged]
+    remaining.insert(position, {"name": name, "books": sorted(books), "deleted": sorted(deleted & books),
+                                "bytes": size})
+    segments["segments"] = remaining
+    return drop_dead_segments(segments)
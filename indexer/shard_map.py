@@ -0,0 +1,107 @@
+import json
+import os
+import zlib
+from bisect import bisect_right
+
+SHARD_MAP_FILENAME = 'shard_map.json'
+LETTER_SHARD_MAP = {"scheme": "letter"}
+
+
+def hash_shard_map(num_shards):
+    """
+    Create a shard map that spreads the words over `num_shards` hash buckets.
+
+    :param num_shards: The number of shards.
+    :return: The shard map.
+    """
+    return {"scheme": "hash", "shards": num_shards}
+
+
+def prefix_shard_map(word_weights, num_shards):
+    """
+    Create a shard map of sorted word ranges with about the same weight each.
+
+    :param word_weights: A dictionary mapping every word of the vocabulary to its weight, see `vocabulary_weights`.
+    :param num_shards: The number of shards.
+    :return: The shard map. Its "boundaries" are the first word of every range.
+    """
+    total_weight = sum(word_weights.values())
+    boundaries = ['']
+    accumulated = 0
+
+    for word in sorted(word_weights):
+        if accumulated >= total_weight * len(boundaries) / num_shards and len(boundaries) < num_shards:
+            boundaries.append(word)
+        accumulated += word_weights[word]
+
+    return {"scheme": "prefix", "boundaries": boundaries}
+
+
+def vocabulary_weights(indexer, word_weights=None):
+    """
+    Measure the postings of every word of an indexer: one unit per book and per position.
+
+    :param indexer: A dictionary with words and their indexes.
+    :param word_weights: An optional dictionary to add the weights to.
+    :return: A dictionary mapping words to their weights.
+    """
+    word_weights = {} if word_weights is None else word_weights
+    for word, data in indexer.items():
+        word_weights[word] = word_weights.get(word, 0) + len(data) + sum(map(len, data.values()))
+    return word_weights
+
+
+def shard_for(word, shard_map):
+    """
+    Route a word to its shard.
+
+    :param word: The word.
+    :param shard_map: The shard map of the index.
+    :return: The key of the shard, used in the name of its files.
+    """
+    scheme = shard_map["scheme"]
+    if scheme == "hash":
+        return f"h{zlib.crc32(word.encode('utf-8')) % shard_map['shards']:03d}"
+    if scheme == "prefix":
+        return f"p{bisect_right(shard_map['boundaries'], word) - 1:03d}"
+    return word[0].lower()
+
+
+def shard_map_path(shards_directory):
+    """
+    Return the path of the shard map of a directory of shards.
+
+    :param shards_directory: The directory where the partial indexers are saved.
+    :return: The path of the shard map file.
+    """
+    return os.path.join(shards_directory, SHARD_MAP_FILENAME)
+
+
+def load_shard_map(shards_directory):
+    """
+    Load the shard map of a directory of shards.
+
+    :param shards_directory: The directory where the partial indexers are saved.
+    :return: The shard map, or the first letter map for directories written without one.
+    """
+    filepath = shard_map_path(shards_directory)
+    if not os.path.exists(filepath):
+        return LETTER_SHARD_MAP
+    with open(filepath, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_shard_map(shard_map, shards_directory):
+    """
+    Save the shard map of a directory of shards.
+
+    :param shard_map: The shard map.
+    :param shards_directory: The directory where the partial indexers are saved.
+    :return: None
+    """
+    os.makedirs(shards_directory, exist_ok=True)
+    filepath = shard_map_path(shards_directory)
+    temporary_path = filepath + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump(shard_map, file, ensure_ascii=False)
+    os.replace(temporary_path, filepath)
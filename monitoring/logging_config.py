@@ -0,0 +1,50 @@
+import logging
+import os
+from contextlib import contextmanager
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+# Environment variable that overrides the level of the controllers, e.g. DEBUG, WARNING or OFF
+LOG_LEVEL_VARIABLE = 'SEARCH_ENGINE_LOG_LEVEL'
+OFF = 'OFF'
+
+
+def configure_logging(level='INFO', filepath=None):
+    """
+    Configure the messages of the indexers, the query engines and the crawler, which log through the
+    `logging` module instead of printing.
+
+    :param level: The lowest level shown, as a name ('DEBUG', 'INFO', 'WARNING', 'ERROR') or a number.
+                  'OFF' or None turns the messages off. The `SEARCH_ENGINE_LOG_LEVEL` environment
+                  variable takes precedence when set.
+    :param filepath: An optional file where the messages are written instead of the standard error.
+    :return: None
+    """
+    level = os.environ.get(LOG_LEVEL_VARIABLE, level)
+    if level is None or str(level).upper() == OFF:
+        logging.disable(logging.CRITICAL)
+        return
+
+    logging.disable(logging.NOTSET)
+    handler = logging.FileHandler(filepath, encoding='utf-8') if filepath else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    root = logging.getLogger()
+    for previous_handler in root.handlers[:]:
+        root.removeHandler(previous_handler)
+        previous_handler.close()
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+
+@contextmanager
+def logging_disabled():
+    """
+    Turn every message off for the block, e.g. the timed section of a benchmark, then restore the previous
+    state, so that a level turned off by `configure_logging` stays off.
+    """
+    previous = logging.root.manager.disable
+    logging.disable(logging.CRITICAL)
+    try:
+        yield
+    finally:
+        logging.disable(previous)
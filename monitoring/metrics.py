@@ -0,0 +1,452 @@
+import json
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+# Upper bounds in seconds, from a cached shard lookup to the indexing of a large book
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+INDEXING_STAGE_SECONDS = 'indexing_stage_seconds'
+QUERY_STAGE_SECONDS = 'query_stage_seconds'
+INDEXING_STAGES = ('read', 'decode', 'tokenize', 'filter', 'merge', 'serialize')
+QUERY_STAGES = ('shard_load', 'intersect', 'metadata', 'snippet')
+
+HELP_TEXTS = {
+    'indexed_books_total': "Books indexed.",
+    'indexed_tokens_total': "Words indexed, stopwords excluded.",
+    'indexed_bytes_total': "Bytes of the book files indexed.",
+    INDEXING_STAGE_SECONDS: "Time spent in each indexing stage per book, and per flush, stripe or shard written "
+                            "for the merge and serialize of the index files.",
+    'queries_total': "Queries run against the index, answers from the result cache excluded.",
+    'query_seconds': "Time taken by a query, answers from the result cache excluded.",
+    'query_deadlines_reached_total': "Queries that returned partial results because their deadline was reached.",
+    QUERY_STAGE_SECONDS: "Time spent in each query stage per query, and per result book for metadata and snippet."
+}
+
+
+def metric_key(name, labels):
+    """
+    Build the key that identifies a metric and its labels inside a registry.
+
+    :param name: The name of the metric.
+    :param labels: A dictionary with the labels of the metric.
+    :return: A hashable tuple.
+    """
+    return name, tuple(sorted(labels.items()))
+
+
+class Counter:
+    def __init__(self, name, help_text='', labels=None):
+        """
+        Initialize a counter, a value that only goes up.
+
+        :param name: The name of the metric.
+        :param help_text: The description of the metric.
+        :param labels: A dictionary with the labels of the metric.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, amount=1):
+        """
+        Increase the counter.
+
+        :param amount: The amount added.
+        :return: None
+        """
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        """
+        :return: A JSON serializable dictionary with the state of the counter.
+        """
+        return {"type": "counter", "name": self.name, "help": self.help_text, "labels": self.labels,
+                "value": self.value}
+
+    def merge(self, snapshot):
+        """
+        Add the value of a snapshot of the same counter, taken in another process.
+
+        :param snapshot: A dictionary returned by `snapshot`.
+        :return: None
+        """
+        self.inc(snapshot["value"])
+
+
+class Histogram:
+    def __init__(self, name, help_text='', labels=None, buckets=DEFAULT_BUCKETS):
+        """
+        Initialize a histogram that counts observations into buckets, with their count and sum.
+
+        :param name: The name of the metric.
+        :param help_text: The description of the metric.
+        :param labels: A dictionary with the labels of the metric.
+        :param buckets: The sorted upper bounds of the buckets. A last bucket takes everything above them.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = Lock()
+
+    def observe(self, value):
+        """
+        Record an observation.
+
+        :param value: The value observed, usually a duration in seconds.
+        :return: None
+        """
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """
+        :return: A JSON serializable dictionary with the state of the histogram. Bucket counts are not cumulative.
+        """
+        with self.lock:
+            return {"type": "histogram", "name": self.name, "help": self.help_text, "labels": self.labels,
+                    "buckets": list(self.buckets), "counts": list(self.counts), "count": self.count, "sum": self.sum}
+
+    def merge(self, snapshot):
+        """
+        Add the observations of a snapshot of the same histogram, taken in another process.
+
+        :param snapshot: A dictionary returned by `snapshot`.
+        :return: None
+        """
+        if tuple(snapshot["buckets"]) != self.buckets:
+            raise ValueError(f"Histogram '{self.name}' has other buckets.")
+        with self.lock:
+            self.counts = [count + other for count, other in zip(self.counts, snapshot["counts"])]
+            self.count += snapshot["count"]
+            self.sum += snapshot["sum"]
+
+
+class MetricsRegistry:
+    def __init__(self, enabled=True):
+        """
+        Initialize a registry holding the metrics of the process, each one identified by its name and labels.
+
+        :param enabled: Whether the metrics are recorded. When disabled, recording does nothing.
+        """
+        self.enabled = enabled
+        self.metrics = {}
+        self.lock = Lock()
+
+    def get_or_create(self, metric_class, name, labels, **kwargs):
+        """
+        Return the metric with a name and labels, creating it the first time.
+
+        :param metric_class: Counter or Histogram.
+        :param name: The name of the metric.
+        :param labels: A dictionary with the labels of the metric.
+        :param kwargs: The other arguments of the metric class.
+        :return: The metric.
+        """
+        key = metric_key(name, labels)
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = metric_class(name, labels=labels, **kwargs)
+                    self.metrics[key] = metric
+        return metric
+
+    def counter(self, name, help_text='', **labels):
+        """
+        :return: The Counter with this name and labels.
+        """
+        return self.get_or_create(Counter, name, labels, help_text=help_text or HELP_TEXTS.get(name, ''))
+
+    def histogram(self, name, help_text='', buckets=DEFAULT_BUCKETS, **labels):
+        """
+        :return: The Histogram with this name and labels.
+        """
+        return self.get_or_create(Histogram, name, labels, help_text=help_text or HELP_TEXTS.get(name, ''),
+                                  buckets=buckets)
+
+    def snapshot(self):
+        """
+        :return: A list with the snapshot of every metric, sorted by name and labels.
+        """
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        return [metric.snapshot() for _, metric in metrics]
+
+    def merge(self, snapshots):
+        """
+        Add the metrics recorded by another process, such as an indexing worker.
+
+        :param snapshots: A list returned by `snapshot` or `collect`.
+        :return: None
+        """
+        if not self.enabled:
+            return
+        for snapshot in snapshots:
+            if snapshot["type"] == "counter":
+                metric = self.counter(snapshot["name"], snapshot["help"], **snapshot["labels"])
+            else:
+                metric = self.histogram(snapshot["name"], snapshot["help"], snapshot["buckets"], **snapshot["labels"])
+            metric.merge(snapshot)
+
+    def reset(self):
+        """
+        Remove every metric.
+
+        :return: None
+        """
+        with self.lock:
+            self.metrics = {}
+
+    def collect(self):
+        """
+        Take a snapshot and reset the registry. Used by worker processes to hand their metrics to the parent.
+
+        :return: A list returned by `snapshot`.
+        """
+        snapshots = self.snapshot()
+        self.reset()
+        return snapshots
+
+
+# The registry of the process, used by the indexers and the query engines
+registry = MetricsRegistry()
+
+
+def increment(name, amount=1, **labels):
+    """
+    Increase a counter of the process registry.
+
+    :param name: The name of the counter.
+    :param amount: The amount added.
+    :param labels: The labels of the counter.
+    :return: None
+    """
+    if registry.enabled:
+        registry.counter(name, **labels).inc(amount)
+
+
+def observe(name, value, **labels):
+    """
+    Record an observation in a histogram of the process registry.
+
+    :param name: The name of the histogram.
+    :param value: The value observed.
+    :param labels: The labels of the histogram.
+    :return: None
+    """
+    if registry.enabled:
+        registry.histogram(name, **labels).observe(value)
+
+
+@contextmanager
+def timed(name, **labels):
+    """
+    Observe the time taken by the block in a histogram of the process registry.
+
+    :param name: The name of the histogram.
+    :param labels: The labels of the histogram.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def reset_metrics():
+    """
+    Empty the process registry. Used as the initializer of worker processes, which would otherwise
+    report again the metrics they inherited from their parent.
+
+    :return: None
+    """
+    registry.reset()
+
+
+def run_and_collect(function, *args):
+    """
+    Run a function inside a worker process and hand the metrics it recorded to the parent, which adds
+    them to its registry with `registry.merge`.
+
+    :param function: The function to run.
+    :param args: Its arguments.
+    :return: A tuple with the value returned by the function and the metrics recorded while it ran.
+    """
+    return function(*args), registry.collect()
+
+
+class StageTimer:
+    def __init__(self, metric_name, **labels):
+        """
+        Initialize a timer that adds up the time spent in each stage of one unit of work, such as a book,
+        and observes every stage once in the `metric_name` histogram, labelled with `stage`.
+
+        Stages interleaved many times, like the decoding and tokenizing of each paragraph, are added
+        with `add` so the hot loops only pay for `time.perf_counter`.
+
+        :param metric_name: The name of the histogram, or None for a timer that records nothing.
+        :param labels: The other labels of the histogram.
+        """
+        self.metric_name = metric_name
+        self.labels = labels
+        self.totals = {}
+
+    def add(self, stage, seconds):
+        """
+        Add time to a stage.
+
+        :param stage: The name of the stage.
+        :param seconds: The time spent.
+        :return: None
+        """
+        self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage):
+        """
+        Add the time taken by the block to a stage.
+
+        :param stage: The name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def observe(self):
+        """
+        Observe the time of every stage and start again from zero.
+
+        :return: None
+        """
+        if self.metric_name is not None:
+            for stage, seconds in self.totals.items():
+                observe(self.metric_name, seconds, **self.labels, stage=stage)
+        self.totals = {}
+
+
+# A timer for the callers that do not measure stages
+NULL_TIMER = StageTimer(None)
+
+
+def format_labels(labels):
+    """
+    Format labels in the Prometheus text format.
+
+    :param labels: A dictionary with the labels.
+    :return: A string like '{stage="read"}', or an empty string.
+    """
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def format_prometheus(snapshots):
+    """
+    Format metrics in the Prometheus text exposition format.
+
+    :param snapshots: A list returned by `MetricsRegistry.snapshot`.
+    :return: The text, one sample per line.
+    """
+    lines = []
+    described = set()
+
+    for snapshot in snapshots:
+        name = snapshot["name"]
+        if name not in described:
+            described.add(name)
+            if snapshot["help"]:
+                lines.append(f"# HELP {name} {snapshot['help']}")
+            lines.append(f"# TYPE {name} {snapshot['type']}")
+
+        labels = snapshot["labels"]
+        if snapshot["type"] == "counter":
+            lines.append(f"{name}{format_labels(labels)} {snapshot['value']}")
+            continue
+
+        cumulative = 0
+        for bound, count in zip(snapshot["buckets"] + ["+Inf"], snapshot["counts"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{format_labels(dict(labels, le=bound))} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(labels)} {snapshot['sum']}")
+        lines.append(f"{name}_count{format_labels(labels)} {snapshot['count']}")
+
+    return '\n'.join(lines) + '\n'
+
+
+class PrometheusTextSink:
+    def __init__(self, filepath):
+        """
+        Initialize a sink that writes the metrics to a file in the Prometheus text format, which the
+        textfile collector of the node exporter can scrape.
+
+        :param filepath: The path of the `.prom` file. It is replaced on every export.
+        """
+        self.filepath = filepath
+
+    def export(self, snapshots):
+        """
+        Write the metrics, replacing the file atomically so a scrape never reads half of it.
+
+        :param snapshots: A list returned by `MetricsRegistry.snapshot`.
+        :return: None
+        """
+        directory = os.path.dirname(self.filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = self.filepath + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            file.write(format_prometheus(snapshots))
+        os.replace(temporary_path, self.filepath)
+
+
+class JsonLinesSink:
+    def __init__(self, filepath):
+        """
+        Initialize a sink that appends the metrics to a JSON lines file, one line per export.
+
+        :param filepath: The path of the file.
+        """
+        self.filepath = filepath
+
+    def export(self, snapshots):
+        """
+        Append the metrics with the time of the export.
+
+        :param snapshots: A list returned by `MetricsRegistry.snapshot`.
+        :return: None
+        """
+        directory = os.path.dirname(self.filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.filepath, 'a', encoding='utf-8') as file:
+            file.write(json.dumps({"timestamp": time.time(), "metrics": snapshots}, ensure_ascii=False) + '\n')
+
+
+def export_metrics(sinks, metrics_registry=None):
+    """
+    Export the metrics of a registry to every sink. A sink is any object with an `export(snapshots)` method.
+
+    :param sinks: The sinks, such as PrometheusTextSink and JsonLinesSink.
+    :param metrics_registry: The registry exported. Defaults to the registry of the process.
+    :return: None
+    """
+    snapshots = (metrics_registry or registry).snapshot()
+    for sink in sinks:
+        sink.export(snapshots)
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    # Entries always kept by `evict`, even over the limits
+    min_entries = 0
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        """
+        Initialize the bookkeeping shared by the caches of the query engine: entries in least recently used
+        order, their total size and the usage statistics. Every entry is a tuple whose last item is its size.
+
+        :param max_entries: Maximum number of entries. None means no limit.
+        :param max_bytes: Maximum total size of the entries. None means no limit.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def insert(self, key, entry):
+        """
+        Add or replace an entry as the most recently used one, then evict. The caller must hold `lock`.
+
+        :param key: The key of the entry.
+        :param entry: A tuple whose last item is the size of the entry.
+        :return: None
+        """
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = entry
+        self.total_bytes += entry[-1]
+        self.evict()
+
+    def remove(self, key):
+        """
+        Drop an entry from the cache. The caller must hold `lock`.
+
+        :param key: The key of the entry.
+        :return: None
+        """
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry[-1]
+
+    def evict(self):
+        """
+        Drop least recently used entries until the cache is within its limits. The caller must hold `lock`.
+        The `min_entries` most recent entries are always kept.
+
+        :return: None
+        """
+        while len(self.entries) > self.min_entries and (
+                (self.max_entries is not None and len(self.entries) > self.max_entries) or
+                (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Drop every entry, keeping the statistics.
+
+        :return: None
+        """
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        """
+        Report the usage of the cache.
+
+        :return: A dictionary with hits, misses, hit ratio, invalidations, evictions, entries and bytes.
+        """
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / requests if requests else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes
+            }
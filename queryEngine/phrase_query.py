@@ -0,0 +1,168 @@
+import re
+from bisect import bisect_left
+
+from indexer.analyzer import get_analyzer
+
+QUERY_TOKEN_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+NEAR_PATTERN = re.compile(r'^NEAR/(\d+)$')
+
+
+def parse_query(input_query, analyzer=None):
+    """
+    Parse a query into clauses that are evaluated over the positions stored in the index.
+
+    - A plain word is a clause on its own.
+    - Words between double quotes form a phrase: they must appear at consecutive positions.
+    - `a NEAR/k b` requires `b` to appear at most `k` positions before or after `a`.
+      NEAR can join words and phrases, and can be chained.
+
+    Every book has to satisfy all the clauses. Words are normalized by the same analyzer as at index time,
+    so stopwords are dropped and do not take a position inside phrases either.
+
+    :param input_query: The search query.
+    :param analyzer: The Analyzer used by the indexer. Defaults to the one with the shared stopwords.
+    :return: A list of clauses. Each clause is a dictionary with its "words" and the "gaps" between
+             consecutive words as (maximum distance, ordered) tuples.
+    """
+    analyzer = analyzer or get_analyzer()
+    clauses = []
+    near_distance = None
+
+    for match in QUERY_TOKEN_PATTERN.finditer(input_query):
+        phrase, token = match.groups()
+
+        if token is not None:
+            near = NEAR_PATTERN.match(token)
+            if near:
+                near_distance = int(near.group(1))
+                continue
+            text = token
+        else:
+            text = phrase
+
+        words = analyzer.analyze(text)
+        if not words:
+            continue
+        clause = {"words": words, "gaps": [(1, True)] * (len(words) - 1)}
+
+        if near_distance is not None and clauses:
+            previous = clauses.pop()
+            clause = {"words": previous["words"] + clause["words"],
+                      "gaps": previous["gaps"] + [(near_distance, False)] + clause["gaps"]}
+        near_distance = None
+        clauses.append(clause)
+
+    return clauses
+
+
+def is_positional(clauses):
+    """
+    Check if any clause needs positions, this is, if the query has a phrase or a NEAR operator.
+
+    :param clauses: The clauses returned by `parse_query`.
+    :return: True if at least one clause has more than one word.
+    """
+    return any(clause["gaps"] for clause in clauses)
+
+
+def query_words(clauses):
+    """
+    Return the distinct words of the clauses, in the order they appear in the query.
+
+    :param clauses: The clauses returned by `parse_query`.
+    :return: A list of words.
+    """
+    words = []
+    for clause in clauses:
+        for word in clause["words"]:
+            if word not in words:
+                words.append(word)
+    return words
+
+
+def extend_match(match, position_lists, gaps):
+    """
+    Try to complete a partial match with positions of the next words of the clause.
+
+    :param match: The positions matched so far, one for each of the first words of the clause.
+    :param position_lists: The sorted positions of every word of the clause in a book.
+    :param gaps: The (maximum distance, ordered) constraint between each pair of consecutive words.
+    :return: A tuple with one position for each word, or None if the match cannot be completed.
+    """
+    index = len(match)
+    if index == len(position_lists):
+        return tuple(match)
+
+    distance, ordered = gaps[index - 1]
+    previous = match[-1]
+    positions = position_lists[index]
+    low = previous + 1 if ordered else previous - distance
+    high = previous + distance
+
+    i = bisect_left(positions, low)
+    while i < len(positions) and positions[i] <= high:
+        if positions[i] != previous:
+            result = extend_match(match + [positions[i]], position_lists, gaps)
+            if result:
+                return result
+        i += 1
+    return None
+
+
+def match_clause(clause, book_postings):
+    """
+    Find the occurrences of a clause in a book by intersecting the position lists of its words.
+
+    :param clause: A clause returned by `parse_query`.
+    :param book_postings: A dictionary mapping each word to its sorted positions in the book.
+    :return: A list of matches, each one a tuple with the position of every word of the clause.
+    """
+    position_lists = [book_postings[word] for word in clause["words"]]
+    matches = []
+    for start in position_lists[0]:
+        match = extend_match([start], position_lists, clause["gaps"])
+        if match:
+            matches.append(match)
+    return matches
+
+
+def match_book(clauses, word_postings, book_key):
+    """
+    Check if a book that contains every query word satisfies all the clauses.
+
+    :param clauses: The clauses returned by `parse_query`.
+    :param word_postings: A dictionary mapping each query word to its postings ({book key: [positions]}).
+    :param book_key: The key of the book.
+    :return: The list of matches of all the clauses, or None if a clause does not match.
+    """
+    book_postings = {word: postings[book_key] for word, postings in word_postings.items()}
+    book_matches = []
+    for clause in clauses:
+        clause_matches = match_clause(clause, book_postings)
+        if not clause_matches:
+            return None
+        book_matches.extend(clause_matches)
+    return book_matches
+
+
+def evaluate_clauses(clauses, word_postings):
+    """
+    Resolve the books that satisfy every clause using only the index.
+
+    :param clauses: The clauses returned by `parse_query`.
+    :param word_postings: A dictionary mapping each query word to its postings ({book key: [positions]}).
+    :return: A dictionary mapping each matching book key to the list of matches of all its clauses.
+    """
+    common_books = None
+    for postings in word_postings.values():
+        if common_books is None:
+            common_books = set(postings.keys())
+        else:
+            common_books &= set(postings.keys())
+
+    results = {}
+    for book_key in common_books or ():
+        book_matches = match_book(clauses, word_postings, book_key)
+        if book_matches:
+            results[book_key] = book_matches
+    return results
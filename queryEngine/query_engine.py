@@ -1,106 +1,200 @@
-import glob
 import json
+import logging
 import os
 import re
+import time
+from bisect import bisect_right
 
+from data_model.object_type.Word import WORD_EXTENSION, Word
+from indexer.analyzer import get_analyzer
+from indexer.indexer import load_doc_table
+from indexer.metadata_catalog import load_catalog
+from monitoring.metrics import QUERY_STAGE_SECONDS, StageTimer, increment, observe
+from queryEngine.phrase_query import evaluate_clauses, is_positional, parse_query, query_words
 
-# uncomment if using memory usage test
-# from memory_profiler import profile
+ENGINE_NAME = 'query_engine'
 
+logger = logging.getLogger(__name__)
 
-def find_book(book_id, book_folder):
+
+def find_book(book_id, book_folder, catalog=None):
     """
     Searches for a book file in the specified folder by its ID.
 
-    This function looks for a file that ends with '_{book_id}.txt' in the provided
-    book folder and returns the full path if found.
+    The file name is taken from the metadata catalog when the book is in it. Otherwise, this
+    function looks for a file that ends with '_{book_id}.txt' in the provided book folder
+    and returns the full path if found.
 
     :param book_id: The ID of the book to search for.
     :param book_folder: The folder where the book files are stored.
+    :param catalog: An optional metadata catalog, as returned by `load_catalog`.
     :return: The full path to the book file if found, otherwise None.
     """
+    if catalog and book_id in catalog:
+        return os.path.join(book_folder, catalog[book_id]["filename"])
+
     for filename in os.listdir(book_folder):
         if filename.endswith(f"_{book_id}.txt"):  # find file that ends with _{book_id}.txt
             return os.path.join(book_folder, filename)
     return None
 
 
-# uncomment if using memory usage test
-# @profile
-def query_engine(input, book_folder, index_folder, max_occurrences=3):
-    input = input.lower()
-    words = input.split()
-    results = []
-    loaded_words = {}
-
-    # save the JSON objects
-    for filepath in glob.glob(f"{index_folder}/*.json"):
-        with open(filepath, "r") as file:
-            data = json.load(file)
-
-            if "id_name" in data and "dictionary" in data:
-                word_key = data["id_name"]
-                dictionary_info = data["dictionary"]
-                loaded_words[word_key] = {"dictionary": dictionary_info}
-            else:
-                print(f"Invalid structure in file: {filepath}")
-
-    # Check if all the words are there
-    words_looked_for = all(word in loaded_words for word in words)
-
-    if words_looked_for:
-        books_in_common = None
-        for word in words:
-            word_info = loaded_words[word]["dictionary"]
-            if books_in_common is None:
-                books_in_common = set(word_info.keys())
-            else:
-                books_in_common &= set(word_info.keys())
-
-        if books_in_common:
-            for book_key in books_in_common:
-
-                book_info = book_key.split(" by ")
-                book_name = book_info[0].strip()
-                author_and_id = book_info[1].split(" - ")
-                author_name = author_and_id[0].strip()
-                book_id = author_and_id[1].strip()
-
-                book_filename = find_book(book_id, book_folder)
-
-                if book_filename:
-                    try:
-                        with open(book_filename, "r", encoding="utf-8") as file:  # we have to specify the encoding
-                            text = file.read()
-
-                        paragraphs = text.split('\n\n')
-                        relevant_paragraphs = []
-                        occurrences = 0
+def load_word(word, index_folder, doc_table=None):
+    """
+    Loads the dictionary of a word from its Word file, or from the JSON file of an older index.
 
-                        word_pattern = re.compile(rf"\b{input}\b", re.IGNORECASE)
+    :param word: The word to load.
+    :param index_folder: The folder where the Word files are stored.
+    :param doc_table: The table mapping book IDs to book keys. Loaded from `index_folder` if not given.
+    :return: The word's dictionary ({book key: positions}), or None if the word is not indexed.
+             Books missing from the doc table are left out.
+    """
+    word_filepath = os.path.join(index_folder, f"{word}{WORD_EXTENSION}")
+    if os.path.exists(word_filepath):
+        if doc_table is None:
+            doc_table = load_doc_table(index_folder)
+        with open(word_filepath, "rb") as file:
+            word_obj = Word.from_bytes(file.read())
+        dictionary = {}
+        for doc_id, positions in word_obj.dictionary.items():
+            dictionary_key = doc_table.get(str(doc_id))
+            if dictionary_key is None:
+                logger.warning(f"Book ID {doc_id} of the word '{word}' is not in the doc table, skipped.")
+                continue
+            dictionary[dictionary_key] = positions
+        return dictionary
+
+    filepath = os.path.join(index_folder, f"{word}.json")
+    if not os.path.exists(filepath):
+        return None
+
+    with open(filepath, "r", encoding="utf-8") as file:
+        data = json.load(file)
+
+    if "id_name" in data and "dictionary" in data:
+        return data["dictionary"]
+    logger.warning(f"Invalid structure in file: {filepath}")
+    return None
 
-                        for paragraph in paragraphs:
-                            if word_pattern.search(paragraph):
-                                occurrences += len(word_pattern.findall(paragraph))
 
-                                highlighted_paragraph = word_pattern.sub(f"\033[94m{input}\033[0m", paragraph)
-                                relevant_paragraphs.append(highlighted_paragraph.strip())
+def matched_paragraphs(paragraphs, matches, max_occurrences):
+    """
+    Pick the paragraphs of a book where its matches start. Positions are counted as `indexer5` counts
+    them, the words kept by the analyzer in reading order starting at 1. Words never span a blank line,
+    so counting them paragraph by paragraph gives the same positions as counting them over the whole text.
+
+    :param paragraphs: The paragraphs of the book, in reading order.
+    :param matches: The matches of the query in the book, as tuples of word positions.
+    :param max_occurrences: Maximum number of paragraphs to return.
+    :return: A list with the paragraphs, in reading order.
+    """
+    analyzer = get_analyzer()
+    starts = sorted({min(match) for match in matches})
+    selected = []
+    index = 0
+    position = 1  # Position of the first word of the next paragraph
+
+    for paragraph in paragraphs:
+        position += len(analyzer.analyze(paragraph))
+        if starts[index] < position:
+            selected.append(paragraph)
+            index = bisect_right(starts, position - 1)
+            if len(selected) == max_occurrences or index == len(starts):
+                break
+    return selected
+
+
+def query_engine(input, book_folder, index_folder, max_occurrences=3, metadata_folder=None):
+    """
+    Searches the Word files for the books that contain the query and returns relevant paragraphs.
 
-                        if relevant_paragraphs:
-                            results.append({
-                                "book_name": book_name,
-                                "author_name": author_name,
-                                "URL": f'https://www.gutenberg.org/files/{book_id}/{book_id}-0.txt',
-                                "paragraphs": relevant_paragraphs[:max_occurrences],
-                                "total_occurrences": occurrences
-                            })
+    A query without operators is looked for as a phrase. Phrases between double quotes and
+    proximity operators (`word NEAR/k word`) can be combined. Matching books and their number of
+    occurrences are resolved from the positions stored in the word files; book text is only read
+    to extract the paragraphs.
 
-                    except FileNotFoundError:
-                        print(f"Error: The Book {book_filename} was not found.")
+    :param input: The search query.
+    :param book_folder: The folder where the book files are stored.
+    :param index_folder: The folder where the Word files are stored.
+    :param max_occurrences: Maximum number of paragraphs to return for each book.
+    :param metadata_folder: Optional folder with the metadata catalog, used to locate the book files.
+    :return: List of dictionaries with book information and paragraphs containing the search words.
+    """
+    clauses = parse_query(input)
+    words = query_words(clauses)
+    if len(clauses) > 1 and not is_positional(clauses):
+        # Repeated words keep their place in the phrase
+        phrase = [word for clause in clauses for word in clause["words"]]
+        clauses = [{"words": phrase, "gaps": [(1, True)] * (len(phrase) - 1)}]
+    results = []
+    loaded_words = {}
+    start = time.perf_counter()
+    increment('queries_total', engine=ENGINE_NAME)
+    timer = StageTimer(QUERY_STAGE_SECONDS, engine=ENGINE_NAME)
 
+    # Load only the Word files of the words looked for
+    with timer.stage('shard_load'):
+        doc_table = load_doc_table(index_folder)
+        for word in words:
+            dictionary_info = load_word(word, index_folder, doc_table)
+            if dictionary_info is None:
+                break
+            loaded_words[word] = dictionary_info
+    if len(loaded_words) < len(words):
+        timer.observe()
+        observe('query_seconds', time.perf_counter() - start, engine=ENGINE_NAME)
+        return results  # Exit early if any word is missing
+
+    with timer.stage('intersect'):
+        book_matches = evaluate_clauses(clauses, loaded_words)
+    timer.observe()
+    if not book_matches:
+        observe('query_seconds', time.perf_counter() - start, engine=ENGINE_NAME)
+        return results
+
+    with timer.stage('metadata'):
+        catalog = load_catalog(metadata_folder) if metadata_folder else None
+    word_pattern = re.compile(rf"\b(?:{'|'.join(re.escape(word) for word in words)})\b", re.IGNORECASE)
+
+    for book_key, matches in book_matches.items():
+
+        book_info = book_key.split(" by ")
+        book_name = book_info[0].strip()
+        author_and_id = book_info[1].split(" - ")
+        author_name = author_and_id[0].strip()
+        book_id = author_and_id[1].strip()
+
+        # The book key already holds the file name; the folder is only listed if the file was renamed
+        with timer.stage('metadata'):
+            book_filename = os.path.join(book_folder, f"{book_name} by {author_name}_{book_id}.txt")
+            if not os.path.exists(book_filename):
+                book_filename = find_book(book_id, book_folder, catalog)
+
+        if book_filename:
+            snippet_start = time.perf_counter()
+            try:
+                with open(book_filename, "r", encoding="utf-8") as file:  # we have to specify the encoding
+                    text = file.read()
+
+                paragraphs = matched_paragraphs(text.split('\n\n'), matches, max_occurrences)
+                relevant_paragraphs = [
+                    word_pattern.sub(lambda found: f"\033[94m{found.group(0)}\033[0m", paragraph).strip()
+                    for paragraph in paragraphs
+                ]
+
+                if relevant_paragraphs:
+                    results.append({
+                        "book_name": book_name,
+                        "author_name": author_name,
+                        "URL": f'https://www.gutenberg.org/files/{book_id}/{book_id}-0.txt',
+                        "paragraphs": relevant_paragraphs,
+                        "total_occurrences": len(matches)
+                    })
+
+            except FileNotFoundError:
+                logger.error(f"The Book {book_filename} was not found.")
+            timer.add('snippet', time.perf_counter() - snippet_start)
+        timer.observe()
+
+    observe('query_seconds', time.perf_counter() - start, engine=ENGINE_NAME)
     return results
-
-# uncomment if doing memory usage tests
-# book_datamart_folder = "../Books_Datamart"
-# indexer_folder = "../Words_Datamart"
-# query_engine("wife", book_datamart_folder, indexer_folder)
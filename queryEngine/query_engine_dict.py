@@ -1,151 +1,494 @@
 import json
+import logging
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
+from data_model.postings_codec import BINARY_EXTENSION, lexicon_path_for, lookup_term, postings_size, read_binary_index
+from indexer.doc_lengths import doc_lengths_path, load_doc_lengths
+from indexer.index_generation import read_generation
+from indexer.metadata_catalog import catalog_path, load_catalog
+from indexer.paragraph_index import load_paragraph_table, read_paragraphs
+from indexer.segments import load_segments, segment_directory, segments_path
+from indexer.shard_map import LETTER_SHARD_MAP, load_shard_map, shard_for, shard_map_path
+from queryEngine.phrase_query import match_book, parse_query, query_words
+from monitoring.metrics import QUERY_STAGE_SECONDS, StageTimer, increment, observe, timed
+from queryEngine.ranking import top_k_books
 
-# uncomment if using memory usage test
-# from memory_profiler import profile
+ENGINE_NAME = 'query_engine_dict'
 
+# Reading books is mostly waiting on the disk, so there are a few more threads than cores
+SNIPPET_WORKERS = min(16, (os.cpu_count() or 1) + 4)
 
-def load_json_index(word, index_folder):
+# Shared by every query of the process, so concurrent queries do not read more books at once than this
+snippet_executor = ThreadPoolExecutor(max_workers=SNIPPET_WORKERS, thread_name_prefix='snippets')
+
+logger = logging.getLogger(__name__)
+
+
+def read_json_file(filepath):
+    """
+    Parse a JSON file.
+
+    :param filepath: The path of the JSON file.
+    :return: The parsed content.
+    """
+    with open(filepath, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def load_cached(filepath, loader, cache=None, key=None, sizeof=None):
+    """
+    Call `loader`, going through the shard cache when one is given.
+
+    :param filepath: The path of the file read by `loader`, used to detect stale entries.
+    :param loader: A function without arguments that reads the file.
+    :param cache: An optional ShardCache.
+    :param key: The cache key, defaults to `filepath`.
+    :param sizeof: A function that returns the size of the value, when it is not the whole file.
+    :return: The value returned by `loader`.
+    """
+    if cache is None:
+        return loader()
+    return cache.get(filepath, loader, key=key, sizeof=sizeof)
+
+
+def route_word(word, index_folder, cache=None):
     """
-    Loads the JSON file for the word's index based on its first letter.
+    Find the shard a word is stored in, following the shard map saved with the index.
+
+    :param word: The word to route.
+    :param index_folder: The directory containing the index files.
+    :param cache: An optional ShardCache that keeps the shard map between queries.
+    :return: The key of the shard, used in the name of its files.
+    """
+    filepath = shard_map_path(index_folder)
+    if os.path.exists(filepath):
+        shard_map = load_cached(filepath, lambda: load_shard_map(index_folder), cache)
+    else:
+        shard_map = LETTER_SHARD_MAP
+    return shard_for(word, shard_map)
+
+
+def load_json_index(word, index_folder, cache=None):
+    """
+    Loads the JSON file for the word's index based on its shard.
 
     :param word: The word whose index is to be loaded.
     :param index_folder: The directory containing the index JSON files.
+    :param cache: An optional ShardCache that keeps parsed shards between queries.
     :return: A dictionary with the index data, or an empty dictionary if the file is not found.
     """
-    first_letter = word[0].lower()
-    json_path = os.path.join(index_folder, f'indexer_{first_letter}.json')
+    shard = route_word(word, index_folder, cache)
+    json_path = os.path.join(index_folder, f'indexer_{shard}.json')
 
     if os.path.exists(json_path):
-        with open(json_path, 'r', encoding='utf-8') as file:
-            return json.load(file)
+        return load_cached(json_path, lambda: read_json_file(json_path), cache)
     else:
-        print(f"Index file for letter '{first_letter}' not found.")
+        logger.debug(f"Index file for shard '{shard}' not found.")
+        return {}
+
+
+def load_index(word, index_folder, cache=None):
+    """
+    Loads the index of the word's shard, preferring the binary postings file
+    `indexer_{shard}.bin` over the JSON one when both exist.
+
+    :param word: The word whose index is to be loaded.
+    :param index_folder: The directory containing the index files.
+    :param cache: An optional ShardCache that keeps parsed shards between queries.
+    :return: A dictionary with the index data, or an empty dictionary if no file is found.
+    """
+    shard = route_word(word, index_folder, cache)
+    binary_path = os.path.join(index_folder, f'indexer_{shard}{BINARY_EXTENSION}')
+
+    if os.path.exists(binary_path):
+        return load_cached(binary_path, lambda: read_binary_index(binary_path), cache)
+    return load_json_index(word, index_folder, cache)
+
+
+def load_word_postings(word, index_folder, cache=None):
+    """
+    Loads the postings of a single word, from the live segments of the index when it is segmented.
+
+    :param word: The word whose postings are to be loaded.
+    :param index_folder: The directory containing the index files.
+    :param cache: An optional ShardCache that keeps parsed shards and postings between queries.
+    :return: A dictionary mapping book IDs to positions, or None if the word is not indexed.
+    """
+    filepath = segments_path(index_folder)
+    if os.path.exists(filepath):
+        segments = load_cached(filepath, lambda: load_segments(index_folder), cache)
+        return load_segmented_postings(word, index_folder, segments, cache)
+    return load_shard_postings(word, index_folder, cache)
+
+
+def load_segmented_postings(word, index_folder, segments, cache=None):
+    """
+    Loads the postings of a single word from every live segment, skipping the books that were
+    indexed again in a newer segment.
+
+    :param word: The word whose postings are to be loaded.
+    :param index_folder: The directory containing the index files.
+    :param segments: The list of segments, as returned by `load_segments`.
+    :param cache: An optional ShardCache that keeps parsed shards and postings between queries.
+    :return: A dictionary mapping book IDs to positions, or None if the word is not in any segment.
+    """
+    postings = None
+
+    for segment in segments["segments"]:
+        directory = segment_directory(index_folder, segment["name"])
+        shard = route_word(word, directory, cache)
+        if not (os.path.exists(os.path.join(directory, f'indexer_{shard}{BINARY_EXTENSION}')) or
+                os.path.exists(os.path.join(directory, f'indexer_{shard}.json'))):
+            continue
+
+        segment_postings = load_shard_postings(word, directory, cache)
+        if segment_postings:
+            deleted = set(segment["deleted"])
+            postings = postings or {}
+            postings.update((book_id, positions) for book_id, positions in segment_postings.items()
+                            if book_id not in deleted)
+
+    return postings or None
+
+
+def load_shard_postings(word, index_folder, cache=None):
+    """
+    Loads the postings of a single word from its shard. When the binary shard has a term dictionary,
+    only that word's record is read; otherwise the whole shard is loaded with `load_index`.
+
+    :param word: The word whose postings are to be loaded.
+    :param index_folder: The directory containing the shard files.
+    :param cache: An optional ShardCache that keeps parsed shards and postings between queries.
+    :return: A dictionary mapping book IDs to positions, or None if the word is not indexed.
+    """
+    shard = route_word(word, index_folder, cache)
+    binary_path = os.path.join(index_folder, f'indexer_{shard}{BINARY_EXTENSION}')
+
+    if os.path.exists(binary_path) and os.path.exists(lexicon_path_for(binary_path)):
+        return load_cached(binary_path, lambda: lookup_term(word, binary_path), cache, key=(binary_path, word),
+                           sizeof=postings_size)
+    return load_index(word, index_folder, cache).get(word)
+
+
+def load_index_doc_lengths(index_folder, cache=None):
+    """
+    Loads the number of words of every indexed book.
+
+    :param index_folder: The directory containing the index files.
+    :param cache: An optional ShardCache that keeps the document lengths between queries.
+    :return: A dictionary mapping book IDs to their number of words, empty for indexes built without them.
+    """
+    filepath = doc_lengths_path(index_folder)
+    if not os.path.exists(filepath):
         return {}
+    return load_cached(filepath, lambda: load_doc_lengths(index_folder), cache)
+
+
+def read_metadata_file(json_filepath):
+    """
+    Parse a metadata JSON file into a dictionary keyed by book ID.
+
+    :param json_filepath: The path of the metadata JSON file.
+    :return: A dictionary mapping book IDs to their metadata.
+    """
+    return {book['id_book']: book for book in read_json_file(json_filepath)}
 
 
-def load_metadata(book_id, metadata_folder):
+def load_books_catalog(metadata_folder, cache=None):
     """
-    Loads the metadata of a book based on its book ID.
+    Loads the metadata catalog of all the books, keyed by book ID.
+
+    :param metadata_folder: The directory containing the metadata files.
+    :param cache: An optional ShardCache that keeps the parsed catalog between queries.
+    :return: A dictionary mapping book IDs to their metadata, or None if the folder has no catalog.
+    """
+    filepath = catalog_path(metadata_folder)
+    if not os.path.exists(filepath):
+        return None
+    return load_cached(filepath, lambda: load_catalog(metadata_folder), cache)
+
+
+def load_metadata(book_id, metadata_folder, cache=None, catalog=None):
+    """
+    Loads the metadata of a book based on its book ID, from the metadata catalog or,
+    for folders written before the catalog existed, from its hundreds range JSON file.
 
     :param book_id: The ID of the book whose metadata is to be loaded.
-    :param metadata_folder: The directory containing the metadata JSON files.
+    :param metadata_folder: The directory containing the metadata files.
+    :param cache: An optional ShardCache that keeps parsed metadata files between queries.
+    :param catalog: The catalog already loaded by the caller, see `load_books_catalog`.
+                    It is loaded from the folder when not given.
     :return: A dictionary with the book's metadata, or None if not found.
     """
+    if catalog is None:
+        catalog = load_books_catalog(metadata_folder, cache)
+    if catalog is not None and book_id in catalog:
+        return catalog[book_id]
+
     hundred_range = (int(book_id) // 100) * 100
     json_filename = f"books_metadata_{hundred_range}-{hundred_range + 99}.json"
     json_filepath = os.path.join(metadata_folder, json_filename)
 
     if os.path.exists(json_filepath):
-        with open(json_filepath, 'r', encoding='utf-8') as file:
-            books_data = json.load(file)
-            for book in books_data:
-                if book['id_book'] == book_id:
-                    return book
+        books_data = load_cached(json_filepath, lambda: read_metadata_file(json_filepath), cache)
+        return books_data.get(book_id)
     return None
 
 
-def extract_paragraphs(book_filename, search_words):
+def extract_paragraphs(book_filename, search_words, highlight=True):
     """
     Extract paragraphs from the book based on occurrences dictionary and search words.
 
     :param book_filename: The path to the book file from which to extract paragraphs.
     :param search_words: A list of words to search for in the book paragraphs.
+    :param highlight: Whether to highlight the search words with ANSI colors.
     :return: A list of relevant paragraphs containing the search words.
     """
     try:
-        with open(book_filename, "r", encoding="utf-8") as file:
+        with open(book_filename, "r", encoding="utf-8", errors="replace") as file:
             text = file.read()
 
         paragraphs = text.split('\n\n')
         relevant_paragraphs = []
         occurrences = 0
-        word_patterns = {word: re.compile(rf"\b{word}\b", re.IGNORECASE) for word in search_words}
+        word_patterns = {word: re.compile(rf"\b{re.escape(word)}\b", re.IGNORECASE) for word in search_words}
 
         for paragraph in paragraphs:
             for word, pattern in word_patterns.items():
                 if pattern.search(paragraph):
                     occurrences += len(pattern.findall(paragraph))
 
-                    highlighted_paragraph = pattern.sub(f"\033[94m{word}\033[0m", paragraph)
-                    relevant_paragraphs.append(highlighted_paragraph.strip())
+                    if highlight:
+                        paragraph = pattern.sub(f"\033[94m{word}\033[0m", paragraph)
+                    relevant_paragraphs.append(paragraph.strip())
                     break
         return relevant_paragraphs, occurrences
 
     except FileNotFoundError:
-        print(f"Error: Book file not found: {book_filename}")
+        logger.error(f"Book file not found: {book_filename}")
         return [], 0
 
 
-# uncomment if using memory usage test
-# @profile
-def query_engine(input_query, index_folder, metadata_folder, book_folder, max_occurrences=3):
+def highlight_words(paragraph, search_words):
+    """
+    Highlight the search words inside a paragraph.
+
+    :param paragraph: The text of the paragraph.
+    :param search_words: A list of words to highlight.
+    :return: The paragraph with the search words highlighted, stripped of surrounding whitespace.
+    """
+    for word in search_words:
+        paragraph = re.sub(rf"\b{re.escape(word)}\b", f"\033[94m{word}\033[0m", paragraph, flags=re.IGNORECASE)
+    return paragraph.strip()
+
+
+def extract_matched_paragraphs(book_filename, book_id, index_folder, matches, search_words, max_occurrences,
+                               highlight=True):
+    """
+    Extract the paragraphs that contain the matches of a book. When the book has a paragraph table,
+    only those paragraphs are read from the file; otherwise the whole book is scanned with
+    `extract_paragraphs`.
+
+    :param book_filename: The path to the book file.
+    :param book_id: The ID of the book.
+    :param index_folder: Directory where the word index files and paragraph tables are stored.
+    :param matches: The matches of the query in the book, as tuples of token positions.
+    :param search_words: A list of words to highlight.
+    :param max_occurrences: Maximum number of paragraphs to return.
+    :param highlight: Whether to highlight the search words with ANSI colors.
+    :return: A list with the paragraphs, in reading order.
+    """
+    paragraph_table = load_paragraph_table(book_id, index_folder)
+    if paragraph_table is None:
+        paragraphs, _ = extract_paragraphs(book_filename, search_words, highlight)
+        return paragraphs[:max_occurrences]
+
+    try:
+        paragraphs = read_paragraphs(book_filename, paragraph_table, [min(match) for match in matches],
+                                     max_occurrences)
+    except FileNotFoundError:
+        logger.error(f"Book file not found: {book_filename}")
+        return []
+    if not highlight:
+        return [paragraph.strip() for paragraph in paragraphs]
+    return [highlight_words(paragraph, search_words) for paragraph in paragraphs]
+
+
+def build_result(score, book_id, matches, words, index_folder, metadata_folder, book_folder, max_occurrences,
+                 cache=None, highlight=True, catalog=None):
+    """
+    Build the result of a ranked book: load its metadata and extract its relevant paragraphs.
+
+    :param score: The score of the book.
+    :param book_id: The ID of the book.
+    :param matches: The matches of the query in the book, as tuples of token positions.
+    :param words: The words of the query.
+    :param index_folder: Directory where the word index files are stored.
+    :param metadata_folder: Directory where the book metadata JSON files are stored.
+    :param book_folder: Directory where the book files are stored.
+    :param max_occurrences: Maximum number of paragraphs to return.
+    :param cache: An optional ShardCache for the metadata files.
+    :param highlight: Whether to highlight the search words with ANSI colors.
+    :param catalog: The metadata catalog loaded once for the query, see `load_books_catalog`.
+    :return: A dictionary with the book information, or None if the book has no metadata or no paragraphs.
+    """
+    # Load book metadata
+    with timed(QUERY_STAGE_SECONDS, engine=ENGINE_NAME, stage='metadata'):
+        metadata = load_metadata(book_id, metadata_folder, cache, catalog)
+    if not metadata:
+        logger.warning(f"Metadata for book ID '{book_id}' not found.")
+        return None
+
+    book_name = metadata["book_name"]
+    author_name = metadata["author"]
+    url = metadata["URL"]
+
+    # Locate the book file
+    book_filename = metadata.get("filename", f"{book_name} by {author_name}_{book_id}.txt")
+    book_path = os.path.join(book_folder, book_filename)
+
+    # Extract relevant paragraphs
+    with timed(QUERY_STAGE_SECONDS, engine=ENGINE_NAME, stage='snippet'):
+        paragraphs = extract_matched_paragraphs(book_path, book_id, index_folder, matches, words, max_occurrences,
+                                                highlight)
+    if not paragraphs:
+        return None
+    return {
+        "book_name": book_name,
+        "author_name": author_name,
+        "URL": url,
+        "paragraphs": paragraphs,
+        "total_occurrences": len(matches),
+        "score": score
+    }
+
+
+def query_engine(input_query, index_folder, metadata_folder, book_folder, max_occurrences=3, cache=None,
+                 top_k=10, result_cache=None, highlight=True, deadline=None, executor=None):
     """
-    Searches for books containing the words in the input query and returns relevant paragraphs.
+    Searches for books containing the words in the input query and returns the most relevant ones
+    with their relevant paragraphs.
+
+    Besides plain words, the query can contain phrases between double quotes and proximity
+    operators (`word NEAR/k word`). Books are ranked with BM25 from the postings and the document
+    lengths stored in the index, and only the best `top_k` are kept; phrases and NEAR operators are
+    only checked for books that can enter them. Book text is only read to extract the paragraphs
+    of the books returned.
 
     :param input_query: The search query (a string of words).
     :param index_folder: Directory where the word index files are stored.
     :param metadata_folder: Directory where the book metadata JSON files are stored.
     :param book_folder: Directory where the book files are stored.
     :param max_occurrences: Maximum number of paragraphs to return for each book.
-    :return: List of dictionaries with book information and paragraphs containing the search words.
+    :param cache: An optional ShardCache shared between queries, so repeated shards and metadata
+                  files are not read and parsed again.
+    :param top_k: Maximum number of books to return.
+    :param result_cache: An optional ResultCache. Queries that normalize to the same clauses with the same
+                         parameters are answered from it until the index publishes a new generation.
+    :param highlight: Whether to highlight the search words of the paragraphs with ANSI colors. Disable it
+                      for results that are not printed to a terminal.
+    :param deadline: Optional time limit of the query in seconds. When it is reached, the books whose
+                     paragraphs are not extracted yet are left out and the partial results are returned,
+                     without storing them in the result cache.
+    :param executor: The pool where the books are read, one task per book. Defaults to `snippet_executor`.
+    :return: List of dictionaries with book information, score and paragraphs containing the search words,
+             from the most to the least relevant.
+    """
+    results, _ = search_books(input_query, index_folder, metadata_folder, book_folder, max_occurrences, cache,
+                              top_k, result_cache, highlight, deadline, executor)
+    return results
+
+
+def search_books(input_query, index_folder, metadata_folder, book_folder, max_occurrences=3, cache=None,
+                 top_k=10, result_cache=None, highlight=True, deadline=None, executor=None, catalog=None,
+                 doc_lengths=None):
     """
-    input_query = input_query.lower()
-    words = input_query.split()
+    Run a query, see `query_engine`.
+
+    :param catalog: The metadata catalog, for callers that keep it loaded. Loaded per query if not given.
+    :param doc_lengths: The document lengths of the index, for callers that keep them loaded.
+                        Loaded per query if not given.
+    :return: A tuple with the results and whether they are complete, False if the deadline was reached.
+    """
+    start = time.perf_counter()
+
+    if result_cache is not None:
+        generation = read_generation(index_folder)
+        key = result_cache.key(input_query, index_folder=index_folder, metadata_folder=metadata_folder,
+                               book_folder=book_folder, max_occurrences=max_occurrences, top_k=top_k,
+                               highlight=highlight)
+        results = result_cache.get(key, generation)
+        if results is not None:
+            return results, True
+
+        remaining = None if deadline is None else deadline - (time.perf_counter() - start)
+        results, complete = search_books(input_query, index_folder, metadata_folder, book_folder,
+                                         max_occurrences, cache, top_k, highlight=highlight, deadline=remaining,
+                                         executor=executor, catalog=catalog, doc_lengths=doc_lengths)
+        if complete:
+            result_cache.put(key, generation, results)
+        return results, complete
+
+    clauses = parse_query(input_query)
+    words = query_words(clauses)
     results = []
 
     # Dictionary to store word occurrences across books
     word_occurrences = {}
 
+    increment('queries_total', engine=ENGINE_NAME)
+    timer = StageTimer(QUERY_STAGE_SECONDS, engine=ENGINE_NAME)
+
     # Step 1: Load word indices for all search words
     for word in words:
-        index_data = load_json_index(word, index_folder)
-        if word in index_data:
-            word_occurrences[word] = index_data[word]
-        else:
-            print(f"Word '{word}' not found in any index.")
-            return []  # Exit early if any word is missing
-
-    # Step 2: Find common books that contain all the search words
-    common_books = None
-    for word, occurrences in word_occurrences.items():
-        if common_books is None:
-            common_books = set(occurrences.keys())
+        with timer.stage('shard_load'):
+            postings = load_word_postings(word, index_folder, cache)
+        if postings is not None:
+            word_occurrences[word] = postings
         else:
-            common_books &= set(occurrences.keys())
-    # Step 3: Process each book that contains all the words
-    if common_books:
-        for book_id in common_books:
-            # Step 4: Load book metadata
-            metadata = load_metadata(book_id, metadata_folder)
-            if not metadata:
-                print(f"Metadata for book ID '{book_id}' not found.")
-                continue
-
-            book_name = metadata["book_name"]
-            author_name = metadata["author"]
-            url = metadata["URL"]
-
-            # Step 5: Load the book content
-            book_path = os.path.join(book_folder, f"{book_name} by {author_name}_{book_id}.txt")
-
-            # Step 6: Extract relevant paragraphs
-            paragraphs, occurrences = extract_paragraphs(book_path, words)
-            if paragraphs:
-                results.append({
-                    "book_name": book_name,
-                    "author_name": author_name,
-                    "URL": url,
-                    "paragraphs": paragraphs[:max_occurrences],
-                    "total_occurrences": occurrences
-                })
+            logger.info(f"Word '{word}' not found in any index.")
+            timer.observe()
+            observe('query_seconds', time.perf_counter() - start, engine=ENGINE_NAME)
+            return [], True  # Exit early if any word is missing
 
-    return results
+    # Step 2: Rank the books that contain every word, checking the clauses only for the ones that can make it
+    book_matches = {}
+
+    def satisfies_clauses(book_id):
+        book_matches[book_id] = match_book(clauses, word_occurrences, book_id)
+        return book_matches[book_id] is not None
+
+    if doc_lengths is None:
+        doc_lengths = load_index_doc_lengths(index_folder, cache)
+    with timer.stage('intersect'):
+        ranking = top_k_books(word_occurrences, doc_lengths, top_k, satisfies_clauses)
+    timer.observe()
+
+    # Step 3: Build the result of each book of the top k in the pool, keeping the ranking order.
+    # The catalog is parsed once here rather than by every task, which matters when there is no cache.
+    if catalog is None and ranking:
+        catalog = load_books_catalog(metadata_folder, cache)
+    executor = executor or snippet_executor
+    futures = [executor.submit(build_result, score, book_id, book_matches[book_id], words, index_folder,
+                               metadata_folder, book_folder, max_occurrences, cache, highlight, catalog)
+               for score, book_id in ranking]
+
+    timeout = None if deadline is None else max(0.0, deadline - (time.perf_counter() - start))
+    _, not_done = wait(futures, timeout=timeout)
+    for future in not_done:
+        future.cancel()
+    if not_done:
+        logger.warning(f"Query deadline reached: {len(not_done)} of {len(futures)} books left out.")
+        increment('query_deadlines_reached_total', engine=ENGINE_NAME)
+
+    for future in futures:
+        if future not in not_done:
+            result = future.result()
+            if result is not None:
+                results.append(result)
 
-# uncomment if doing memory usage tests
-# indexer_folder = "../Words_Datamart_Dict"
-# metadata_datamart_folder = "../Books_Metadata_Dict"
-# book_datamart_folder = "../Books_Datamart"
-# query_engine("wife", indexer_folder, metadata_datamart_folder, book_datamart_folder)
+    observe('query_seconds', time.perf_counter() - start, engine=ENGINE_NAME)
+    return results, not not_done
@@ -0,0 +1,91 @@
+import heapq
+import math
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def bm25_idf(document_frequency, num_books):
+    """
+    Compute the inverse document frequency of a word, as in BM25.
+
+    :param document_frequency: The number of books containing the word.
+    :param num_books: The number of books in the index.
+    :return: The IDF, always positive.
+    """
+    return math.log(1 + (num_books - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+def bm25_term_score(term_frequency, doc_length, idf, average_length, k1=BM25_K1, b=BM25_B):
+    """
+    Compute the contribution of a word to the BM25 score of a book.
+
+    :param term_frequency: The number of times the word appears in the book.
+    :param doc_length: The number of words of the book.
+    :param idf: The IDF of the word.
+    :param average_length: The average number of words of the books in the index.
+    :param k1: Term frequency saturation.
+    :param b: Document length normalization.
+    :return: The score of the word in the book.
+    """
+    norm = k1 * (1 - b + b * doc_length / average_length)
+    return idf * term_frequency * (k1 + 1) / (term_frequency + norm)
+
+
+def top_k_books(word_postings, doc_lengths, k, accept=None, k1=BM25_K1, b=BM25_B):
+    """
+    Rank the books containing every query word with BM25 and keep the best `k` in a bounded heap.
+
+    Words are visited from the rarest to the most common, and the books of the rarest one drive the
+    search. Every word has an upper bound of its score (its highest term frequency in the shortest book),
+    so as soon as the score of a book plus the bounds of its remaining words cannot beat the worst book
+    in the heap, the book is skipped without looking up the rest of its words (max-score pruning).
+
+    :param word_postings: A dictionary mapping each query word to its postings ({book key: [positions]}).
+    :param doc_lengths: A dictionary mapping book keys to their number of words. When a book is
+                        missing, it is taken as a book of average length.
+    :param k: The maximum number of books to return.
+    :param accept: An optional function called only for books that would enter the top `k`, with the
+                   book key. Returning False discards the book (used to check phrases and NEAR).
+    :param k1: Term frequency saturation.
+    :param b: Document length normalization.
+    :return: A list of (score, book key) tuples, from the best to the worst.
+    """
+    if not word_postings or k <= 0:
+        return []
+
+    num_books = max(len(doc_lengths), max(len(postings) for postings in word_postings.values()))
+    average_length = sum(doc_lengths.values()) / len(doc_lengths) if doc_lengths else 1.0
+    shortest_length = min(doc_lengths.values()) if doc_lengths else average_length
+
+    words = sorted(word_postings, key=lambda word: len(word_postings[word]))
+    idfs = [bm25_idf(len(word_postings[word]), num_books) for word in words]
+    upper_bounds = [bm25_term_score(max(map(len, word_postings[word].values())), shortest_length, idf,
+                                    average_length, k1, b)
+                    for word, idf in zip(words, idfs)]
+    # remaining_bounds[i] is the best score the words from i onwards can add
+    remaining_bounds = [sum(upper_bounds[i:]) for i in range(len(words) + 1)]
+
+    heap = []
+    for book_key, positions in word_postings[words[0]].items():
+        doc_length = doc_lengths.get(book_key, average_length)
+        score = bm25_term_score(len(positions), doc_length, idfs[0], average_length, k1, b)
+
+        for i in range(1, len(words)):
+            if len(heap) == k and score + remaining_bounds[i] < heap[0][0]:
+                break
+            positions = word_postings[words[i]].get(book_key)
+            if positions is None:
+                break
+            score += bm25_term_score(len(positions), doc_length, idfs[i], average_length, k1, b)
+        else:
+            if len(heap) == k and (score, book_key) <= heap[0]:
+                continue
+            if accept is not None and not accept(book_key):
+                continue
+            if len(heap) < k:
+                heapq.heappush(heap, (score, book_key))
+            else:
+                heapq.heapreplace(heap, (score, book_key))
+
+    return sorted(heap, reverse=True)
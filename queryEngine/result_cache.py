@@ -0,0 +1,114 @@
+import json
+import os
+
+from queryEngine.lru_cache import LRUCache
+from queryEngine.phrase_query import parse_query
+
+
+def normalize_query(input_query):
+    """
+    Reduce a query to the clauses it is evaluated with, so queries that only differ in case,
+    punctuation, spacing or stopwords share their cached results.
+
+    :param input_query: The search query.
+    :return: A string with the parsed clauses.
+    """
+    return json.dumps(parse_query(input_query))
+
+
+class ResultCache(LRUCache):
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entries=None, persist_path=None):
+        """
+        Initialize a cache for the results of whole queries.
+
+        Results are kept serialized as JSON, which gives their exact size and a fresh copy on every hit.
+        Entries are evicted in least recently used order when their total size goes over `max_bytes`
+        or there are more than `max_entries` of them. Every entry remembers the index generation it
+        was computed with, and it is discarded when requested with another one.
+
+        :param max_bytes: Maximum total size of the cached results.
+        :param max_entries: Maximum number of entries. None means no limit.
+        :param persist_path: Optional JSON file where the cache is saved by `save` and loaded from here.
+        """
+        super().__init__(max_entries, max_bytes)
+        self.persist_path = persist_path
+
+        if persist_path is not None and os.path.exists(persist_path):
+            self.load()
+
+    @staticmethod
+    def key(input_query, **params):
+        """
+        Build the key of a query.
+
+        :param input_query: The search query.
+        :param params: Everything else the results depend on, such as folders and `max_occurrences`.
+        :return: A string key.
+        """
+        return json.dumps([normalize_query(input_query), params], sort_keys=True)
+
+    def get(self, key, generation):
+        """
+        Return the cached results of a query.
+
+        :param key: The key built by `key`.
+        :param generation: The current generation of the index.
+        :return: A copy of the results, or None if they are not cached for this generation.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] != generation:
+                self.remove(key)
+                self.invalidations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            serialized = entry[1]
+        return json.loads(serialized)
+
+    def put(self, key, generation, results):
+        """
+        Store the results of a query.
+
+        :param key: The key built by `key`.
+        :param generation: The generation of the index the results were computed with.
+        :param results: The results, made of JSON serializable values.
+        :return: None
+        """
+        serialized = json.dumps(results, ensure_ascii=False)
+        with self.lock:
+            self.insert(key, (generation, serialized, len(serialized)))
+
+    def save(self):
+        """
+        Save the entries to `persist_path`, replacing the file atomically. Does nothing without a path.
+
+        :return: None
+        """
+        if self.persist_path is None:
+            return
+        with self.lock:
+            entries = [[key, generation, serialized] for key, (generation, serialized, _) in self.entries.items()]
+
+        directory = os.path.dirname(self.persist_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = self.persist_path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump(entries, file, ensure_ascii=False)
+        os.replace(temporary_path, self.persist_path)
+
+    def load(self):
+        """
+        Load the entries saved in `persist_path`, in their least to most recently used order.
+
+        :return: None
+        """
+        with open(self.persist_path, 'r', encoding='utf-8') as file:
+            entries = json.load(file)
+        with self.lock:
+            for key, generation, serialized in entries:
+                self.insert(key, (generation, serialized, len(serialized)))
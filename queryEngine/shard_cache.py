@@ -0,0 +1,58 @@
+import os
+
+from queryEngine.lru_cache import LRUCache
+
+
+class ShardCache(LRUCache):
+    # The entry just loaded is kept even if it alone is over `max_bytes`
+    min_entries = 1
+
+    def __init__(self, max_entries=64, max_bytes=None):
+        """
+        Initialize a bounded cache for parsed index shards and metadata files.
+
+        Entries are evicted in least recently used order when there are more than `max_entries`
+        of them or when their total size goes over `max_bytes`. A whole file counts its size on disk,
+        and a value read from part of a file, such as the postings of one term, the size the caller
+        gives for it. An entry is invalidated when the modification time or size of its file changes,
+        or when it is requested with a different index generation.
+
+        :param max_entries: Maximum number of entries kept in memory.
+        :param max_bytes: Maximum total size of the entries. None means no limit.
+        """
+        super().__init__(max_entries, max_bytes)
+
+    def get(self, filepath, loader, key=None, generation=None, sizeof=None):
+        """
+        Return the parsed content of a file, calling `loader` only when it is not cached or is stale.
+
+        :param filepath: The path of the file the entry was parsed from.
+        :param loader: A function without arguments that parses the file.
+        :param key: The key of the entry. Defaults to `filepath`; use a tuple to cache several
+                    values read from the same file (for example, one per term).
+        :param generation: The index generation the caller expects. None skips the check.
+        :param sizeof: A function that returns the size in bytes of the value. Defaults to the size of the
+                       file, which only fits entries that hold the whole file.
+        :return: The value returned by `loader`, possibly from a previous call.
+        """
+        key = filepath if key is None else key
+        stat = os.stat(filepath)
+        signature = (stat.st_mtime_ns, stat.st_size, generation)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] == signature:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self.remove(key)
+                self.invalidations += 1
+            self.misses += 1
+
+        value = loader()
+        size = stat.st_size if sizeof is None else sizeof(value)
+
+        with self.lock:
+            self.insert(key, (signature, value, size))
+        return value
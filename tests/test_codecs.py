@@ -0,0 +1,80 @@
+from array import array
+
+from data_model.object_type.Word import Word
+from data_model.postings_codec import (decode_index, decode_term, encode_index, encode_term, lookup_term,
+                                       read_binary_index, read_positions, read_varint, write_binary_index,
+                                       write_positions, write_varint)
+from indexer.indexer_dict import compact_indexer
+
+INDEX = {
+    "whale": {"1": [0, 5, 300], "2": [7], "130": [1, 2, 3]},
+    "ahab": {"2": [128, 16384, 2 ** 31]},
+    "über": {"7": [0]}
+}
+
+
+def test_varint_round_trip():
+    buffer = bytearray()
+    values = [0, 1, 127, 128, 255, 16383, 16384, 2 ** 32 - 1, 2 ** 40]
+    for value in values:
+        write_varint(value, buffer)
+
+    offset = 0
+    for value in values:
+        decoded, offset = read_varint(buffer, offset)
+        assert decoded == value
+    assert offset == len(buffer)
+
+
+def test_positions_round_trip():
+    buffer = bytearray()
+    write_positions([40, 3, 3000000, 41], buffer)
+    positions, offset = read_positions(buffer, 0)
+    assert positions == [3, 40, 41, 3000000]
+    assert offset == len(buffer)
+
+
+def test_term_round_trip():
+    buffer = bytearray()
+    encode_term("whale", INDEX["whale"], buffer)
+    term, postings, offset = decode_term(memoryview(bytes(buffer)), 0)
+    assert term == "whale"
+    assert postings == INDEX["whale"]
+    assert offset == len(buffer)
+
+
+def test_index_round_trip():
+    assert decode_index(encode_index(INDEX)) == INDEX
+    assert decode_index(encode_index({})) == {}
+
+
+def test_binary_file_and_lookup(tmp_path):
+    filepath = str(tmp_path / "indexer_w.bin")
+    write_binary_index(INDEX, filepath)
+
+    assert read_binary_index(filepath) == INDEX
+    for term, postings in INDEX.items():
+        assert lookup_term(term, filepath) == postings
+    assert lookup_term("moby", filepath) is None
+
+
+def test_word_bytes_round_trip():
+    word = Word("whale", {1: array('I', [0, 5, 300]), 130: array('I', [2 ** 32 - 1])})
+    decoded = Word.from_bytes(word.to_bytes())
+    assert decoded.id_name == "whale"
+    assert {doc_id: list(positions) for doc_id, positions in decoded.dictionary.items()} == \
+        {1: [0, 5, 300], 130: [2 ** 32 - 1]}
+    assert decoded.to_bytes() == word.to_bytes()
+
+
+def test_word_dict_round_trip():
+    data = {"id_name": "ahab", "dictionary": {"Moby Dick by Herman Melville - 2701": [3, 9], "12": [1]}}
+    word = Word.from_dict(data)
+    assert word.to_dict() == {"id_name": "ahab", "dictionary": {"2701": [3, 9], "12": [1]}}
+    assert Word.from_dict(word.to_dict()).to_bytes() == word.to_bytes()
+
+
+def test_compact_indexer_drops_postings_without_book_id():
+    compacted = compact_indexer({"whale": {"": [1], "3": [2]}, "ahab": {"": [4]}})
+    assert {word: {doc_id: list(positions) for doc_id, positions in data.items()}
+            for word, data in compacted.items()} == {"whale": {3: [2]}}
@@ -0,0 +1,104 @@
+from indexer.analyzer import Analyzer
+from indexer.indexer import indexer5
+from queryEngine.phrase_query import evaluate_clauses, is_positional, match_clause, parse_query, query_words
+from queryEngine.query_engine import query_engine
+
+ANALYZER = Analyzer(stopwords=["the", "of", "a"])
+
+
+def book_postings(text):
+    """
+    :return: The positions of every word of a text, counted like the indexers do.
+    """
+    postings = {}
+    for position, word in enumerate(ANALYZER.analyze(text)):
+        postings.setdefault(word, []).append(position)
+    return postings
+
+
+def test_plain_words_are_separate_clauses():
+    clauses = parse_query("White WHALE", ANALYZER)
+    assert clauses == [{"words": ["white"], "gaps": []}, {"words": ["whale"], "gaps": []}]
+    assert not is_positional(clauses)
+
+
+def test_quoted_phrase_requires_consecutive_positions():
+    clauses = parse_query('"white whale"', ANALYZER)
+    assert clauses == [{"words": ["white", "whale"], "gaps": [(1, True)]}]
+    assert is_positional(clauses)
+
+    assert match_clause(clauses[0], book_postings("the great white whale")) == [(1, 2)]
+    assert match_clause(clauses[0], book_postings("whale white")) == []
+    assert match_clause(clauses[0], book_postings("white great whale")) == []
+
+
+def test_stopwords_inside_a_phrase_take_no_position():
+    clauses = parse_query('"moby of the dick"', ANALYZER)
+    assert clauses == [{"words": ["moby", "dick"], "gaps": [(1, True)]}]
+    assert match_clause(clauses[0], book_postings("moby the dick")) == [(0, 1)]
+
+
+def test_near_matches_both_directions():
+    clause, = parse_query("ahab NEAR/2 whale", ANALYZER)
+    assert clause == {"words": ["ahab", "whale"], "gaps": [(2, False)]}
+
+    assert match_clause(clause, book_postings("ahab hated whale")) == [(0, 2)]
+    assert match_clause(clause, book_postings("whale hated ahab")) == [(2, 0)]
+    assert match_clause(clause, book_postings("ahab hated that whale")) == []
+
+
+def test_near_chain_joins_phrases():
+    clause, = parse_query('"captain ahab" NEAR/1 whale', ANALYZER)
+    assert clause == {"words": ["captain", "ahab", "whale"], "gaps": [(1, True), (1, False)]}
+    assert match_clause(clause, book_postings("whale captain ahab")) == []
+    assert match_clause(clause, book_postings("captain ahab whale")) == [(0, 1, 2)]
+
+
+def test_repeated_words_keep_their_positions():
+    clause, = parse_query('"dog cat dog"', ANALYZER)
+    assert clause["words"] == ["dog", "cat", "dog"]
+    assert query_words([clause]) == ["dog", "cat"]
+
+    assert match_clause(clause, book_postings("dog cat dog")) == [(0, 1, 2)]
+    assert match_clause(clause, book_postings("dog cat cat")) == []
+
+
+def test_repeated_word_near_itself_needs_two_occurrences():
+    clause, = parse_query("dog NEAR/3 dog", ANALYZER)
+    assert match_clause(clause, book_postings("dog cat bird")) == []
+    assert match_clause(clause, book_postings("dog cat dog"))
+
+
+def test_evaluate_clauses_keeps_books_matching_every_clause():
+    books = {"1": "white whale swims", "2": "whale white swims", "3": "white whale"}
+    clauses = parse_query('"white whale" swims', ANALYZER)
+    word_postings = {}
+    for book_key, text in books.items():
+        for word, positions in book_postings(text).items():
+            word_postings.setdefault(word, {})[book_key] = positions
+    word_postings = {word: word_postings[word] for word in query_words(clauses)}
+
+    assert evaluate_clauses(clauses, word_postings) == {"1": [(0, 1), (2,)]}
+
+
+def test_query_of_stopwords_has_no_clauses():
+    assert parse_query("the of a", ANALYZER) == []
+
+
+def test_query_engine_returns_the_paragraphs_of_the_matches(tmp_path):
+    books = tmp_path / "books"
+    books.mkdir()
+    (books / "Moby Dick by Herman Melville_2701.txt").write_text(
+        "Ahab hated the whale.\n\nThe great white whale rose.\n\nA dog and a bird.\n\nDog cat dog again.\n",
+        encoding="utf-8")
+    indexer5(str(books), str(tmp_path / "words"))
+
+    def paragraphs(input_query):
+        results = query_engine(input_query, str(books), str(tmp_path / "words"))
+        return [paragraph.replace("\033[94m", "").replace("\033[0m", "") for result in results
+                for paragraph in result["paragraphs"]]
+
+    assert paragraphs('"white whale"') == ["The great white whale rose."]
+    assert paragraphs("whale NEAR/3 ahab") == ["Ahab hated the whale."]
+    # A query without operators is a phrase that keeps its repeated words
+    assert paragraphs("dog cat dog") == ["Dog cat dog again."]
@@ -0,0 +1,69 @@
+import random
+
+from queryEngine.ranking import bm25_idf, bm25_term_score, top_k_books
+
+
+def exhaustive_top_k(word_postings, doc_lengths, k, accept=None):
+    """
+    :return: The best `k` books scoring every book that contains all the words, without pruning.
+    """
+    num_books = max(len(doc_lengths), max(len(postings) for postings in word_postings.values()))
+    average_length = sum(doc_lengths.values()) / len(doc_lengths)
+    # Same word order as top_k_books, so that equal scores add up to the same floats
+    words = sorted(word_postings, key=lambda word: len(word_postings[word]))
+    scores = []
+    for book_key in set.intersection(*(set(word_postings[word]) for word in words)):
+        if accept is not None and not accept(book_key):
+            continue
+        score = sum(bm25_term_score(len(word_postings[word][book_key]), doc_lengths[book_key],
+                                    bm25_idf(len(word_postings[word]), num_books), average_length)
+                    for word in words)
+        scores.append((score, book_key))
+    return sorted(scores, reverse=True)[:k]
+
+
+def random_corpus(rng):
+    """
+    :return: The postings of a few query words and the lengths of a small random corpus. Lengths and term
+             frequencies come from small ranges, so many books tie.
+    """
+    num_books = rng.randint(1, 30)
+    doc_lengths = {str(book_id): rng.choice([50, 100, 200]) for book_id in range(num_books)}
+    word_postings = {}
+    for word in ["whale", "ahab", "sea", "ship"][:rng.randint(1, 4)]:
+        books = rng.sample(sorted(doc_lengths), rng.randint(1, num_books))
+        word_postings[word] = {book_key: list(range(rng.randint(1, 3))) for book_key in books}
+    return word_postings, doc_lengths
+
+
+def test_pruned_top_k_matches_exhaustive_ranking():
+    rng = random.Random(42)
+    for _ in range(300):
+        word_postings, doc_lengths = random_corpus(rng)
+        k = rng.randint(1, 40)
+        assert top_k_books(word_postings, doc_lengths, k) == exhaustive_top_k(word_postings, doc_lengths, k)
+
+
+def test_pruned_top_k_matches_exhaustive_ranking_with_accept():
+    def accept(book_key):
+        return int(book_key) % 3 != 0
+
+    rng = random.Random(7)
+    for _ in range(300):
+        word_postings, doc_lengths = random_corpus(rng)
+        k = rng.randint(1, 10)
+        assert (top_k_books(word_postings, doc_lengths, k, accept) ==
+                exhaustive_top_k(word_postings, doc_lengths, k, accept))
+
+
+def test_ties_are_broken_by_book_key():
+    word_postings = {"whale": {"1": [0], "2": [0], "3": [0]}}
+    doc_lengths = {"1": 10, "2": 10, "3": 10}
+    assert [book_key for _, book_key in top_k_books(word_postings, doc_lengths, 2)] == ["3", "2"]
+
+
+def test_k_larger_than_the_hits_returns_every_hit():
+    word_postings = {"whale": {"1": [0, 5], "2": [3]}, "ahab": {"1": [1], "3": [2]}}
+    doc_lengths = {"1": 10, "2": 10, "3": 10}
+    assert [book_key for _, book_key in top_k_books(word_postings, doc_lengths, 10)] == ["1"]
+    assert top_k_books(word_postings, doc_lengths, 0) == []
@@ -0,0 +1,54 @@
+import os
+import shutil
+
+from benchmark.synthetic_corpus import generate_corpus
+from indexer.analyzer import STOPWORDS_FILEPATH, get_analyzer
+from indexer.indexer_dict import compact_segments, indexer_dict
+from indexer.segments import load_segments
+from queryEngine.query_engine_dict import query_engine
+
+
+def corpus_queries(books):
+    """
+    :return: Single word, multi-word, phrase and NEAR queries built from the words of a book.
+    """
+    filename = sorted(os.listdir(books))[0]
+    with open(os.path.join(books, filename), encoding="utf-8") as file:
+        words = get_analyzer(STOPWORDS_FILEPATH).analyze(file.read())
+    middle = len(words) // 2
+    return [words[middle], f"{words[middle]} {words[-1]}", f'"{words[middle]} {words[middle + 1]}"',
+            f"{words[middle]} NEAR/3 {words[middle + 2]}", "zzzunknown"]
+
+
+def search(queries, books, words, metadata):
+    return [query_engine(query, str(words), str(metadata), str(books), highlight=False) for query in queries]
+
+
+def test_segmented_runs_and_compaction_match_a_full_rebuild(tmp_path):
+    generate_corpus(str(tmp_path / "corpus"), 8, words_per_book=300, vocabulary_size=1000)
+    filenames = sorted(filename for filename in os.listdir(tmp_path / "corpus") if filename.endswith(".txt"))
+    books, words, metadata = tmp_path / "books", tmp_path / "words", tmp_path / "metadata"
+    books.mkdir()
+
+    # Four runs of two new books each, then one that indexes a changed book again
+    for run in range(4):
+        for filename in filenames[2 * run:2 * run + 2]:
+            shutil.copy(tmp_path / "corpus" / filename, books)
+        indexer_dict(str(books), str(words), str(metadata), STOPWORDS_FILEPATH, index_format="binary",
+                     incremental=True, segmented=True)
+    with open(books / filenames[0], "a", encoding="utf-8") as file:
+        file.write("\n\nzzzunknown appended to the changed book.\n")
+    indexer_dict(str(books), str(words), str(metadata), STOPWORDS_FILEPATH, index_format="binary",
+                 incremental=True, segmented=True)
+    assert len(load_segments(str(words))["segments"]) == 5
+
+    rebuilt_words, rebuilt_metadata = tmp_path / "rebuilt_words", tmp_path / "rebuilt_metadata"
+    indexer_dict(str(books), str(rebuilt_words), str(rebuilt_metadata), STOPWORDS_FILEPATH, index_format="binary")
+    queries = corpus_queries(books)
+    expected = search(queries, books, rebuilt_words, rebuilt_metadata)
+    assert any(expected)
+
+    assert search(queries, books, words, metadata) == expected
+    compact_segments(str(words))
+    assert len(load_segments(str(words))["segments"]) < 5
+    assert search(queries, books, words, metadata) == expected